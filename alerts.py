@@ -0,0 +1,136 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+from array import array
+
+class Rule(object):
+    '''one alert: whether it is raised, since when, and the value that raised it'''
+
+    def __init__(self, name):
+        self.name = name
+        self.active = False
+        self.since = 0
+        self.raised = 0     # times it went off
+        self.value = 0.0
+
+
+class Detector(object):
+    '''Leak and anomaly rules, evaluated as pulses are counted.
+
+    continuous: water has flowed, with no gap longer than gap_s, for
+        flow_minutes or more, eg. a stuck valve or a running toilet.
+    quiet: at least quiet_litres flowed during the quiet hours, given as
+        (start, end) hours of the day in the meter's time, which is UTC.
+    hourly: the volume so far this hour is above factor times the usual
+        volume for this hour of the day, and above min_litres. The usual
+        volume is a moving average per hour of the day, kept in RAM and
+        used once it has seen warmup days.
+
+    update() takes each batch of pulses and check() notices flow
+    stopping; neither looks at past data, and each rule keeps a fixed
+    amount of state. changed is set when any rule goes on or off.
+    '''
+
+    def __init__(self, flow_minutes=60, gap_s=120, quiet=None, quiet_litres=1.0,
+                 factor=3.0, min_litres=20.0, alpha=0.25, warmup=3):
+        self.flow_minutes = flow_minutes
+        self.gap_s = gap_s
+        self.quiet = quiet
+        self.quiet_litres = quiet_litres
+        self.factor = factor
+        self.min_litres = min_litres
+        self.alpha = alpha
+        self.warmup = warmup
+        self.continuous = Rule('continuous')
+        self.quiet_flow = Rule('quiet')
+        self.hourly = Rule('hourly')
+        self.rules = (self.continuous, self.quiet_flow, self.hourly)
+        self.changed = False
+        self._start = None      # start of the current run of flow
+        self._last = None       # time of the last pulses
+        self._quiet_l = 0.0     # litres in the current quiet period
+        self._hour = None       # hours since the epoch being summed
+        self._hour_l = 0.0
+        self._base = array('f', [0.0] * 24)   # usual litres per hour of day
+        self._days = bytearray(24)            # days seen per hour of day
+
+    def _set(self, r, on, t, value):
+        r.value = value
+        if on != r.active:
+            r.active = on
+            self.changed = True
+            if on:
+                r.since = t
+                r.raised += 1
+
+    def in_quiet(self, t):
+        if not self.quiet:
+            return False
+        h = t % 86400 // 3600
+        a, b = self.quiet
+        if a <= b:
+            return a <= h < b
+        return h >= a or h < b
+
+    def _fold(self, h, litres):
+        if self._days[h] == 0:
+            self._base[h] = litres
+        else:
+            self._base[h] += self.alpha * (litres - self._base[h])
+        if self._days[h] < 255:
+            self._days[h] += 1
+
+    def _roll(self, t):
+        # fold finished hours, including any with no flow at all, into the
+        # baseline for their hour of the day
+        hr = t // 3600
+        if self._hour is None:
+            self._hour = hr
+            return
+        if hr == self._hour:
+            return
+        self._fold(self._hour % 24, self._hour_l)
+        for i in range(self._hour + 1, min(hr, self._hour + 25)):
+            self._fold(i % 24, 0.0)
+        self._hour = hr
+        self._hour_l = 0.0
+        self._set(self.hourly, False, 0, 0.0)
+
+    def update(self, litres, t):
+        '''account for litres measured at time t'''
+        if self._last is None or t - self._last > self.gap_s:
+            self._start = t
+        self._last = t
+        d = t - self._start
+        self._set(self.continuous, d >= self.flow_minutes * 60, self._start, d / 60)
+
+        if self.in_quiet(t):
+            self._quiet_l += litres
+            self._set(self.quiet_flow, self._quiet_l >= self.quiet_litres, t, self._quiet_l)
+
+        self._roll(t)
+        self._hour_l += litres
+        h = t % 86400 // 3600
+        limit = max(self._base[h] * self.factor, self.min_litres)
+        self._set(self.hourly, self._days[h] >= self.warmup and self._hour_l > limit,
+            t, self._hour_l)
+
+    def check(self, t):
+        '''re-evaluate with no new pulses'''
+        if self._last is not None and t - self._last > self.gap_s:
+            self._last = None
+            self._set(self.continuous, False, 0, 0.0)
+        elif self._last is not None:
+            # in case the settings changed
+            d = self._last - self._start
+            self._set(self.continuous, d >= self.flow_minutes * 60, self._start, d / 60)
+        if not self.in_quiet(t):
+            self._quiet_l = 0.0
+            self._set(self.quiet_flow, False, 0, 0.0)
+        self._roll(t)
+
+    def baseline(self, h):
+        '''usual litres in hour h of the day, None while warming up'''
+        return self._base[h] if self._days[h] >= self.warmup else None
+
+    def summary(self):
+        '''names of the active alerts, comma separated'''
+        return ','.join([r.name for r in self.rules if r.active])
@@ -0,0 +1,82 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import time
+
+PRIO_PERSIST = 0
+PRIO_DISPLAY = 1
+
+class Arbiter(object):
+    '''Serialize jobs on a shared I2C bus.
+
+    A job is a function that does one or more transfers, eg. a state save
+    or an OLED refresh. If the bus is free the job runs at once. If another
+    job holds it, which happens when a timer callback fires in the middle of
+    a multi-transfer sequence, the new job is queued and run when the
+    holder releases the bus, lowest priority number first. A queued job
+    replaces an older one with the same name, so back-to-back display
+    refreshes collapse into one.
+
+    Bus time is accounted per device in stats, dev -> [runs, total us,
+    max us, times queued], where dev is what the job talks to. Jobs that
+    name no device are accounted under their own name.
+    '''
+
+    PERSIST = PRIO_PERSIST
+    DISPLAY = PRIO_DISPLAY
+
+    def __init__(self):
+        self._holder = None
+        self._queue = []    # [prio, name, fn, dev]
+        self.stats = {}
+
+    def _stat(self, dev):
+        s = self.stats.get(dev)
+        if s is None:
+            s = self.stats[dev] = [0, 0, 0, 0]
+        return s
+
+    def _run(self, name, fn, dev):
+        self._holder = name
+        t0 = time.ticks_us()
+        try:
+            fn()
+        finally:
+            dt = time.ticks_diff(time.ticks_us(), t0)
+            s = self._stat(dev)
+            s[0] += 1
+            s[1] += dt
+            if dt > s[2]:
+                s[2] = dt
+
+    def submit(self, name, prio, fn, dev=None):
+        '''run fn now if the bus is free, else queue it. True if it ran.'''
+        if dev is None:
+            dev = name
+        if self._holder is not None:
+            self._stat(dev)[3] += 1
+            for q in self._queue:
+                if q[1] == name:
+                    q[0] = prio
+                    q[2] = fn
+                    q[3] = dev
+                    return False
+            self._queue.append([prio, name, fn, dev])
+            return False
+
+        try:
+            self._run(name, fn, dev)
+            # drain whatever arrived while we held the bus. The bus stays
+            # held so that jobs arriving now are queued behind these.
+            while self._queue:
+                best = 0
+                for i in range(1, len(self._queue)):
+                    if self._queue[i][0] < self._queue[best][0]:
+                        best = i
+                _, qname, qfn, qdev = self._queue.pop(best)
+                self._run(qname, qfn, qdev)
+        finally:
+            self._holder = None
+        return True
+
+    @property
+    def busy(self):
+        return self._holder is not None
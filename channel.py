@@ -0,0 +1,41 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+from flow import FlowRate
+from debounce import EdgeFilter
+
+class Channel(object):
+    '''One additional flow sensor.
+
+    Channel 0 is the meter watermeter.py always had. Each further channel
+    has its own input pin, edge filter, pulse counter, flow estimate and a
+    state record, including its calibration, in its own DB_generic
+    backend. Pulses reach it through the shared ISR ring, tagged with the
+    channel number.
+    '''
+
+    def __init__(self, n, gpio, dbh):
+        self.n = n
+        self.gpio = gpio
+        self.dbh = dbh
+        self.filter = EdgeFilter()
+        self.flow = FlowRate()
+        self.state = None
+        self.pulses = 0
+
+    def load(self):
+        self.state = self.dbh.load()
+        self.pulses = self.state['usage']
+
+    def dirty(self):
+        return self.pulses != self.state['usage']
+
+    def save(self, now=None):
+        self.state['usage'] = self.pulses
+        self.dbh.save(self.state, now)
+
+    def pulse(self, t_us):
+        '''count one pulse that arrived at ticks_us() t_us'''
+        self.pulses += 1
+        self.flow.update(t_us)
+
+    def litres(self):
+        return self.pulses * self.state['ml_per_pulse'] / 1000.0
@@ -0,0 +1,133 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import time
+import usocket as socket
+import ustruct
+
+NTP_DELTA = 3155673600  # 1900-01-01 to 2000-01-01, the MicroPython epoch
+# MicroPython's epoch is 2000-01-01, collectors and API clients expect the
+# unix epoch
+EPOCH_OFFSET = 946684800
+
+def sntp(host='pool.ntp.org', timeout=1):
+    '''ask an NTP server for the time, in ms since the epoch'''
+    addr = socket.getaddrinfo(host, 123)[0][-1]
+    q = bytearray(48)
+    q[0] = 0x1b     # version 3, client
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.settimeout(timeout)
+        t0 = time.ticks_ms()
+        s.sendto(q, addr)
+        msg = s.recv(48)
+        rtt = time.ticks_diff(time.ticks_ms(), t0)
+    finally:
+        s.close()
+    sec, frac = ustruct.unpack_from('!II', msg, 40)
+    if sec == 0:
+        raise OSError('bad NTP reply')
+    # the reply was sent about half way through the round trip
+    return (sec - NTP_DELTA) * 1000 + (frac * 1000 >> 32) + rtt // 2
+
+
+class Clock(object):
+    '''Monotonic wall clock kept from ticks_ms() and disciplined by NTP.
+
+    The ESP8266 RTC drifts badly, and setting it steps the time, which can
+    make intervals measured with it skip or repeat. This clock counts
+    ticks_ms() instead, corrected by a rate in ppm estimated from
+    successive NTP samples. An offset from NTP is slewed out at no more
+    than max_slew_ppm, so the time never goes backwards; only an offset
+    above step_ms, eg. at boot, is stepped. Once the rate estimate is
+    steady NTP is queried less often, up to max_interval seconds apart.
+    '''
+
+    def __init__(self, t=0, step_ms=10000, max_slew_ppm=500,
+                 min_interval=300, max_interval=4 * 3600):
+        self._base_ticks = time.ticks_ms()
+        self._base_ms = int(t) * 1000   # clock time at _base_ticks
+        self._raw_ms = 0                # uncorrected ms counted so far
+        self._slew_ms = 0               # offset still to be slewed out
+        self.ppm = 0                    # rate correction
+        self.rated = False              # ppm has been measured
+        self.step_ms = step_ms
+        self.max_slew_ppm = max_slew_ppm
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval    # seconds until the next NTP query
+        self.synced = False
+        self.steps = 0
+        self.samples = 0
+        self.last_offset_ms = 0
+        self._next = 0                  # _raw_ms of the next NTP query
+        self._sample = None             # (_raw_ms, NTP ms) of the last query
+
+    def _advance(self, commit):
+        raw = time.ticks_diff(time.ticks_ms(), self._base_ticks)
+        t = self._base_ms + raw + raw * self.ppm // 1000000
+        s = raw * self.max_slew_ppm // 1000000
+        s = max(-s, min(s, self._slew_ms))
+        if commit:
+            self._base_ticks = time.ticks_add(self._base_ticks, raw)
+            self._base_ms = t + s
+            self._raw_ms += raw
+            self._slew_ms -= s
+        return t + s
+
+    def ms(self):
+        '''milliseconds since the epoch'''
+        # re-anchor well within the ticks_ms() wrap around
+        if time.ticks_diff(time.ticks_ms(), self._base_ticks) > 3600000:
+            return self._advance(True)
+        return self._advance(False)
+
+    def time(self):
+        '''seconds since the epoch, like time.time()'''
+        return self.ms() // 1000
+
+    def localtime(self, t=None):
+        return time.localtime(self.time() if t is None else t)
+
+    def set(self, t):
+        '''step to t seconds, eg. to a saved time before NTP is available'''
+        self._advance(True)
+        self._base_ms = int(t) * 1000
+        self._slew_ms = 0
+
+    def due(self):
+        '''True when it is time to ask NTP again'''
+        self._advance(True)
+        return self._raw_ms >= self._next
+
+    def sample(self, ntp_ms):
+        '''take an NTP reading: step or slew to it, and refine the rate'''
+        now = self._advance(True)
+        offset = ntp_ms - now
+        self.last_offset_ms = offset
+        self.samples += 1
+        steady = False
+        if not self.synced or abs(offset) > self.step_ms:
+            self._base_ms = ntp_ms
+            self._slew_ms = 0
+            self.steps += 1
+            self._sample = None
+        else:
+            self._slew_ms = offset
+            if self._sample is not None:
+                dr = self._raw_ms - self._sample[0]
+                if dr >= 600000:
+                    # rate against NTP over the raw ticks, not our
+                    # corrected time, so the estimate doesn't chase itself
+                    ppm = ((ntp_ms - self._sample[1]) - dr) * 1000000 // dr
+                    steady = self.rated and abs(ppm - self.ppm) < 5
+                    self.ppm = (self.ppm * 3 + ppm) // 4 if self.rated else ppm
+                    self.rated = True
+        self.synced = True
+        if self._sample is None or self._raw_ms - self._sample[0] >= 600000:
+            self._sample = (self._raw_ms, ntp_ms)
+
+        if steady and abs(offset) < 100:
+            self.interval = min(self.interval * 2, self.max_interval)
+        elif abs(offset) >= 1000:
+            self.interval = self.min_interval
+        self._next = self._raw_ms + self.interval * 1000
+        return offset
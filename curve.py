@@ -0,0 +1,51 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+from array import array
+from db import FLOAT32_MIN, FLOAT32_MAX
+
+class Curve(object):
+    '''Calibration as a function of pulse frequency.
+
+    Turbine sensors deliver noticeably more or less per pulse at low flow.
+    The calibration points (Hz, ml/pulse) are joined by straight lines,
+    and held level below the first and above the last point. The start,
+    value and slope of each segment are computed when the points are set,
+    so k() is a short scan and one multiply-add, with no division.
+    '''
+
+    def __init__(self, points):
+        self.points = sorted((float(h), float(k)) for h, k in points)
+        if not self.points:
+            raise ValueError('no calibration points')
+        p = self.points
+        n = len(p)
+        self._h = array('f', [h for h, _ in p])
+        self._k = array('f', [k for _, k in p])
+        self._m = array('f', [0.0] * n)
+        for i in range(n - 1):
+            dh = p[i + 1][0] - p[i][0]
+            if dh > 0:
+                self._m[i] = (p[i + 1][1] - p[i][1]) / dh
+
+    def k(self, hz):
+        '''ml per pulse at a pulse rate of hz'''
+        h = self._h
+        i = len(h) - 1
+        while i > 0 and hz < h[i]:
+            i -= 1
+        if hz <= h[0]:
+            return self._k[0]
+        return self._k[i] + self._m[i] * (hz - h[i])
+
+    @staticmethod
+    def parse(s):
+        '''points from "hz:ml,hz:ml,...", as /calibrate takes them'''
+        p = []
+        for pair in s.split(','):
+            h, _, k = pair.partition(':')
+            h = float(h)
+            k = float(k)
+            # nan fails every comparison, and the points are saved as float32
+            if not (0 <= h <= FLOAT32_MAX and FLOAT32_MIN <= k <= FLOAT32_MAX):
+                raise ValueError('bad calibration point')
+            p.append((h, k))
+        return p
@@ -0,0 +1,99 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import time
+try:
+    from time import ticks_diff
+except ImportError:
+    # CPython, for replay(): host timestamps don't wrap
+    def ticks_diff(a, b):
+        return a - b
+
+class EdgeFilter(object):
+    '''Reject edges that can't be real pulses.
+
+    An edge is rejected if it comes less than holdoff_us after the last
+    accepted edge, which catches ringing on long cables, or if the interval
+    is shorter than 1/ratio of the recent typical interval, which catches
+    spikes from nearby pumps at low flow. The flow really speeding up looks
+    the same for a moment, so after max_rejects outliers in a row the
+    filter accepts and starts over at the new rate.
+
+    Both tests are off unless asked for: set too tight, they drop real
+    pulses at high flow, and many meters have clean enough signals.
+
+    accept() runs in the hard IRQ: it only does small int arithmetic on
+    attributes that already exist, and never allocates.
+    '''
+
+    def __init__(self, holdoff_us=0, ratio=0, max_rejects=3, timeout_us=2_000_000):
+        self.holdoff_us = holdoff_us    # 0 turns off the holdoff
+        self.ratio = ratio          # 0 turns off the outlier test
+        self.max_rejects = max_rejects
+        self.timeout_us = timeout_us
+        self.last_us = None         # time of the last accepted edge
+        self.ref_us = 0             # typical interval, 0 when unknown
+        self.run = 0                # outliers rejected in a row
+        self.rejected = 0
+
+    def accept(self, t_us):
+        '''True if the edge at t_us should be counted'''
+        if self.last_us is None:
+            self.last_us = t_us
+            return True
+        dt = ticks_diff(t_us, self.last_us)
+        if dt < self.holdoff_us:
+            self.rejected += 1
+            return False
+        if dt > self.timeout_us:
+            # flow had stopped, there is no rate to compare against
+            self.ref_us = 0
+        elif self.ref_us and self.ratio and dt * self.ratio < self.ref_us:
+            if self.run < self.max_rejects:
+                self.run += 1
+                self.rejected += 1
+                return False
+            self.ref_us = dt
+        elif self.ref_us:
+            self.ref_us += (dt - self.ref_us) >> 2
+        else:
+            self.ref_us = dt
+        self.run = 0
+        self.last_us = t_us
+        return True
+
+
+def replay(edges, holdoff_us=2000, ratio=4, max_rejects=3):
+    '''feed edge times in us through a filter, returning (accepted, rejected, ns per edge)'''
+    f = EdgeFilter(holdoff_us, ratio, max_rejects)
+    n = 0
+    if hasattr(time, 'perf_counter_ns'):
+        t0 = time.perf_counter_ns()
+        for t in edges:
+            if f.accept(t):
+                n += 1
+        dt = time.perf_counter_ns() - t0
+    else:
+        t0 = time.ticks_us()
+        for t in edges:
+            if f.accept(t):
+                n += 1
+        dt = time.ticks_diff(time.ticks_us(), t0) * 1000
+    return n, f.rejected, dt // max(len(edges), 1)
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description='replay recorded edge times through the pulse filter')
+    ap.add_argument('file', help='edge times in us, one per line')
+    ap.add_argument('--holdoff', type=int, action='append', help='hold-off in us, repeat to compare [2000]')
+    ap.add_argument('--ratio', type=int, default=4, help='outlier ratio, 0 to disable [%(default)s]')
+    ap.add_argument('--max-rejects', type=int, default=3, help='outliers in a row before following the new rate [%(default)s]')
+    args = ap.parse_args()
+    with open(args.file) as fd:
+        edges = [int(l.split()[0]) for l in fd if l.strip() and not l.startswith('#')]
+    print('{} edges'.format(len(edges)))
+    for h in args.holdoff or [2000]:
+        n, r, ns = replay(edges, h, args.ratio, args.max_rejects)
+        print('holdoff {} us, ratio {}: {} accepted, {} rejected, {} ns/edge'.format(h, args.ratio, n, r, ns))
+
+if __name__ == '__main__':
+    main()
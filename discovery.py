@@ -0,0 +1,118 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import usocket as socket
+import uselect as select
+
+def inet_pton(dottedquad):
+    a = list(map(int, dottedquad.strip().split('.')))
+    n = a[0]<<24 | a[1]<<16 | a[2]<<8 | a[3]
+    return n
+
+def inet_ntop(n):
+    a = [n>>24&0xff, n>>16&0xff, n>>8&0xff, n&0xff]
+    return '{:d}.{:d}.{:d}.{:d}'.format(*a)
+
+def calculate_broadcast(ip, nm):
+    return inet_ntop(inet_pton(ip) | (~inet_pton(nm) & 0xffffffff))
+
+
+class Discovery(object):
+    '''Device announcement and SSDP-style discovery on UDP port 1900, or
+    another port for testing.
+
+    One socket is kept open for both jobs. The announcement broadcast and
+    the M-SEARCH response are formatted only when the interface
+    configuration changes. Announcements start every min_interval seconds
+    and back off to max_interval; collectors that want an answer sooner
+    can send an M-SEARCH with ST set to ssdp:all or to Discovery.ST. A
+    status, such as active alerts, is appended to the announcement and
+    sent out promptly when it changes.
+    '''
+
+    ST = b'urn:ckuethe:device:watermeter:1'
+
+    def __init__(self, net, http_port=80, uuid='', min_interval=30, max_interval=900, port=1900):
+        self._net = net
+        self._http_port = http_port
+        self._port = port
+        self._uuid = uuid
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._interval = min_interval
+        self._next = 0
+        self._ifc = None
+        self._dst = None
+        self._adv = None
+        self._resp = None
+        self.status = ''
+        self.ip = None
+        self.announced = 0
+        self.answered = 0
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('0.0.0.0', port))
+        self._sock.setblocking(False)
+        self._poller = select.poll()
+        self._poller.register(self._sock, select.POLLIN)
+
+    def _refresh(self):
+        '''rebuild the packets if the interface configuration changed'''
+        i = self._net.ifconfig()
+        if i == self._ifc and self._adv is not None:
+            return
+        self._ifc = i
+        self.ip = i[0]
+        self._dst = (calculate_broadcast(i[0], i[1]), self._port)
+        url = 'http://{}:{}/'.format(i[0], self._http_port)
+        self._adv = 'watermeter running on http://{}'.format(i[0]).encode()
+        if self.status:
+            self._adv += b' alert=' + self.status.encode()
+        self._resp = ('HTTP/1.1 200 OK\r\n'
+            'CACHE-CONTROL: max-age={}\r\n'
+            'EXT:\r\n'
+            'LOCATION: {}\r\n'
+            'SERVER: MicroPython UPnP/1.1 watermeter/1\r\n'
+            'ST: {}\r\n'
+            'USN: uuid:{}::{}\r\n\r\n').format(self._max_interval * 2, url,
+                self.ST.decode(), self._uuid, self.ST.decode()).encode()
+        # new address, tell everyone promptly
+        self._interval = self._min_interval
+        self._next = 0
+
+    def _answer(self):
+        while self._poller.poll(0):
+            try:
+                data, addr = self._sock.recvfrom(512)
+            except OSError:
+                return
+            if data.startswith(b'M-SEARCH') and (self.ST in data or b'ssdp:all' in data):
+                try:
+                    self._sock.sendto(self._resp, addr)
+                    self.answered += 1
+                except OSError:
+                    pass
+
+    def set_status(self, status):
+        '''change the status announced, eg. "continuous,quiet" or ""'''
+        if status == self.status:
+            return
+        self.status = status
+        self._adv = None    # rebuilt, and announced, on the next poll
+
+    def poll(self, now):
+        '''answer pending queries, and announce if due. Returns True if announced.'''
+        self._refresh()
+        self._answer()
+        if now < self._next or self.ip == '0.0.0.0':
+            return False
+        self._next = now + self._interval
+        self._interval = min(self._interval * 2, self._max_interval)
+        try:
+            self._sock.sendto(self._adv, self._dst)
+        except OSError:
+            return False
+        self.announced += 1
+        return True
+
+    def close(self):
+        self._sock.close()
@@ -0,0 +1,82 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+def _char(s, i):
+    return s[i] if i < len(s) else ' '
+
+class Display(object):
+    '''Text rows on an SSD1306 that only send what changed.
+
+    Each 8 pixel text row is one display page. line() redraws only the
+    characters that differ from what the row showed before, and show()
+    sends just the changed column range of each changed page, instead of
+    the whole framebuffer like SSD1306.show() does.
+    '''
+
+    def __init__(self, oled):
+        self._oled = oled
+        self._width = oled.width
+        self._pages = oled.height // 8
+        self._buf = memoryview(oled.buffer)
+        self._rows = [''] * self._pages
+        self._x0 = [self._width] * self._pages   # dirty columns, x0 > x1 when clean
+        self._x1 = [-1] * self._pages
+        self.bytes_sent = 0
+        self.refreshes = 0
+
+    def line(self, row, s):
+        '''put string s on text row row'''
+        old = self._rows[row]
+        if s == old:
+            return
+        # only what fits on the display counts, and past the end of a
+        # string is as blank as a space
+        n = min(max(len(s), len(old)), self._width // 8)
+        i = 0
+        while i < n and _char(s, i) == _char(old, i):
+            i += 1
+        self._rows[row] = s
+        if i == n:
+            return
+        j = n - 1
+        while j > i and _char(s, j) == _char(old, j):
+            j -= 1
+        x0 = i * 8
+        x1 = (j + 1) * 8 - 1
+        self._oled.fill_rect(x0, row * 8, x1 - x0 + 1, 8, 0)
+        self._oled.text(s[i:j + 1], x0, row * 8)
+        self._x0[row] = min(self._x0[row], x0)
+        self._x1[row] = max(self._x1[row], x1)
+
+    def show(self):
+        '''send the changed parts of the framebuffer to the display'''
+        o = self._oled
+        for p in range(self._pages):
+            x0 = self._x0[p]
+            x1 = self._x1[p]
+            if x0 > x1:
+                continue
+            o.write_cmd(SET_COL_ADDR)
+            o.write_cmd(x0)
+            o.write_cmd(x1)
+            o.write_cmd(SET_PAGE_ADDR)
+            o.write_cmd(p)
+            o.write_cmd(p)
+            a = p * self._width
+            o.write_data(self._buf[a + x0:a + x1 + 1])
+            self.bytes_sent += x1 - x0 + 1
+            self._x0[p] = self._width
+            self._x1[p] = -1
+        self.refreshes += 1
+
+    def clear(self):
+        '''blank the display, eg. after something else drew on it'''
+        self._oled.fill(0)
+        self._oled.show()
+        self.bytes_sent += len(self._buf)
+        for p in range(self._pages):
+            self._rows[p] = ''
+            self._x0[p] = self._width
+            self._x1[p] = -1
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''
+Poll a fleet of watermeters and merge their usage into one stream.
+
+This runs on a host with CPython 3, not on the ESP8266. Meters are found
+from their UDP announcements on port 1900 and an SSDP M-SEARCH, then
+polled concurrently over kept-alive connections. Each poll sends the last
+ETag seen, so meters with no new pulses answer with an empty 304.
+'''
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import sys
+import time
+
+GAL_TO_L = 3.78541
+
+# the meter's volume in litres, whatever unit it displays. With a
+# calibration curve it isn't simply pulses times k, so take the meter's word.
+def litres(d):
+    v = d['volume']
+    return v * GAL_TO_L if d.get('unit') == 'gal' else v
+
+ADV_RE = re.compile(rb'watermeter running on (http://[0-9.]+(?::\d+)?)')
+LOCATION_RE = re.compile(rb'LOCATION: *(http://[0-9.]+(?::\d+)?)', re.I)
+ST = b'urn:ckuethe:device:watermeter:1'
+MSEARCH = (b'M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\n'
+           b'MAN: "ssdp:discover"\r\nMX: 1\r\nST: ' + ST + b'\r\n\r\n')
+
+
+class Listener(asyncio.DatagramProtocol):
+    '''collect meter URLs from announcements and M-SEARCH responses'''
+
+    def __init__(self, found):
+        self.found = found
+
+    def datagram_received(self, data, addr):
+        m = ADV_RE.search(data) or LOCATION_RE.search(data)
+        if m:
+            url = m.group(1).decode().rstrip('/')
+            if ':' not in url[7:]:
+                url += ':80'
+            self.found.add(url)
+
+
+async def discover(found, port=1900):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.bind(('', port))
+    transport, _ = await loop.create_datagram_endpoint(lambda: Listener(found), sock=sock)
+    transport.sendto(MSEARCH, ('255.255.255.255', 1900))
+    return transport
+
+
+class Meter(object):
+    '''one kept-alive connection to a meter'''
+
+    def __init__(self, url):
+        self.url = url
+        self.host, port = url[7:].split(':')
+        self.port = int(port)
+        self.etag = None
+        self.reader = None
+        self.writer = None
+        self.polls = 0
+        self.unchanged = 0
+        self.errors = 0
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def _request(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        h = 'GET /usage HTTP/1.1\r\nHost: {}\r\n'.format(self.host)
+        if self.etag:
+            h += 'If-None-Match: {}\r\n'.format(self.etag)
+        self.writer.write((h + '\r\n').encode())
+
+        status = (await self.reader.readline()).split()
+        if len(status) < 2:
+            raise ConnectionError('connection closed')
+        length = None
+        keep = status[0] == b'HTTP/1.1'
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            k, _, v = line.decode().partition(':')
+            k = k.strip().lower()
+            if k == 'content-length':
+                length = int(v)
+            elif k == 'etag':
+                self.etag = v.strip()
+            elif k == 'connection':
+                keep = v.strip().lower() == 'keep-alive'
+        if length is None:
+            body = await self.reader.read()
+            keep = False
+        else:
+            body = await self.reader.readexactly(length)
+        if not keep:
+            self.close()
+        return status[1], body
+
+    async def poll(self):
+        '''return the usage report, or None if it hasn't changed'''
+        self.polls += 1
+        try:
+            code, body = await self._request()
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.errors += 1
+            self.close()
+            return None
+        if code == b'304':
+            self.unchanged += 1
+            return None
+        if code != b'200':
+            self.errors += 1
+            return None
+        return json.loads(body)
+
+
+def sample(meter, d):
+    return {
+        't': round(time.time(), 3),
+        'meter': meter.url,
+        'pulses': d['pulses'],
+        'litres': round(litres(d), 3),
+        'k': d['k'],
+    }
+
+
+async def poll_fleet(meters, found, interval, duration=None, out=sys.stdout):
+    '''poll every meter once per interval, writing changes as JSON lines'''
+    start = time.monotonic()
+    while duration is None or time.monotonic() - start < duration:
+        for url in sorted(found - set(meters)):
+            meters[url] = Meter(url)
+        t = time.monotonic()
+        ms = list(meters.values())
+        for m, d in zip(ms, await asyncio.gather(*[m.poll() for m in ms])):
+            if d is not None and out:
+                out.write(json.dumps(sample(m, d)) + '\n')
+        if out:
+            out.flush()
+        await asyncio.sleep(max(0, interval - (time.monotonic() - t)))
+
+
+class FakeMeter(object):
+    '''a local stand-in answering /usage the way watermeter.py does'''
+
+    def __init__(self, activity=0.2):
+        self.pulses = 0
+        self.k = 1.5
+        self.activity = activity
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                inm = None
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b''):
+                        break
+                    if h.lower().startswith(b'if-none-match:'):
+                        inm = h[14:].strip().decode()
+                if random.random() < self.activity:
+                    self.pulses += random.randint(1, 50)
+                tag = '"{}-{}-1"'.format(self.pulses, self.k)
+                if inm == tag:
+                    writer.write('HTTP/1.1 304 NA\r\nContent-Length: 0\r\nETag: {}\r\n\r\n'.format(tag).encode())
+                else:
+                    body = json.dumps({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S.000'),
+                        'unit': 'litre', 'volume': self.pulses * self.k / 1000.0,
+                        'pulses': self.pulses, 'k': self.k}).encode()
+                    writer.write('HTTP/1.1 200 NA\r\nContent-Type: application/json\r\n'
+                        'Content-Length: {}\r\nETag: {}\r\nConnection: keep-alive\r\n\r\n'.format(
+                        len(body), tag).encode() + body)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+async def simulate(n, duration, interval):
+    found = set()
+    servers = []
+    for _ in range(n):
+        s = await asyncio.start_server(FakeMeter().handle, '127.0.0.1', 0)
+        servers.append(s)
+        found.add('http://127.0.0.1:{}'.format(s.sockets[0].getsockname()[1]))
+    meters = {}
+    t = time.monotonic()
+    await poll_fleet(meters, found, interval, duration, out=None)
+    t = time.monotonic() - t
+    polls = sum(m.polls for m in meters.values())
+    unchanged = sum(m.unchanged for m in meters.values())
+    errors = sum(m.errors for m in meters.values())
+    print('{} meters: {} polls in {:.1f} s, {:.0f} polls/s, {} not modified, {} errors'.format(
+        n, polls, t, polls / t, unchanged, errors))
+    for m in meters.values():
+        m.close()
+    # let the fake meters see their connections close before shutting down
+    await asyncio.sleep(0.1)
+    for s in servers:
+        s.close()
+        await s.wait_closed()
+
+
+async def run(args):
+    found = set(args.meter)
+    transport = None
+    if not args.no_discover:
+        transport = await discover(found)
+    try:
+        await poll_fleet({}, found, args.interval)
+    finally:
+        if transport:
+            transport.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('-i', '--interval', type=float, default=5.0, help='seconds between polls [%(default)s]')
+    ap.add_argument('-m', '--meter', action='append', default=[], help='meter URL, eg. http://192.168.1.42:80')
+    ap.add_argument('--no-discover', action='store_true', help="don't listen for announcements")
+    ap.add_argument('--simulate', type=int, metavar='N', help='benchmark against N local fake meters')
+    ap.add_argument('--duration', type=float, default=10.0, help='simulation length in seconds [%(default)s]')
+    args = ap.parse_args()
+    try:
+        if args.simulate:
+            asyncio.run(simulate(args.simulate, args.duration, 0))
+        else:
+            asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
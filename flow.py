@@ -0,0 +1,92 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import time
+from array import array
+
+class FlowRate(object):
+    '''Estimate pulse rate from inter-pulse intervals.
+
+    Two estimates are kept, both O(1) per pulse: an exponentially weighted
+    moving average of the interval, and the mean interval over a fixed
+    window of the most recent pulses.
+    '''
+
+    def __init__(self, window=16, alpha=0.25, timeout_us=2_000_000):
+        self._win = array('L', [0] * window)
+        self._size = window
+        self._idx = 0
+        self._n = 0
+        self._sum = 0
+        self._alpha = alpha
+        self._timeout = timeout_us
+        self.ewma = 0.0         # smoothed interval, us
+        self.last_us = None     # ticks_us() of the last pulse seen
+
+    def reset(self):
+        '''forget all history, eg. after the flow stopped'''
+        for i in range(self._size):
+            self._win[i] = 0
+        self._idx = 0
+        self._n = 0
+        self._sum = 0
+        self.ewma = 0.0
+
+    def update(self, t_us):
+        '''feed the timestamp of one pulse'''
+        if self.last_us is None:
+            self.last_us = t_us
+            return
+        dt = time.ticks_diff(t_us, self.last_us)
+        self.last_us = t_us
+        if dt <= 0:
+            return
+        if dt > self._timeout:
+            # flow was stopped, this interval says nothing about the rate
+            self.reset()
+            return
+
+        self._sum += dt - self._win[self._idx]
+        self._win[self._idx] = dt
+        self._idx = (self._idx + 1) % self._size
+        if self._n < self._size:
+            self._n += 1
+
+        if self.ewma == 0.0:
+            self.ewma = dt
+        else:
+            self.ewma += self._alpha * (dt - self.ewma)
+
+    def _hz(self, interval, now_us):
+        if interval <= 0 or self.last_us is None:
+            return 0.0
+        if now_us is None:
+            now_us = time.ticks_us()
+        elapsed = time.ticks_diff(now_us, self.last_us)
+        if elapsed > self._timeout:
+            return 0.0
+        # if the next pulse is overdue, the rate is at most 1/elapsed. This
+        # lets the estimate fall promptly when the flow stops.
+        if elapsed > interval:
+            interval = elapsed
+        return 1_000_000 / interval
+
+    def hz(self, now_us=None):
+        '''pulse rate from the moving average'''
+        return self._hz(self.ewma, now_us)
+
+    def window_hz(self, now_us=None):
+        '''pulse rate from the sliding window'''
+        if self._n == 0:
+            return 0.0
+        return self._hz(self._sum / self._n, now_us)
+
+
+def bench(n=1000):
+    '''time the per-pulse cost of FlowRate.update() on the device'''
+    f = FlowRate()
+    t = time.ticks_us()
+    start = time.ticks_us()
+    for _ in range(n):
+        t = time.ticks_add(t, 5000)
+        f.update(t)
+    dt = time.ticks_diff(time.ticks_us(), start)
+    print('{} updates in {} us, {:.1f} us/pulse'.format(n, dt, dt / n))
@@ -0,0 +1,85 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import ustruct
+from array import array
+
+class History(object):
+    '''Fixed memory history of pulse counts.
+
+    The last hour is kept as per-minute buckets in RAM. Hourly and daily
+    buckets are kept in ring buffers in the backing memory of a DB_generic
+    backend, each bucket tagged with its index since the epoch so that
+    stale slots can be told apart from current ones.
+    '''
+
+    resolutions = {'minute': 60, 'hour': 3600, 'day': 86400}
+    _fmt = '<II'    # bucket index, pulses
+    _bsize = 8
+
+    def __init__(self, dbh, memaddr, size, minutes=60):
+        self._dbh = dbh
+        n = size // self._bsize
+        nh = n * 2 // 3
+        # res: [base address, number of buckets, current index, current count]
+        self._rings = {
+            'hour': [memaddr, nh, None, 0],
+            'day': [memaddr + nh * self._bsize, n - nh, None, 0],
+        }
+        self._min_idx = array('L', [0] * minutes)
+        self._min_val = array('L', [0] * minutes)
+        self._buf = bytearray(self._bsize)
+        self._last = None   # pulse count at the previous update
+
+    def _read(self, ring, idx):
+        self._dbh.read_into(ring[0] + (idx % ring[1]) * self._bsize, self._buf)
+        tag, val = ustruct.unpack_from(self._fmt, self._buf)
+        return val if tag == idx else 0
+
+    def _write(self, ring, idx, val):
+        ustruct.pack_into(self._fmt, self._buf, 0, idx, val)
+        self._dbh.write(ring[0] + (idx % ring[1]) * self._bsize, self._buf)
+
+    def update(self, pulses, t):
+        '''account for the pulses counted since the last update, at time t'''
+        if self._last is None or pulses < self._last:
+            self._last = pulses
+            return
+        delta = pulses - self._last
+        if delta == 0:
+            return
+        self._last = pulses
+
+        m = t // 60
+        i = m % len(self._min_idx)
+        if self._min_idx[i] != m:
+            self._min_idx[i] = m
+            self._min_val[i] = 0
+        self._min_val[i] += delta
+
+        for res in ('hour', 'day'):
+            ring = self._rings[res]
+            idx = t // self.resolutions[res]
+            if ring[2] != idx:
+                # new bucket, or first one since boot: pick up where we were
+                ring[2] = idx
+                ring[3] = self._read(ring, idx)
+            ring[3] += delta
+            self._write(ring, idx, ring[3])
+
+    def query(self, res, t0, t1):
+        '''generate (start time, pulses) for the recorded buckets in [t0, t1]'''
+        s = self.resolutions[res]
+        i1 = t1 // s
+        if res == 'minute':
+            n = len(self._min_idx)
+        else:
+            ring = self._rings[res]
+            n = ring[1]
+        i0 = max(t0 // s, i1 - n + 1)
+        for idx in range(i0, i1 + 1):
+            if res == 'minute':
+                j = idx % n
+                val = self._min_val[j] if self._min_idx[j] == idx else 0
+            else:
+                val = self._read(ring, idx)
+            if val:
+                yield idx * s, val
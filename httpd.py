@@ -0,0 +1,315 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import time
+import logging
+import uasyncio as asyncio
+
+logger = logging.Logger('httpd')
+
+def unquote_plus(s):
+    s = s.replace('+', ' ')
+    if '%' not in s:
+        return s
+    parts = s.split('%')
+    r = [parts[0]]
+    for p in parts[1:]:
+        try:
+            r.append(chr(int(p[:2], 16)) + p[2:])
+        except ValueError:
+            r.append('%' + p)
+    return ''.join(r)
+
+
+class Request(object):
+    '''just enough of picoweb's request for the watermeter routes'''
+
+    def __init__(self):
+        self.method = None
+        self.path = None
+        self.qs = ''
+        self.form = {}
+        self.headers = {}
+        self.keep_alive = False
+
+    def parse_qs(self):
+        self.form = {}
+        for kv in self.qs.split('&'):
+            if kv:
+                k, _, v = kv.partition('=')
+                self.form[unquote_plus(k)] = unquote_plus(v)
+
+
+class Response(object):
+    '''wraps the stream writer, adding HTTP/1.1 framing.
+
+    Given a buffer, a response whose head and body fit in it from base on
+    goes out in one write. Sent apart, the body of a short response would
+    wait behind Nagle's algorithm for the client's delayed ACK of the head,
+    tens of ms on a kept-alive connection.
+    '''
+
+    def __init__(self, writer, buf=None):
+        self.writer = writer
+        self.keep_alive = False
+        self.started = False
+        self.buf = buf
+        self.base = 0
+        self.held = 0       # bytes of head waiting in buf for the body
+
+    def start(self, content_type, status='200', length=None, headers=None):
+        # without a length the end of the body can only be signalled by
+        # closing the connection
+        if length is None:
+            self.keep_alive = False
+        self.started = True
+        h = 'HTTP/1.1 {} NA\r\nContent-Type: {}\r\n'.format(status, content_type)
+        if length is not None:
+            h += 'Content-Length: {}\r\n'.format(length)
+        if headers:
+            for k, v in headers.items():
+                h += '{}: {}\r\n'.format(k, v)
+        h += 'Connection: {}\r\n\r\n'.format('keep-alive' if self.keep_alive else 'close')
+        if self.buf is not None and length and self.base + len(h) + length <= len(self.buf):
+            h = h.encode()
+            self.buf[self.base:self.base + len(h)] = h
+            self.held = len(h)
+            return
+        yield from self.writer.awrite(h)
+
+    def flush(self):
+        if self.held:
+            n = self.held
+            self.held = 0
+            yield from self.writer.awrite(self.buf, self.base, n)
+
+    def awrite(self, buf, off=0, sz=-1):
+        if self.held:
+            if sz < 0:
+                sz = len(buf) - off
+            i = self.base + self.held
+            if i + sz <= len(self.buf) and not isinstance(buf, str):
+                memoryview(self.buf)[i:i + sz] = memoryview(buf)[off:off + sz]
+                self.held = 0
+                yield from self.writer.awrite(self.buf, self.base, i + sz - self.base)
+                return
+            yield from self.flush()
+        yield from self.writer.awrite(buf, off, sz)
+
+
+class App(object):
+    '''collects routes, in the same url_map form as picoweb.WebApp'''
+
+    def __init__(self):
+        self.url_map = []
+
+    def route(self, url, **kwargs):
+        def _route(f):
+            self.url_map.append((url, f, kwargs))
+            return f
+        return _route
+
+
+def _has(mv, start, end, name):
+    '''True if mv[start:end] starts with the lower case name, in any case'''
+    n = len(name)
+    if end - start < n:
+        return False
+    for i in range(n):
+        # sets the case bit of letters; '-' and ':' already have it
+        if mv[start + i] | 0x20 != name[i]:
+            return False
+    return True
+
+def _readinto(reader, mv):
+    # uasyncio 2.0's StreamReader has no readinto(), so wait on its socket
+    # and read that, as StreamReader.read() does
+    if hasattr(reader, 'readinto'):
+        return (yield from reader.readinto(mv))
+    while True:
+        yield asyncio.IORead(reader.polls)
+        n = reader.ios.readinto(mv)
+        if n is not None:
+            return n
+
+
+class Server(object):
+    '''Small uasyncio HTTP/1.1 server for picoweb style routes.
+
+    Connections are kept alive between requests, which saves the TCP
+    handshake for clients that poll. At most max_conn connections are
+    open at once; when a new one arrives and all slots are taken, the
+    connection that has been idle the longest is closed to make room.
+    A connection that sends nothing for timeout_ms, or takes longer than
+    that to send a request, is closed too.
+
+    Request heads are read into a buffer of hdr_size bytes per connection,
+    allocated up front, and parsed where they lie; a head that doesn't fit
+    gets a 431. Short responses are put together in the same buffer.
+    '''
+
+    def __init__(self, url_map, max_conn=4, hdr_size=512, timeout_ms=15000):
+        self._routes = {}
+        for e in url_map:
+            if isinstance(e[0], str):
+                self._routes[e[0]] = e[1]
+        self._max_conn = max_conn
+        self._timeout_ms = timeout_ms
+        # ticks_ms() when each open connection last finished a request, or
+        # was accepted; None while a request is being answered
+        self._idle = {}
+        # one spare, for a connection that evicted one whose handler
+        # hasn't let go of its buffer yet
+        self._free = [bytearray(hdr_size) for _ in range(max_conn + 1)]
+        self.requests = 0
+        self.evicted = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def _oldest(self, now, age):
+        # the connection idle the longest, if for longer than age ms
+        oldest = None
+        for w, t in self._idle.items():
+            if t is not None and time.ticks_diff(now, t) >= age:
+                age = time.ticks_diff(now, t)
+                oldest = w
+        return oldest
+
+    def _close(self, w):
+        del self._idle[w]
+        yield from w.aclose()
+
+    def _evict(self):
+        oldest = self._oldest(time.ticks_ms(), 0)
+        if oldest is None:
+            return False
+        self.evicted += 1
+        yield from self._close(oldest)
+        return True
+
+    def _reaper(self):
+        while True:
+            yield from asyncio.sleep_ms(1000)
+            while True:
+                w = self._oldest(time.ticks_ms(), self._timeout_ms)
+                if w is None:
+                    break
+                self.timeouts += 1
+                yield from self._close(w)
+
+    def _request_line(self, req, mv, start, end):
+        try:
+            method, target, version = bytes(mv[start:end]).decode().split()
+        except ValueError:
+            return False
+        req.method = method
+        req.path, _, req.qs = target.partition('?')
+        req.form = {}
+        req.headers = {}
+        req.keep_alive = version == 'HTTP/1.1'
+        return True
+
+    def _header(self, req, mv, start, end):
+        # only a couple of headers matter here; don't keep the rest
+        if _has(mv, start, end, b'if-none-match:'):
+            req.headers[b'If-None-Match'] = bytes(mv[start + 14:end]).strip()
+        elif _has(mv, start, end, b'connection:'):
+            v = bytes(mv[start + 11:end]).strip().lower()
+            if v == b'close':
+                req.keep_alive = False
+            elif v == b'keep-alive':
+                req.keep_alive = True
+
+    def _read_request(self, reader, req, mv, have):
+        # reads a request head into mv, which already holds have bytes.
+        # Returns how many bytes after the head are left at the start of
+        # mv for the next request, -1 at the end of the connection or on a
+        # bad request, and -2 if the head doesn't fit.
+        start = 0       # of the line being scanned
+        i = 0
+        lines = 0
+        while True:
+            while i < have:
+                if mv[i] == 10:
+                    if i - start <= 1 and mv[start] in (10, 13):
+                        if lines:
+                            i += 1
+                            rest = have - i
+                            for j in range(rest):
+                                mv[j] = mv[i + j]
+                            return rest
+                        # blank lines before a request are allowed
+                    elif lines == 0:
+                        if not self._request_line(req, mv, start, i):
+                            return -1
+                        lines = 1
+                    else:
+                        self._header(req, mv, start, i)
+                    start = i + 1
+                i += 1
+            if have == len(mv):
+                return -2
+            n = yield from _readinto(reader, mv[have:])
+            if not n:
+                return -1
+            have += n
+
+    def _handle(self, reader, writer):
+        if len(self._idle) >= self._max_conn:
+            yield from self._evict()
+        if len(self._idle) >= self._max_conn or not self._free:
+            yield from writer.awrite(b'HTTP/1.1 503 Service Unavailable\r\nConnection: close\r\n\r\n')
+            yield from writer.aclose()
+            return
+        buf = self._free.pop()
+        mv = memoryview(buf)
+        have = 0
+        self._idle[writer] = time.ticks_ms()
+        req = Request()
+        resp = Response(writer, buf)
+        try:
+            while True:
+                have = yield from self._read_request(reader, req, mv, have)
+                if have == -2:
+                    yield from writer.awrite(b'HTTP/1.1 431 Request Header Fields Too Large\r\nConnection: close\r\n\r\n')
+                if have < 0 or writer not in self._idle:
+                    break
+                self._idle[writer] = None   # busy
+                self.requests += 1
+                resp.keep_alive = req.keep_alive
+                resp.started = False
+                # after the start of the next request, if that came along
+                resp.base = have
+                resp.held = 0
+                handler = self._routes.get(req.path)
+                if handler is None:
+                    yield from resp.start('text/plain', '404', 0)
+                else:
+                    yield from handler(req, resp)
+                    if not resp.started:
+                        yield from resp.start('text/plain', '204', 0)
+                    yield from resp.flush()
+                if not resp.keep_alive:
+                    break
+                self._idle[writer] = time.ticks_ms()
+        except OSError:
+            pass
+        except Exception as e:
+            self.errors += 1
+            logger.error('%s: %r', req.path, e)
+            if not resp.started or resp.held:
+                resp.held = 0
+                try:
+                    yield from writer.awrite(b'HTTP/1.1 500 Internal Server Error\r\nConnection: close\r\n\r\n')
+                except OSError:
+                    pass
+        finally:
+            self._free.append(buf)
+            # unless it was evicted or timed out, which closed it already
+            close = self._idle.pop(writer, False) is not False
+        if close:
+            yield from writer.aclose()
+
+    def run(self, host='0.0.0.0', port=80):
+        loop = asyncio.get_event_loop()
+        loop.create_task(asyncio.start_server(self._handle, host, port))
+        loop.create_task(self._reaper())
+        loop.run_forever()
@@ -0,0 +1,87 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import time
+import gc
+
+class Probe(object):
+    '''call count and duration of one instrumented function'''
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+
+    def add(self, dt):
+        # may run in a hard IRQ, so keep everything a small int: when the
+        # total gets large, halve it along with the count to keep the mean
+        if self.total_us > 0x10000000:
+            self.total_us >>= 1
+            self.count >>= 1
+        if self.count == 0 or dt < self.min_us:
+            self.min_us = dt
+        if dt > self.max_us:
+            self.max_us = dt
+        self.count += 1
+        self.total_us += dt
+
+
+class Profiler(object):
+    '''Time calls to functions and track free memory.
+
+    Instrumenting a function means replacing it with a wrapper from
+    wrap(), wrap_isr() or wrap_route(), so nothing is wrapped, and nothing
+    costs anything, unless profiling is turned on. The low and high
+    gc.mem_free() watermarks are sampled after each call, except in
+    interrupt handlers.
+    '''
+
+    def __init__(self):
+        self.probes = []
+        self.mem_low = None
+        self.mem_high = 0
+
+    def probe(self, name):
+        p = Probe(name)
+        self.probes.append(p)
+        return p
+
+    def sample_mem(self):
+        m = gc.mem_free()
+        if self.mem_low is None or m < self.mem_low:
+            self.mem_low = m
+        if m > self.mem_high:
+            self.mem_high = m
+        return m
+
+    def wrap(self, name, fn):
+        p = self.probe(name)
+        def timed(*args):
+            t0 = time.ticks_us()
+            try:
+                return fn(*args)
+            finally:
+                p.add(time.ticks_diff(time.ticks_us(), t0))
+                self.sample_mem()
+        return timed
+
+    def wrap_isr(self, name, fn):
+        '''for hard IRQ handlers: no allocation, no memory sampling'''
+        p = self.probe(name)
+        def timed(arg=None):
+            t0 = time.ticks_us()
+            fn(arg)
+            p.add(time.ticks_diff(time.ticks_us(), t0))
+        return timed
+
+    def wrap_route(self, name, fn):
+        '''for request handlers; this includes the time spent sending'''
+        p = self.probe(name)
+        def timed(req, resp):
+            t0 = time.ticks_us()
+            try:
+                yield from fn(req, resp)
+            finally:
+                p.add(time.ticks_diff(time.ticks_us(), t0))
+                self.sample_mem()
+        return timed
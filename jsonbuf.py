@@ -0,0 +1,185 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+
+class JSONWriter(object):
+    '''Write a JSON object or array into a reusable bytearray.
+
+    Numbers are formatted digit by digit straight into the buffer, so a
+    response can be built without the intermediate dict and string that
+    json.dumps() needs. Containers nest up to 4 deep.
+    '''
+
+    _hex = b'0123456789abcdef'
+    # (field, width, trailing character) for timestamp()
+    _ts_fields = ((0, 4, 0x2d), (1, 2, 0x2d), (2, 2, 0x20), (3, 2, 0x3a),
+                  (4, 2, 0x3a), (5, 2, 0x2e), (6, 3, 0x22))
+
+    def __init__(self, size=256):
+        self.buf = bytearray(size)
+        self.n = 0
+        self.busy = 0       # number of holders, see hold() and release()
+        self._stack = bytearray(4)  # closing brackets of open containers
+        self._depth = 0
+        self._first = True
+        self._keyed = False
+
+    def _grow(self, n):
+        if self.n + n > len(self.buf):
+            self.buf.extend(bytearray(max(n, len(self.buf))))
+
+    def _put(self, b):
+        n = len(b)
+        self._grow(n)
+        self.buf[self.n:self.n + n] = b
+        self.n += n
+
+    def _byte(self, c):
+        self._grow(1)
+        self.buf[self.n] = c
+        self.n += 1
+
+    def _int(self, v, width=0):
+        if v < 0:
+            self._byte(0x2d)  # -
+            v = -v
+        start = self.n
+        while v or width > 0 or self.n == start:
+            self._byte(0x30 + v % 10)
+            v //= 10
+            width -= 1
+        # digits went in backwards
+        i, j = start, self.n - 1
+        while i < j:
+            self.buf[i], self.buf[j] = self.buf[j], self.buf[i]
+            i += 1
+            j -= 1
+
+    def _float(self, v, places):
+        if v - v != 0:
+            # NaN or +-inf, which JSON has no numbers for
+            self._put(b'null')
+            return
+        if v < 0:
+            self._byte(0x2d)
+            v = -v
+        m = 10 ** places
+        v = int(v * m + 0.5)
+        self._int(v // m)
+        if places:
+            self._byte(0x2e)  # .
+            self._int(v % m, places)
+
+    def _str(self, s):
+        if isinstance(s, str):
+            s = s.encode()
+        self._byte(0x22)
+        for c in s:
+            if c < 0x20 or c == 0x22 or c == 0x5c:
+                break
+        else:
+            self._put(s)
+            self._byte(0x22)
+            return
+        for c in s:
+            if c == 0x22 or c == 0x5c:
+                self._byte(0x5c)
+                self._byte(c)
+            elif c < 0x20:
+                # control characters must be escaped, eg. \u000a
+                self._put(b'\\u00')
+                self._byte(self._hex[c >> 4])
+                self._byte(self._hex[c & 15])
+            else:
+                self._byte(c)
+        self._byte(0x22)
+
+    def _sep(self):
+        if self._keyed:
+            self._keyed = False
+        elif self._first:
+            self._first = False
+        else:
+            self._put(b', ')
+
+    def _open(self, c, close):
+        self.busy = 1
+        self.n = 0
+        self._depth = 0
+        self._keyed = False
+        return self._push(c, close)
+
+    def _push(self, c, close):
+        self._byte(c)
+        self._stack[self._depth] = close
+        self._depth += 1
+        self._first = True
+        return self
+
+    def obj(self):
+        '''start a new object, discarding the previous content'''
+        return self._open(0x7b, 0x7d)
+
+    def arr(self):
+        '''start a new array, discarding the previous content'''
+        return self._open(0x5b, 0x5d)
+
+    def sub_obj(self):
+        '''start an object nested in the current container'''
+        self._sep()
+        return self._push(0x7b, 0x7d)
+
+    def sub_arr(self):
+        '''start an array nested in the current container'''
+        self._sep()
+        return self._push(0x5b, 0x5d)
+
+    def end(self):
+        '''close the innermost object or array'''
+        self._depth -= 1
+        self._byte(self._stack[self._depth])
+        self._first = False
+        return self
+
+    def hold(self):
+        '''keep the content while it is being sent'''
+        self.busy += 1
+        return self
+
+    def release(self):
+        '''the content has been sent, the buffer may be reused'''
+        if self.busy:
+            self.busy -= 1
+
+    def key(self, k):
+        self._sep()
+        self._str(k)
+        self._put(b': ')
+        self._keyed = True
+        return self
+
+    def val(self, v, places=4):
+        self._sep()
+        if v is None:
+            self._put(b'null')
+        elif v is True:
+            self._put(b'true')
+        elif v is False:
+            self._put(b'false')
+        elif isinstance(v, int):
+            self._int(v)
+        elif isinstance(v, float):
+            self._float(v, places)
+        else:
+            self._str(v)
+        return self
+
+    def item(self, k, v, places=4):
+        return self.key(k).val(v, places)
+
+    def timestamp(self, t):
+        '''a localtime() tuple as "YYYY-MM-DD HH:MM:SS.sss"'''
+        self._sep()
+        self._byte(0x22)
+        for i, w, c in self._ts_fields:
+            self._int(t[i], w)
+            self._byte(c)
+        return self
@@ -0,0 +1,47 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+
+class Exposition(object):
+    '''Prometheus text exposition, built once and patched in place.
+
+    metrics is a sequence of (name, type, help, decimal places). The HELP
+    and TYPE lines and metric names are rendered into the buffer when the
+    object is created; each sample value is a fixed width, zero padded
+    field which set() overwrites, with a '-' in its first place if it is
+    negative. A scrape is then a single write of buf.
+    '''
+
+    def __init__(self, metrics, width=16):
+        self._width = width
+        self._places = []
+        self._offsets = []
+        s = []
+        n = 0
+        for name, kind, doc, places in metrics:
+            head = '# HELP {0} {1}\n# TYPE {0} {2}\n{0} '.format(name, doc, kind)
+            s.append(head)
+            n += len(head)
+            self._offsets.append(n)
+            self._places.append(places)
+            s.append('0' * width + '\n')
+            n += width + 1
+        self.buf = bytearray(''.join(s).encode())
+
+    def set(self, i, v):
+        '''set the value of the i'th metric'''
+        places = self._places[i]
+        start = self._offsets[i]
+        p = start + self._width - 1
+        dot = p - places if places else -1
+        neg = v < 0
+        if neg:
+            v = -v
+        v = int(v * 10 ** places + 0.5) if places else int(v)
+        while p >= start:
+            if p == dot:
+                self.buf[p] = 0x2e  # .
+            else:
+                self.buf[p] = 0x30 + v % 10
+                v //= 10
+            p -= 1
+        if neg:
+            self.buf[start] = 0x2d  # -
@@ -0,0 +1,69 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import usocket as socket
+from clock import EPOCH_OFFSET
+
+class Publisher(object):
+    '''Push usage to a collector as InfluxDB line protocol over UDP.
+
+    Samples are only taken when the pulse count changed and at most every
+    min_interval seconds. Up to batch lines are collected into one
+    datagram, which is sent when full or when the oldest line is max_age
+    seconds old. One socket is kept for the life of the publisher.
+
+    Timestamps are in nanoseconds, the default precision of InfluxDB and
+    Telegraf, though only to the second.
+    '''
+
+    def __init__(self, host, port=8089, name='watermeter', min_interval=10, batch=6, max_age=60):
+        self._addr = socket.getaddrinfo(host, port)[0][-1]
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._name = name
+        self._min_interval = min_interval
+        self._batch = batch
+        self._max_age = max_age
+        self._buf = bytearray(batch * 105)
+        self._n = 0
+        self._lines = 0
+        self._first_t = 0
+        self._last_t = 0
+        self._last_pulses = None
+        self.sent = 0
+        self.errors = 0
+
+    def sample(self, pulses, volume, t):
+        '''offer a reading taken at time t, and send the batch when due'''
+        if self._last_pulses is None:
+            self._last_pulses = pulses
+        if self._lines and t - self._first_t >= self._max_age:
+            self.flush()
+        if pulses == self._last_pulses or t - self._last_t < self._min_interval:
+            return
+        line = '{} pulses={}i,delta={}i,volume={:.3f} {}000000000\n'.format(self._name,
+            pulses, pulses - self._last_pulses, volume, t + EPOCH_OFFSET).encode()
+        if self._n + len(line) > len(self._buf):
+            self.flush()
+        self._buf[self._n:self._n + len(line)] = line
+        self._n += len(line)
+        if self._lines == 0:
+            self._first_t = t
+        self._lines += 1
+        self._last_t = t
+        self._last_pulses = pulses
+        if self._lines >= self._batch:
+            self.flush()
+
+    def flush(self):
+        '''send whatever is batched'''
+        if self._n == 0:
+            return
+        try:
+            self._sock.sendto(memoryview(self._buf)[:self._n], self._addr)
+            self.sent += 1
+        except OSError:
+            self.errors += 1
+        self._n = 0
+        self._lines = 0
+
+    def close(self):
+        self.flush()
+        self._sock.close()
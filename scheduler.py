@@ -0,0 +1,97 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import time
+import urandom
+import logging
+import uasyncio as asyncio
+
+logger = logging.Logger('scheduler')
+
+class Task(object):
+    '''a periodic job and its timing statistics'''
+
+    def __init__(self, name, fn, period_ms, jitter_ms=0, deadline_ms=None):
+        self.name = name
+        self.fn = fn
+        self.period = period_ms
+        self.jitter = jitter_ms
+        self.deadline = deadline_ms
+        self.runs = 0
+        self.run_us = 0         # total
+        self.max_us = 0
+        self.late_ms = 0        # total
+        self.max_late_ms = 0
+        self.overruns = 0       # runs that took longer than the deadline
+        self.skipped = 0        # periods missed entirely
+        self.errors = 0
+        self.last_error = None  # repr() of the last exception raised
+
+
+class Scheduler(object):
+    '''Run periodic jobs as uasyncio tasks.
+
+    Each run is started at its scheduled time plus up to jitter_ms, so jobs
+    with the same period don't all wake up together. How late each run
+    starts and how long it takes are recorded per task; a run longer than
+    deadline_ms counts as an overrun, and if a job falls more than a whole
+    period behind the missed runs are skipped rather than run back to back.
+    An exception from a job is logged and counted, and the job carries on.
+    heartbeat is the ticks_ms() of the last run of any job, for a watchdog
+    to tell that the loop is still going.
+    '''
+
+    def __init__(self):
+        self.tasks = []
+        self.heartbeat = time.ticks_ms()
+        self._loop = None
+
+    def every(self, name, period_ms, fn, jitter_ms=0, deadline_ms=None):
+        '''add a job. Jobs added after start() begin at once.'''
+        t = Task(name, fn, period_ms, jitter_ms, deadline_ms)
+        self.tasks.append(t)
+        if self._loop:
+            self._loop.create_task(self._runner(t))
+        return t
+
+    def _jitter(self, t):
+        return urandom.getrandbits(16) % t.jitter if t.jitter else 0
+
+    def _runner(self, t):
+        base = time.ticks_ms()
+        while True:
+            base = time.ticks_add(base, t.period)
+            due = time.ticks_add(base, self._jitter(t))
+            delay = time.ticks_diff(due, time.ticks_ms())
+            if delay > 0:
+                yield from asyncio.sleep_ms(delay)
+
+            late = time.ticks_diff(time.ticks_ms(), due)
+            t0 = time.ticks_us()
+            try:
+                t.fn()
+            except Exception as e:
+                t.errors += 1
+                t.last_error = repr(e)
+                logger.error('%s: %s', t.name, t.last_error)
+            dt = time.ticks_diff(time.ticks_us(), t0)
+
+            t.runs += 1
+            t.run_us += dt
+            if dt > t.max_us:
+                t.max_us = dt
+            if late > 0:
+                t.late_ms += late
+                if late > t.max_late_ms:
+                    t.max_late_ms = late
+            if t.deadline is not None and dt > t.deadline * 1000:
+                t.overruns += 1
+
+            now = time.ticks_ms()
+            self.heartbeat = now
+            if time.ticks_diff(now, base) > t.period:
+                t.skipped += time.ticks_diff(now, base) // t.period
+                base = now
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        for t in self.tasks:
+            self._loop.create_task(self._runner(t))
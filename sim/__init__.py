@@ -0,0 +1,103 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''Stand-ins for the MicroPython modules the watermeter needs, so that it
+runs on a host with CPython.
+
+    import sim
+    sim.install()
+    import watermeter
+
+install() puts the stand-ins in sys.modules under the names the device
+code imports: machine, network, micropython, uasyncio, btree, picoweb,
+ssd1306, and the u-prefixed aliases of the standard library. time gets
+the MicroPython extras (ticks_ms() and friends) and the device's epoch,
+2000-01-01 UTC. The I2C devices on the virtual bus are in sim.devices.
+
+python3 -m sim runs watermeter.main() against a virtual board, and
+python3 -m sim.bench runs the benchmarks.
+'''
+import sys
+import gc
+
+installed = False
+
+def install():
+    '''make the stand-ins importable under their MicroPython names'''
+    global installed
+    if installed:
+        return
+    import struct, binascii, socket, select, random, json, os, errno
+    from sim import utime
+    # imported after utime, so that they see the device's time
+    from sim import machine, network, micropython, uasyncio, btree, picoweb, ssd1306
+
+    sys.modules.update({
+        'time': utime,
+        'utime': utime,
+        'machine': machine,
+        'network': network,
+        'micropython': micropython,
+        'uasyncio': uasyncio,
+        'btree': btree,
+        'picoweb': picoweb,
+        'ssd1306': ssd1306,
+        'ustruct': struct,
+        'ubinascii': binascii,
+        'usocket': socket,
+        'uselect': select,
+        'urandom': random,
+        'ujson': json,
+        'uos': os,
+        'uerrno': errno,
+    })
+    gc.mem_free = _mem_free
+    gc.mem_alloc = _mem_alloc
+    installed = True
+
+
+# The ESP8266 has about this much heap for Python objects. Heap figures on
+# a host are CPython object sizes from tracemalloc, so they are only good
+# for comparing one run with another.
+heap_size = 36 * 1024
+
+def _mem_alloc():
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+def _mem_free():
+    return heap_size - _mem_alloc()
+
+
+def board(oled=False, eeprom=None):
+    '''attach a watermeter's I2C devices to the bus on GPIO4/5: an FRAM,
+    optionally an OLED, and optionally an EEPROM at address eeprom'''
+    from sim import devices
+    b = devices.bus(scl=4, sda=5)
+    b.attach(0x50, devices.FRAM())
+    if oled:
+        b.attach(0x3c, devices.SSD1306())
+    if eeprom:
+        b.attach(eeprom, devices.EEPROM())
+    return b
+
+def sntp(host=None, timeout=1):
+    '''an NTP answer from the host's clock, in place of clock.sntp()'''
+    from sim import utime
+    return int((utime._time.time() - utime.EPOCH) * 1000)
+
+def boot():
+    '''import watermeter and do what its main() does before the network
+    comes up: open the storage, load the state, arm the pulse IRQ on GPIO4
+    and start the clock, arbiter and scheduler. Needs board(). Returns the
+    module; booting again is a no-op.'''
+    import watermeter as wm
+    from machine import Pin
+    if wm.dbh is None:
+        wm.open_storage()
+        wm.load_state()
+    if not wm.channel_pins:
+        pin = Pin(4, Pin.IN, Pin.PULL_UP)
+        wm.channel_pins = (pin,)
+        wm.edge_filters = (wm.edge_filter,)
+        pin.irq(trigger=Pin.IRQ_FALLING, handler=wm.pulse_handler, hard=True)
+    wm.start_services()
+    return wm
@@ -0,0 +1,66 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''Run watermeter.main() on a virtual board.
+
+    python3 -m sim --port 8080 --flow 20:0,60:25,30:4 --oled
+
+The flow profile is seconds:Hz segments, repeated, fed to the sensor pin
+from a thread. NTP answers come from the host's clock. With --duration
+the meter stops after that many seconds and the pulses sent are compared
+with the pulses counted.
+'''
+import argparse
+import logging
+import threading
+import sim
+
+def profile(s):
+    p = []
+    for seg in s.split(','):
+        secs, _, hz = seg.partition(':')
+        p.append((float(secs), float(hz)))
+    return p
+
+def main():
+    ap = argparse.ArgumentParser(description='run the watermeter on a virtual board')
+    ap.add_argument('--port', type=int, default=8080, help='HTTP port [%(default)s]')
+    ap.add_argument('--flow', type=profile, default='10:0,30:20,20:5', help='seconds:hz,... [%(default)s]')
+    ap.add_argument('--oled', action='store_true', help='with an OLED display')
+    ap.add_argument('--server', default='httpd', choices=('httpd', 'picoweb'))
+    ap.add_argument('--debug', type=int, default=0)
+    ap.add_argument('--duration', type=float, help='stop after this many seconds')
+    args = ap.parse_args()
+
+    sim.install()
+    sim.board(oled=args.oled)
+    import watermeter
+    from machine import Pin
+    import uasyncio as asyncio
+
+    watermeter.port = args.port
+    watermeter.sntp = sim.sntp
+    watermeter.logger.addHandler(logging.StreamHandler())
+    if args.oled:
+        watermeter.open_storage()
+        d = watermeter.dbh.load()
+        d['indicator'] = 'oled'
+        watermeter.dbh.save(d)
+
+    pin = Pin(12 if args.oled else 4)
+    pin.drive(args.flow, repeat=True)
+    if args.duration:
+        t = threading.Timer(args.duration, asyncio.get_event_loop().stop)
+        t.daemon = True
+        t.start()
+    try:
+        watermeter.main(debug=args.debug, server=args.server)
+    except KeyboardInterrupt:
+        pass
+    pin.stop()
+    watermeter.pulse_consumer()
+    # the FRAM starts out blank, so everything counted is from this run
+    print('edges sent {}, after the IRQ was armed {}; counted {}, dropped {}, rejected {}'.format(
+        pin.edges, pin.irqs, watermeter.pulse_ctr, watermeter.pulse_drops,
+        watermeter.edge_filter.rejected))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''Benchmarks of the watermeter on the virtual board.
+
+    python3 -m sim.bench -o baseline.json
+    python3 -m sim.bench --compare baseline.json
+
+Each benchmark adds numbers to a flat dict, which is printed and can be
+written as JSON. With --compare, each number is shown next to the one in
+an earlier run. Times are host times, so only compare runs on the same
+machine; bus bytes and bus time are what the ESP8266 would see.
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import sim
+
+benchmarks = []
+
+def benchmark(fn):
+    benchmarks.append(fn)
+    return fn
+
+def _perf():
+    from sim import utime
+    return utime._time.perf_counter()
+
+def timed(fn, n):
+    '''mean microseconds per call of fn()'''
+    t0 = _perf()
+    for _ in range(n):
+        fn()
+    return (_perf() - t0) * 1000000 / n
+
+def heap(fn):
+    '''(bytes still allocated, peak bytes allocated) by fn()'''
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        cur, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return cur - base, peak - base
+
+
+class Ticks(object):
+    '''a ticks_us() source that only moves when told to'''
+
+    def __init__(self):
+        self.us = 0
+
+    def __call__(self):
+        return self.us
+
+
+@benchmark
+def boot(r):
+    # import cost is only measured if nothing imported watermeter yet
+    if 'watermeter' not in sys.modules:
+        t0 = _perf()
+        kept, _ = heap(lambda: __import__('watermeter'))
+        r['boot_import_ms'] = (_perf() - t0) * 1000
+        r['boot_import_heap_bytes'] = kept
+    if sys.modules['watermeter'].dbh is None:
+        r['boot_storage_heap_bytes'] = heap(sim.boot)[0]
+
+
+@benchmark
+def isr(r, n=20000):
+    from sim import utime
+    wm = sim.boot()
+    pin = wm.channel_pins[0]
+    clk = Ticks()
+    utime.source = clk
+    try:
+        def edge():
+            clk.us += 5000      # 200 Hz
+            wm.pulse_handler(pin)
+        t_isr = 0.0
+        t_con = 0.0
+        done = 0
+        while done < n:
+            t_isr += timed(edge, 32) * 32
+            t_con += timed(wm.pulse_consumer, 1)
+            done += 32
+        r['isr_us_per_edge'] = t_isr / done
+        r['isr_consumer_us_per_pulse'] = t_con / done
+        r['isr_edges_per_s'] = 1000000 / (r['isr_us_per_edge'] or 1)
+        r['isr_dropped'] = wm.pulse_drops
+    finally:
+        utime.source = None
+
+
+@benchmark
+def save(r, n=50):
+    import db
+    from sim import devices
+    from machine import I2C, Pin
+    wm = sim.boot()
+    b = I2C(scl=Pin(4), sda=Pin(5))
+    if 0x51 not in b.bus.devices:
+        b.bus.attach(0x51, devices.EEPROM())
+    tmp = tempfile.mkdtemp()
+    backends = (
+        ('journal', db.DB_journal(bus=b, memaddr=0, device_kbits=64)),
+        ('eeprom', db.DB_eeprom(bus=b, addr=0x51, device_kbits=64)),
+        ('flat', db.DB_flat(os.path.join(tmp, 'wm.dat'))),
+        ('btree', db.DB_btree(os.path.join(tmp, 'wm.db'))),
+        ('json', db.DB_json(os.path.join(tmp, 'wm.json'))),
+    )
+    state = dict(wm.state)
+    for name, dbh in backends:
+        dbh.save(state)
+        bytes0 = b.bus.bytes
+        bus0 = b.bus.bus_us
+        r['save_{}_us'.format(name)] = timed(lambda: dbh.save(state), n)
+        r['save_{}_bus_bytes'.format(name)] = (b.bus.bytes - bytes0) // n
+        r['save_{}_bus_us'.format(name)] = (b.bus.bus_us - bus0) / n
+        r['save_{}_heap_peak_bytes'.format(name)] = heap(lambda: dbh.save(state))[1]
+        r['load_{}_us'.format(name)] = timed(dbh.load, n)
+
+
+@benchmark
+def eeprom(r, passes=2, endurance=1000000):
+    '''DB_eeprom saves on a 24LC256 with its 5 ms write cycle: the time and
+    bytes a save takes, the ACK polls it makes, and how the write cycles
+    spread over the pages. lifetime is the saves until the most worn page
+    reaches endurance cycles, at this rate of wear.'''
+    import db
+    from sim import devices
+    from machine import I2C, Pin
+    b = I2C(scl=Pin(20), sda=Pin(21))
+    chip = b.bus.attach(0x50, devices.EEPROM(kbits=256, pagesize=64))
+    dbh = db.DB_eeprom(bus=b, device_kbits=256, pagesize=64)
+    state = dict(db.DB_generic.defaults)
+    n = dbh._slots * passes
+    t0 = _perf()
+    for i in range(n):
+        state['usage'] = i
+        dbh.save(state)
+    elapsed = _perf() - t0
+    used = chip.cycles[dbh._memaddr // dbh.pagesize:]
+    r['eeprom_save_ms'] = elapsed * 1000 / n
+    r['eeprom_write_bytes_per_s'] = chip.bytes_written / elapsed
+    r['eeprom_bus_bytes_per_save'] = b.bus.bytes / n
+    r['eeprom_naks_per_save'] = chip.naks / n
+    r['eeprom_page_cycles_per_save'] = chip.writes / n
+    r['eeprom_max_page_cycles'] = chip.wear()
+    r['eeprom_min_page_cycles'] = min(used)
+    r['eeprom_lifetime_saves'] = endurance * n / chip.wear()
+
+
+class _Writer(object):
+    '''a stream that takes whatever it is given, and keeps it if asked'''
+
+    def __init__(self, keep=False):
+        self.bytes = 0
+        self.writes = [] if keep else None
+
+    def awrite(self, buf, off=0, sz=-1):
+        if sz < 0:
+            sz = len(buf) - off
+        self.bytes += sz
+        if self.writes is not None:
+            if isinstance(buf, str):
+                buf = buf.encode()
+            self.writes.append(bytes(buf[off:off + sz]))
+        return
+        yield
+
+def run_route(fn, path='/', qs='', w=None):
+    '''run a route to completion, returning the bytes it wrote'''
+    import httpd
+    req = httpd.Request()
+    req.method = 'GET'
+    req.path = path
+    req.qs = qs
+    if w is None:
+        w = _Writer()
+    resp = httpd.Response(w)
+    for _ in fn(req, resp):
+        pass
+    return w.bytes
+
+
+@benchmark
+def routes(r, n=200):
+    wm = sim.boot()
+    for path in ('/usage', '/metrics', '/flow', '/channels', '/history'):
+        fn = [e[1] for e in wm.app.url_map if e[0] == path][0]
+        name = path.strip('/')
+        r['route_{}_bytes'.format(name)] = run_route(fn, path)
+        r['route_{}_us'.format(name)] = timed(lambda: run_route(fn, path), n)
+        r['route_{}_heap_peak_bytes'.format(name)] = heap(lambda: run_route(fn, path))[1]
+
+
+def _rebuild(v):
+    # a fresh copy of a decoded JSON value, standing in for a route
+    # building its response as dicts and lists
+    if isinstance(v, dict):
+        return {k: _rebuild(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_rebuild(x) for x in v]
+    return v
+
+@benchmark
+def json_alloc(r):
+    '''peak heap a response body takes: the route writing it with
+    JSONWriter, against building the same content as a dict and calling
+    json.dumps(), as the routes did with picoweb.jsonify(). The dict version
+    doesn't get the values from the meter, so it gets off lightly.'''
+    wm = sim.boot()
+    for path in ('/usage', '/flow', '/channels', '/alerts'):
+        fn = [e[1] for e in wm.app.url_map if e[0] == path][0]
+        w = _Writer(keep=True)
+        run_route(fn, path, w=w)
+        # the first write is the head
+        const = b''.join(w.writes[1:])
+        body = json.loads(const)
+        # CPython's generator frames and the head take most of the heap of
+        # a route, so take off what sending a ready made body takes
+        def null(req, resp):
+            yield from wm.start_response(resp, 'application/json', len(const))
+            yield from resp.awrite(const)
+        base = heap(lambda: run_route(null, path))[1]
+        name = path.strip('/')
+        r['json_{}_writer_heap_bytes'.format(name)] = heap(lambda: run_route(fn, path))[1] - base
+        r['json_{}_dumps_heap_bytes'.format(name)] = heap(lambda: json.dumps(_rebuild(body)).encode())[1]
+
+
+def _get(c, f, path):
+    c.sendall(b'GET ' + path + b' HTTP/1.1\r\n\r\n')
+    n = 0
+    while True:
+        line = f.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line[:15].lower() == b'content-length:':
+            n = int(line[15:])
+    return f.read(n)
+
+@benchmark
+def http(r, clients=4, n=250):
+    '''the httpd server under clients polling /usage as fast as they can,
+    over kept-alive connections and then a connection per request'''
+    import socket
+    import threading
+    import uasyncio as asyncio
+    import httpd
+    wm = sim.boot()
+    srv = httpd.Server(wm.app.url_map, max_conn=clients)
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=srv.run, args=('127.0.0.1', port), daemon=True).start()
+
+    def client(lat, keep):
+        c = None
+        for _ in range(n):
+            t0 = _perf()
+            if c is None:
+                c = socket.create_connection(('127.0.0.1', port))
+                f = c.makefile('rb')
+            _get(c, f, b'/usage')
+            if not keep:
+                f.close()
+                c.close()
+                c = None
+            lat.append(_perf() - t0)
+        if c is not None:
+            f.close()
+            c.close()
+
+    for name, keep in (('keepalive', True), ('close', False)):
+        lat = []
+        threads = [threading.Thread(target=client, args=(lat, keep)) for _ in range(clients)]
+        t0 = _perf()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = _perf() - t0
+        lat.sort()
+        r['http_{}_requests_per_s'.format(name)] = len(lat) / elapsed
+        r['http_{}_p50_ms'.format(name)] = lat[len(lat) // 2] * 1000
+        r['http_{}_p99_ms'.format(name)] = lat[len(lat) * 99 // 100] * 1000
+    loop.stop()
+    for ls in asyncio.servers:
+        ls.close()
+    del asyncio.servers[:]
+
+
+def main():
+    ap = argparse.ArgumentParser(description='benchmark the watermeter on a virtual board')
+    ap.add_argument('-o', '--output', help='write the results here, as JSON')
+    ap.add_argument('--compare', help='results of an earlier run to compare with')
+    ap.add_argument('only', nargs='*', help='benchmarks to run [all]')
+    args = ap.parse_args()
+
+    sim.install()
+    sim.board(oled=True)
+    r = {}
+    for b in benchmarks:
+        if not args.only or b.__name__ in args.only:
+            b(r)
+
+    old = {}
+    if args.compare:
+        with open(args.compare) as fd:
+            old = json.load(fd)
+    for k in sorted(r):
+        v = r[k]
+        line = '{:40s} {:12.3f}'.format(k, v)
+        if k in old and old[k]:
+            line += ' {:12.3f} {:+7.1f}%'.format(old[k], (v - old[k]) * 100 / old[k])
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(r, fd, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
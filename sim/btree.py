@@ -0,0 +1,81 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''btree module: a sorted bytes -> bytes map kept in a stream.
+
+Not the Berkeley DB file format, just length prefixed records, written
+back by flush() and close().
+'''
+import struct
+
+INCL = 1
+DESC = 2
+
+def open(stream, flags=0, pagesize=0, cachesize=0, minkeypage=0):
+    return _DB(stream)
+
+
+class _DB(object):
+
+    def __init__(self, stream):
+        self._f = stream
+        self._d = {}
+        stream.seek(0)
+        data = stream.read()
+        i = 0
+        while i + 8 <= len(data):
+            kl, vl = struct.unpack_from('<II', data, i)
+            i += 8
+            self._d[data[i:i + kl]] = data[i + kl:i + kl + vl]
+            i += kl + vl
+
+    def flush(self):
+        f = self._f
+        f.seek(0)
+        for k in sorted(self._d):
+            v = self._d[k]
+            f.write(struct.pack('<II', len(k), len(v)) + k + v)
+        f.truncate()
+        f.flush()
+
+    def close(self):
+        self.flush()
+
+    def __getitem__(self, k):
+        return self._d[bytes(k)]
+
+    def __setitem__(self, k, v):
+        self._d[bytes(k)] = bytes(v)
+
+    def __delitem__(self, k):
+        del self._d[bytes(k)]
+
+    def __contains__(self, k):
+        return bytes(k) in self._d
+
+    def get(self, k, default=None):
+        return self._d.get(bytes(k), default)
+
+    def _range(self, start, end, flags):
+        ks = sorted(self._d, reverse=bool(flags & DESC))
+        for k in ks:
+            if start is not None and (k > start if flags & DESC else k < start):
+                continue
+            if end is not None:
+                if flags & DESC:
+                    past = k < end or (k == end and not flags & INCL)
+                else:
+                    past = k > end or (k == end and not flags & INCL)
+                if past:
+                    break
+            yield k
+
+    def keys(self, start=None, end=None, flags=0):
+        return self._range(start, end, flags)
+
+    def values(self, start=None, end=None, flags=0):
+        return (self._d[k] for k in self._range(start, end, flags))
+
+    def items(self, start=None, end=None, flags=0):
+        return ((k, self._d[k]) for k in self._range(start, end, flags))
+
+    def __iter__(self):
+        return self._range(None, None, 0)
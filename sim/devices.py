@@ -0,0 +1,258 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''Virtual I2C bus and the devices the watermeter talks to.
+
+Transfers are modelled at the byte level: a memory write is the address
+bytes followed by the data, a memory read sets the address pointer with a
+write and then reads. Devices count what they are sent, so wear, bus
+time and display traffic can be measured, and the memories can lose
+power part way through a write.
+
+    from sim import devices
+    b = devices.bus()                   # the one on GPIO4/5
+    fram = b.attach(0x50, devices.FRAM())
+'''
+import errno
+import time as _time
+from array import array
+
+class PowerCut(Exception):
+    '''the power failed during a write; raised out of the transfer'''
+
+
+class Bus(object):
+    '''One I2C bus. Every machine.I2C on the same pins shares it.
+
+    bytes and transfers count traffic, including address bytes, and
+    bus_us is what it would take at freq. begin() and end() mark a
+    sequence of transfers that must not be split, eg. an OLED refresh;
+    a transfer made while two different sequences are open is counted in
+    interleaved.
+    '''
+
+    def __init__(self, freq=400000):
+        self.freq = freq
+        self.devices = {}
+        self.bytes = 0
+        self.transfers = 0
+        self.bus_us = 0.0
+        self.interleaved = 0
+        self._open = []
+        self.log = None     # set to a list to record (addr, nbytes, sequence)
+
+    def attach(self, addr, dev):
+        self.devices[addr] = dev
+        return dev
+
+    def begin(self, tag):
+        self._open.append(tag)
+
+    def end(self, tag):
+        self._open.remove(tag)
+
+    def _device(self, addr):
+        d = self.devices.get(addr)
+        if d is None or d.busy():
+            # nobody ACKed the address
+            raise OSError(errno.ENODEV)
+        return d
+
+    def _count(self, addr, n):
+        self.bytes += n + 1
+        self.transfers += 1
+        self.bus_us += (n + 1) * 9 * 1000000 / self.freq
+        if len(set(self._open)) > 1:
+            self.interleaved += 1
+        if self.log is not None:
+            self.log.append((addr, n, self._open[-1] if self._open else None))
+
+    def scan(self):
+        return sorted(a for a, d in self.devices.items() if not d.busy())
+
+    def write(self, addr, data, stop=True):
+        d = self._device(addr)
+        self._count(addr, len(data))
+        d.write(bytes(data), stop)
+        return len(data) + 1
+
+    def read(self, addr, buf):
+        d = self._device(addr)
+        self._count(addr, len(buf))
+        d.read(buf)
+
+
+class FRAM(object):
+    '''Ferroelectric RAM, eg. an MB85RC256V: no page size, no write delay'''
+
+    def __init__(self, size=32768):
+        self.mem = bytearray(size)
+        self.addr = 0
+        self.writes = 0
+        self.bytes_written = 0
+        self.cut = None     # bytes left before the power fails
+
+    def busy(self):
+        return False
+
+    def fail_after(self, n):
+        '''lose power after n more bytes have been stored'''
+        self.cut = n
+
+    def _store(self, i, b):
+        if self.cut is not None:
+            if self.cut == 0:
+                self.cut = None
+                raise PowerCut()
+            self.cut -= 1
+        self.mem[i] = b
+
+    def write(self, data, stop=True):
+        if len(data) >= 2:
+            self.addr = (data[0] << 8 | data[1]) % len(self.mem)
+        if len(data) > 2:
+            self.writes += 1
+        for b in data[2:]:
+            self._store(self.addr, b)
+            self.bytes_written += 1
+            self.addr = (self.addr + 1) % len(self.mem)
+
+    def read(self, buf):
+        n = len(self.mem)
+        for i in range(len(buf)):
+            buf[i] = self.mem[self.addr]
+            self.addr = (self.addr + 1) % n
+
+
+class EEPROM(FRAM):
+    '''24LCxx EEPROM with page writes and a write cycle.
+
+    Data written past the end of a page wraps to its start, as on the
+    real part. After each write the device doesn't answer for write_ms,
+    so the host has to poll for the ACK. cycles counts write cycles per
+    page, which is what wears out.
+    '''
+
+    def __init__(self, kbits=256, pagesize=64, write_ms=5):
+        super().__init__(kbits * 128)
+        self.mem[:] = b'\xff' * len(self.mem)
+        self.pagesize = pagesize
+        self.write_ms = write_ms
+        self.cycles = array('L', [0] * (len(self.mem) // pagesize))
+        self.naks = 0       # transfers refused during a write cycle
+        self._ready_at = 0.0
+
+    def busy(self):
+        if _time.perf_counter() < self._ready_at:
+            self.naks += 1
+            return True
+        return False
+
+    def wear(self):
+        '''the most write cycles any page has had'''
+        return max(self.cycles)
+
+    def write(self, data, stop=True):
+        if len(data) >= 2:
+            self.addr = (data[0] << 8 | data[1]) % len(self.mem)
+        if len(data) <= 2:
+            return
+        page = self.addr // self.pagesize
+        base = page * self.pagesize
+        off = self.addr % self.pagesize
+        self.writes += 1
+        self.cycles[page] += 1
+        self._ready_at = _time.perf_counter() + self.write_ms / 1000
+        for b in data[2:]:
+            self._store(base + off, b)
+            self.bytes_written += 1
+            off = (off + 1) % self.pagesize
+        self.addr = base + off
+
+
+# number of argument bytes of the SSD1306 commands the driver uses
+_SSD1306_ARGS = {0x20: 1, 0x21: 2, 0x22: 2, 0x81: 1, 0x8d: 1, 0xa8: 1,
+                 0xd3: 1, 0xd5: 1, 0xd9: 1, 0xda: 1, 0xdb: 1}
+
+class SSD1306(object):
+    '''SSD1306 OLED controller in horizontal addressing mode.
+
+    It keeps its own display RAM, so a test can check that what the host
+    sent adds up to the host's framebuffer. data_bytes counts pixel data,
+    cmd_bytes commands and their arguments.
+    '''
+
+    def __init__(self, width=128, height=32):
+        self.width = width
+        self.pages = height // 8
+        self.ram = bytearray(width * self.pages)
+        self.window = (0, width - 1, 0, self.pages - 1)
+        self.col = 0
+        self.page = 0
+        self.data_bytes = 0
+        self.cmd_bytes = 0
+        self.writes = 0
+        self._cmd = None
+        self._args = []
+
+    def busy(self):
+        return False
+
+    def read(self, buf):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+    def write(self, data, stop=True):
+        self.writes += 1
+        if not data:
+            return
+        if data[0] & 0x40:
+            for b in data[1:]:
+                self._data(b)
+        else:
+            for b in data[1:]:
+                self._command(b)
+
+    def _data(self, b):
+        c0, c1, p0, p1 = self.window
+        self.ram[self.page * self.width + self.col] = b
+        self.data_bytes += 1
+        self.col += 1
+        if self.col > c1:
+            self.col = c0
+            self.page += 1
+            if self.page > p1:
+                self.page = p0
+
+    def _command(self, b):
+        self.cmd_bytes += 1
+        if self._cmd is None:
+            if _SSD1306_ARGS.get(b, 0) == 0:
+                return
+            self._cmd = b
+            self._args = []
+            return
+        self._args.append(b)
+        if len(self._args) < _SSD1306_ARGS[self._cmd]:
+            return
+        c0, c1, p0, p1 = self.window
+        if self._cmd == 0x21:
+            c0, c1 = self._args
+            self.col = c0
+        elif self._cmd == 0x22:
+            p0, p1 = self._args
+            self.page = p0
+        self.window = (c0, c1, p0, p1)
+        self._cmd = None
+
+
+_buses = {}
+
+def bus(scl=4, sda=5):
+    '''the bus on these pins'''
+    k = (scl, sda)
+    if k not in _buses:
+        _buses[k] = Bus()
+    return _buses[k]
+
+def reset():
+    '''forget all buses and their devices'''
+    _buses.clear()
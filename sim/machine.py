@@ -0,0 +1,218 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''machine module for a virtual ESP8266 board.
+
+Pins are singletons per GPIO number, like the hardware they stand for.
+Pin.fire() delivers edges to the IRQ handler from the calling thread, and
+Pin.drive() from a thread of its own at the rates of a flow profile, so
+the handler interrupts whatever the main thread is doing. Timer callbacks
+are scheduled with micropython.schedule(), as the ESP8266 port does.
+'''
+import threading
+import time as _time
+from sim import utime, devices
+from sim import micropython
+
+
+class Pin(object):
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+
+    _pins = {}
+
+    def __new__(cls, id, *args, **kwargs):
+        p = cls._pins.get(id)
+        if p is None:
+            p = object.__new__(cls)
+            p.id = id
+            p._value = 1
+            p.handler = None
+            p.trigger = 0
+            p.edges = 0     # falling edges made
+            p.irqs = 0      # handler calls
+            p._stop = None
+            cls._pins[id] = p
+        return p
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self._value = value
+
+    def __repr__(self):
+        return 'Pin({})'.format(self.id)
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger
+
+    def fire(self, n=1):
+        '''n pulses: a falling edge, then a rising one'''
+        for _ in range(n):
+            self._value = 0
+            self.edges += 1
+            h = self.handler
+            if h is not None and self.trigger & self.IRQ_FALLING:
+                self.irqs += 1
+                h(self)
+            self._value = 1
+            if h is not None and self.trigger & self.IRQ_RISING:
+                self.irqs += 1
+                h(self)
+
+    def drive(self, profile, repeat=False):
+        '''pulse from a thread, per (seconds, hz) segment of profile'''
+        self.stop()
+        stop = self._stop = threading.Event()
+        def run():
+            while not stop.is_set():
+                for secs, hz in profile:
+                    end = _time.perf_counter() + secs
+                    if hz <= 0:
+                        stop.wait(secs)
+                        continue
+                    due = _time.perf_counter()
+                    while not stop.is_set() and due < end:
+                        due += 1 / hz
+                        d = due - _time.perf_counter()
+                        if d > 0:
+                            stop.wait(d)
+                        self.fire()
+                if not repeat:
+                    break
+        t = threading.Thread(target=run, daemon=True)
+        t.start()
+        return t
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    @classmethod
+    def reset(cls):
+        for p in cls._pins.values():
+            p.stop()
+        cls._pins.clear()
+
+
+def _pin_id(p):
+    return p.id if isinstance(p, Pin) else p
+
+class I2C(object):
+    '''I2C controller on a pair of pins; see sim.devices for the bus'''
+
+    def __init__(self, id=-1, scl=None, sda=None, freq=400000):
+        self.bus = devices.bus(_pin_id(scl), _pin_id(sda))
+
+    def scan(self):
+        return self.bus.scan()
+
+    def writeto(self, addr, buf, stop=True):
+        return self.bus.write(addr, buf, stop)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self.bus.read(addr, buf)
+
+    def readfrom(self, addr, n, stop=True):
+        buf = bytearray(n)
+        self.bus.read(addr, buf)
+        return bytes(buf)
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        a = memaddr.to_bytes(addrsize // 8, 'big')
+        self.bus.write(addr, a + bytes(buf))
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        self.bus.write(addr, memaddr.to_bytes(addrsize // 8, 'big'), False)
+        self.bus.read(addr, buf)
+
+    def readfrom_mem(self, addr, memaddr, n, addrsize=8):
+        buf = bytearray(n)
+        self.readfrom_mem_into(addr, memaddr, buf, addrsize)
+        return bytes(buf)
+
+
+class Timer(object):
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1):
+        self._stop = None
+
+    def init(self, period=1000, mode=PERIODIC, callback=None):
+        self.deinit()
+        stop = self._stop = threading.Event()
+        def run():
+            while not stop.wait(period / 1000):
+                try:
+                    micropython.schedule(callback, self)
+                except RuntimeError:
+                    pass
+                if mode == self.ONE_SHOT:
+                    break
+        threading.Thread(target=run, daemon=True).start()
+
+    def deinit(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+
+class RTC(object):
+    '''setting the date moves utime.time() to it'''
+
+    def datetime(self, dt=None):
+        if dt is None:
+            t = utime.localtime()
+            return (t[0], t[1], t[2], t[6] + 1, t[3], t[4], t[5], 0)
+        t = utime.mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0))
+        utime.offset += t - utime.time()
+
+    def memory(self, data=None):
+        return b''
+
+
+class WDT(object):
+    def __init__(self, id=0, timeout=5000):
+        self.feeds = 0
+        self.last_feed = utime.ticks_ms()
+
+    def feed(self):
+        self.feeds += 1
+        self.last_feed = utime.ticks_ms()
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+def reset_cause():
+    return 0
+
+def freq(f=None):
+    return 80000000
+
+def unique_id():
+    return b'\x5e\x1a\x0b\x01'
+
+def idle():
+    _time.sleep(0.001)
+
+def disable_irq():
+    return 0
+
+def enable_irq(state=0):
+    pass
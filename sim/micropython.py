@@ -0,0 +1,61 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''micropython module: schedule() and friends.
+
+Scheduled callbacks wait in a queue of depth entries, like the VM's, until
+run_scheduled() is called. The sim event loop calls it between tasks; the
+VM would run them at the next backward jump or function return, which
+sim.stress models more closely.
+'''
+import threading
+
+depth = 8
+_queue = []
+_lock = threading.Lock()
+_running = False
+
+def schedule(fn, arg):
+    with _lock:
+        if len(_queue) >= depth:
+            raise RuntimeError('schedule queue full')
+        _queue.append((fn, arg))
+
+def pending():
+    return len(_queue)
+
+def run_scheduled():
+    '''run the callbacks pending now, returning how many ran; ones they
+    schedule wait for the next call, so a flood can't hold the caller'''
+    global _running
+    if _running:
+        # callbacks don't run inside callbacks
+        return 0
+    _running = True
+    n = 0
+    try:
+        for _ in range(len(_queue)):
+            with _lock:
+                fn, arg = _queue.pop(0)
+            fn(arg)
+            n += 1
+    finally:
+        _running = False
+    return n
+
+def alloc_emergency_exception_buf(n):
+    pass
+
+def const(v):
+    return v
+
+def heap_lock():
+    pass
+
+def heap_unlock():
+    pass
+
+def mem_info(verbose=False):
+    import gc
+    print('stack: n/a\nGC: total: n/a, used: {}, free: {}'.format(gc.mem_alloc(), gc.mem_free()))
+
+def opt_level(level=None):
+    return 0
@@ -0,0 +1,57 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''network module: a WLAN that is connected to the host's loopback.
+
+The station interface connects as soon as it is active, unless link is
+False, and gets address. The netmask makes the broadcast address the
+interface's own, so announcements stay on the host.
+'''
+
+STA_IF = 0
+AP_IF = 1
+
+address = ('127.0.0.1', '255.255.255.255', '127.0.0.1', '127.0.0.1')
+link = True
+
+class WLAN(object):
+    _ifs = {}
+
+    def __new__(cls, interface=STA_IF):
+        w = cls._ifs.get(interface)
+        if w is None:
+            w = object.__new__(cls)
+            w.interface = interface
+            w._active = interface == AP_IF
+            w._config = {'mac': b'\x5e\x1a\x0b\x01\x02\x03', 'dhcp_hostname': 'espressif'}
+            w.ssid = None
+            cls._ifs[interface] = w
+        return w
+
+    def active(self, v=None):
+        if v is None:
+            return self._active
+        self._active = bool(v)
+
+    def connect(self, ssid=None, password=None):
+        self.ssid = ssid
+
+    def disconnect(self):
+        self.ssid = None
+
+    def isconnected(self):
+        return self.interface == STA_IF and self._active and link
+
+    def ifconfig(self, config=None):
+        if self.isconnected():
+            return address
+        return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def status(self):
+        return 5 if self.isconnected() else 0
+
+    def scan(self):
+        return []
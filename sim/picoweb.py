@@ -0,0 +1,81 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''picoweb module: enough of WebApp to serve the watermeter's routes.
+
+One request per connection, as picoweb does; routes match on the exact
+path.
+'''
+from sim import uasyncio as asyncio
+
+
+def start_response(writer, content_type='text/html', status='200', headers=None):
+    yield from writer.awrite('HTTP/1.0 {} NA\r\n'.format(status))
+    yield from writer.awrite('Content-Type: {}\r\n'.format(content_type))
+    if headers:
+        for k, v in headers.items():
+            yield from writer.awrite('{}: {}\r\n'.format(k, v))
+    yield from writer.awrite('\r\n')
+
+def http_error(writer, status):
+    yield from start_response(writer, status=status)
+    yield from writer.awrite(status)
+
+def jsonify(writer, d):
+    import json
+    yield from start_response(writer, 'application/json')
+    yield from writer.awrite(json.dumps(d))
+
+
+def _unquote(s):
+    import urllib.parse
+    return urllib.parse.unquote_plus(s)
+
+class HTTPRequest(object):
+
+    def parse_qs(self):
+        self.form = {}
+        for kv in self.qs.split('&'):
+            if kv:
+                k, _, v = kv.partition('=')
+                self.form[_unquote(k)] = _unquote(v)
+
+
+class WebApp(object):
+
+    def __init__(self, pkg, routes=None, serve_static=True):
+        self.url_map = routes or []
+
+    def route(self, url, **kwargs):
+        def _route(f):
+            self.url_map.append((url, f, kwargs))
+            return f
+        return _route
+
+    def _handle(self, reader, writer):
+        try:
+            line = yield from reader.readline()
+            if not line:
+                return
+            method, target, _ = line.decode().split()
+            req = HTTPRequest()
+            req.method = method
+            req.path, _, req.qs = target.partition('?')
+            req.headers = {}
+            while True:
+                line = yield from reader.readline()
+                if line in (b'', b'\r\n'):
+                    break
+                k, _, v = line.partition(b':')
+                req.headers[k] = v.strip()
+            for e in self.url_map:
+                if e[0] == req.path:
+                    yield from e[1](req, writer)
+                    break
+            else:
+                yield from http_error(writer, '404')
+        finally:
+            yield from writer.aclose()
+
+    def run(self, host='127.0.0.1', port=8081, debug=False, lazy_init=False, log=None):
+        loop = asyncio.get_event_loop()
+        loop.create_task(asyncio.start_server(self._handle, host, port))
+        loop.run_forever()
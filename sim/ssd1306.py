@@ -0,0 +1,113 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''ssd1306 module: the MicroPython driver's SSD1306_I2C, on the virtual bus.
+
+The framebuffer is MONO_VLSB, as framebuf's. text() draws made up 8x8
+glyphs, one per character code, so that different strings light
+different pixels, which is all the display code cares about.
+'''
+
+SET_CONTRAST = 0x81
+SET_NORM_INV = 0xa6
+SET_DISP = 0xae
+SET_MEM_ADDR = 0x20
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+_INIT = (0xae, 0x20, 0x00, 0x40, 0xa1, 0xa8, None, 0xc8, 0xd3, 0x00,
+         0xda, None, 0xd5, 0x80, 0xd9, 0xf1, 0xdb, 0x30, 0x81, 0xff,
+         0xa4, 0xa6, 0x8d, 0x14, 0xaf)
+
+def _glyph(c, j):
+    if c == 0x20 or j == 7:
+        return 0
+    return ((c * 0x9e3779b1) >> (3 * j)) & 0x7f | 1
+
+
+class SSD1306_I2C(object):
+
+    def __init__(self, width, height, i2c, addr=0x3c, external_vcc=False):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.i2c = i2c
+        self.addr = addr
+        self.buffer = bytearray(self.pages * width)
+        self.init_display()
+
+    def init_display(self):
+        for c in _INIT:
+            if c is None:
+                # the arguments that depend on the panel
+                c = self.height - 1 if self._last == 0xa8 else (0x02 if self.height == 32 else 0x12)
+            self.write_cmd(c)
+            self._last = c
+        self.fill(0)
+        self.show()
+
+    def write_cmd(self, cmd):
+        self.i2c.writeto(self.addr, bytes((0x80, cmd)))
+
+    def write_data(self, buf):
+        self.i2c.writeto(self.addr, b'\x40' + bytes(buf))
+
+    def poweroff(self):
+        self.write_cmd(SET_DISP | 0x00)
+
+    def poweron(self):
+        self.write_cmd(SET_DISP | 0x01)
+
+    def contrast(self, contrast):
+        self.write_cmd(SET_CONTRAST)
+        self.write_cmd(contrast)
+
+    def invert(self, invert):
+        self.write_cmd(SET_NORM_INV | (invert & 1))
+
+    def show(self):
+        self.write_cmd(SET_COL_ADDR)
+        self.write_cmd(0)
+        self.write_cmd(self.width - 1)
+        self.write_cmd(SET_PAGE_ADDR)
+        self.write_cmd(0)
+        self.write_cmd(self.pages - 1)
+        self.write_data(self.buffer)
+
+    # framebuf.FrameBuffer, MONO_VLSB
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        i = (y >> 3) * self.width + x
+        b = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buffer[i] & b else 0
+        if c:
+            self.buffer[i] |= b
+        else:
+            self.buffer[i] &= ~b & 0xff
+
+    def fill(self, c):
+        v = 0xff if c else 0
+        for i in range(len(self.buffer)):
+            self.buffer[i] = v
+
+    def fill_rect(self, x, y, w, h, c):
+        for xx in range(max(x, 0), min(x + w, self.width)):
+            for yy in range(max(y, 0), min(y + h, self.height)):
+                self.pixel(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def text(self, s, x, y, c=1):
+        for ch in s:
+            code = ord(ch)
+            for j in range(8):
+                col = _glyph(code, j)
+                for r in range(8):
+                    if col & (1 << r):
+                        self.pixel(x + j, y + r, c)
+            x += 8
@@ -0,0 +1,173 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''Stress the pulse path: edges at a given rate against the virtual board.
+
+    python3 -m sim.stress --rate 2000 --seconds 2
+
+Time is virtual. Every bytecode the watermeter executes moves the clock
+on by --us-per-op, and when an edge is due pulse_handler() runs right
+there, between two bytecodes, as the hard IRQ would. Scheduled callbacks
+run at backward jumps, as in the MicroPython VM, so the scheduled
+pulse_consumer() can land in the middle of a direct call to it. Between
+the direct calls the main loop would make, the board is busy in C for a
+while (I2C, sockets, gc), where nothing scheduled runs and edges pile up
+in the ring, and then idles.
+
+At the end every edge is accounted for: counted once, rejected by the
+edge filter, or dropped because the ring was full. Anything counted twice
+shows up as duplicated, anything that went missing otherwise as lost.
+'''
+import argparse
+import os
+import random
+import sys
+import sim
+
+_skip = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.dirname(_skip)
+
+
+class Stress(object):
+
+    def __init__(self, wm, pin, rate_hz, us_per_op, seed):
+        from sim import utime, micropython
+        self.wm = wm
+        self.pin = pin
+        self.period = 1000000 / rate_hz
+        self.us_per_op = us_per_op
+        self.rand = random.Random(seed)
+        self.run_scheduled = micropython.run_scheduled
+        self.us = utime.ticks_us()
+        self.due = self.us + self.next_interval()
+        self.edges = 0
+        self.nested = 0         # scheduled callbacks run inside a traced call
+        self._last = {}
+        utime.source = self
+
+    def __call__(self):
+        return int(self.us)
+
+    def next_interval(self):
+        # +-50% jitter around the nominal rate
+        return self.period * (0.5 + self.rand.random())
+
+    def edge(self):
+        self.edges += 1
+        self.pin.fire()
+        self.due += self.next_interval()
+
+    def tick(self, us):
+        '''let us of virtual time pass, with the edges that fall in it'''
+        self.us += us
+        while self.due <= self.us:
+            self.edge()
+
+    def busy(self, us):
+        '''time in C code: the IRQ fires, scheduled callbacks wait'''
+        self.tick(us)
+
+    def idle(self, us):
+        '''the main loop waiting: edges and scheduled callbacks'''
+        end = self.us + us
+        while self.due <= end:
+            self.us = self.due
+            self.edge()
+            self.call(self.run_scheduled)
+        self.us = end
+
+    def trace(self, frame, event, arg):
+        code = frame.f_code.co_filename
+        if not code.startswith(_root) or code.startswith(_skip):
+            return None
+        frame.f_trace_opcodes = True
+        return self.local
+
+    def local(self, frame, event, arg):
+        if event == 'opcode':
+            self.tick(self.us_per_op)
+            i = frame.f_lasti
+            if i < self._last.get(frame, -1):
+                # a backward jump: run what the IRQ scheduled, traced
+                self.nested += sys.call_tracing(self.run_scheduled, ())
+            self._last[frame] = i
+        elif event == 'return':
+            self._last.pop(frame, None)
+        return self.local
+
+    def call(self, fn, *args):
+        '''a direct call from the main loop, interruptible'''
+        sys.settrace(self.trace)
+        try:
+            return fn(*args)
+        finally:
+            sys.settrace(None)
+
+    def stop(self):
+        from sim import utime
+        utime.source = None
+
+
+def run(rate_hz=2000, seconds=1.0, us_per_op=1, seed=1, busy_ms=5, idle_ms=15, filter=False):
+    '''edges at rate_hz for seconds of virtual time; returns the counts'''
+    wm = sim.boot()
+    pin = wm.channel_pins[0]
+    f = wm.edge_filters[0]
+    holdoff, ratio = f.holdoff_us, f.ratio
+    if not filter:
+        f.holdoff_us = 0
+        f.ratio = 0
+    # start from an empty ring
+    wm.pulse_consumer()
+    ctr0, drops0, rejected0 = wm.pulse_ctr, wm.pulse_drops, f.rejected
+    s = Stress(wm, pin, rate_hz, us_per_op, seed)
+    try:
+        f.last_us = None
+        end = s.us + seconds * 1000000
+        while s.us < end:
+            # what the main loop does between waits, and the waits
+            s.busy(busy_ms * 1000)
+            s.call(wm.pulse_consumer)
+            s.call(wm.litres)
+            s.idle(idle_ms * 1000)
+        # the rest of the edges, untraced
+        s.run_scheduled()
+        wm.pulse_consumer()
+    finally:
+        s.stop()
+        f.holdoff_us, f.ratio = holdoff, ratio
+    r = {
+        'edges': s.edges,
+        'counted': wm.pulse_ctr - ctr0,
+        'dropped': wm.pulse_drops - drops0,
+        'rejected': f.rejected - rejected0,
+        'nested': s.nested,
+    }
+    extra = r['counted'] + r['dropped'] + r['rejected'] - r['edges']
+    r['duplicated'] = max(extra, 0)
+    r['lost'] = max(-extra, 0)
+    return r
+
+
+def main():
+    ap = argparse.ArgumentParser(description='stress the pulse path on a virtual board')
+    ap.add_argument('--rate', type=float, default=2000, help='edges per second [2000]')
+    ap.add_argument('--seconds', type=float, default=1.0, help='virtual seconds [1]')
+    ap.add_argument('--us-per-op', type=float, default=1.0,
+                    help='virtual microseconds per bytecode [1]')
+    ap.add_argument('--busy-ms', type=float, default=5,
+                    help='time per main loop pass in C, eg. I2C [5]')
+    ap.add_argument('--idle-ms', type=float, default=15,
+                    help='time per main loop pass waiting [15]')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--filter', action='store_true', help='leave the edge filter on')
+    args = ap.parse_args()
+
+    sim.install()
+    sim.board()
+    r = run(args.rate, args.seconds, args.us_per_op, args.seed,
+            args.busy_ms, args.idle_ms, args.filter)
+    print(' '.join('{} {}'.format(k, r[k]) for k in
+                   ('edges', 'counted', 'dropped', 'rejected', 'duplicated', 'lost', 'nested')))
+    return 1 if r['duplicated'] or r['lost'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''The part of uasyncio 2.x the watermeter uses, on host sockets.
+
+Tasks are generators. They yield sleep_ms()/sleep() requests, IORead or
+IOWrite to wait for a socket, or another generator to start it as a
+task. As in uasyncio 2.x, an exception that escapes a task stops the
+loop. Pending micropython.schedule() callbacks are run between tasks.
+'''
+import collections
+import heapq
+import itertools
+import select
+import socket
+import time as _time
+from sim import micropython
+
+
+class _Sleep(object):
+    def __init__(self, ms):
+        self.ms = ms
+
+class IORead(object):
+    def __init__(self, obj):
+        self.obj = obj
+
+class IOWrite(IORead):
+    pass
+
+class IOReadDone(IORead):
+    pass
+
+class IOWriteDone(IORead):
+    pass
+
+
+def sleep_ms(ms):
+    yield _Sleep(ms)
+
+def sleep(s):
+    yield _Sleep(int(s * 1000))
+
+
+def _now_ms():
+    return _time.monotonic() * 1000
+
+
+class EventLoop(object):
+
+    def __init__(self):
+        self._ready = collections.deque()
+        self._timers = []
+        self._seq = itertools.count()
+        self._readers = {}
+        self._writers = {}
+        self._stopped = False
+
+    def create_task(self, coro):
+        self._ready.append(coro)
+        return coro
+
+    def call_soon(self, fn, *args):
+        def call():
+            fn(*args)
+            yield
+        self.create_task(call())
+
+    def call_later_ms(self, ms, fn, *args):
+        def call():
+            yield _Sleep(ms)
+            fn(*args)
+        self.create_task(call())
+
+    def stop(self):
+        self._stopped = True
+
+    def run_forever(self):
+        self._stopped = False
+        while not self._stopped:
+            self.step()
+
+    def run_until_complete(self, coro):
+        result = []
+        def main():
+            result.append((yield from coro))
+            self.stop()
+        self.create_task(main())
+        self.run_forever()
+        return result[0] if result else None
+
+    def _resume(self, gen):
+        try:
+            req = next(gen)
+        except StopIteration:
+            return
+        if req is None or isinstance(req, (IOReadDone, IOWriteDone)):
+            self._ready.append(gen)
+        elif isinstance(req, _Sleep):
+            heapq.heappush(self._timers, (_now_ms() + req.ms, next(self._seq), gen))
+        elif isinstance(req, IOWrite):
+            self._writers[req.obj] = gen
+        elif isinstance(req, IORead):
+            self._readers[req.obj] = gen
+        else:
+            # a coroutine to run as a task of its own
+            self._ready.append(req)
+            self._ready.append(gen)
+
+    def step(self, max_wait_ms=10):
+        '''run what is ready, then wait up to max_wait_ms for timers or I/O'''
+        micropython.run_scheduled()
+        for _ in range(len(self._ready)):
+            self._resume(self._ready.popleft())
+        now = _now_ms()
+        while self._timers and self._timers[0][0] <= now:
+            self._ready.append(heapq.heappop(self._timers)[2])
+
+        # a socket closed under a waiting task wakes it, to find it closed
+        for m in (self._readers, self._writers):
+            for s in [s for s in m if s.fileno() < 0]:
+                self._ready.append(m.pop(s))
+
+        wait = 0 if self._ready else max_wait_ms
+        if self._timers:
+            wait = max(0, min(wait, self._timers[0][0] - now))
+        if not self._readers and not self._writers:
+            if wait:
+                _time.sleep(wait / 1000)
+            return
+        r, w, _ = select.select(list(self._readers), list(self._writers), [], wait / 1000)
+        for s in r:
+            self._ready.append(self._readers.pop(s))
+        for s in w:
+            self._ready.append(self._writers.pop(s))
+
+
+_loop = None
+
+def get_event_loop(*args):
+    global _loop
+    if _loop is None:
+        _loop = EventLoop()
+    return _loop
+
+def new_event_loop():
+    '''replace the loop, eg. between tests'''
+    global _loop
+    _loop = EventLoop()
+    return _loop
+
+
+class StreamReader(object):
+
+    def __init__(self, s):
+        self.s = s
+        self._buf = b''
+
+    def _recv(self, n=1024):
+        while True:
+            try:
+                return self.s.recv(n)
+            except BlockingIOError:
+                yield IORead(self.s)
+
+    def read(self, n=-1):
+        if not self._buf:
+            self._buf = yield from self._recv(1024 if n < 0 else n)
+        if n < 0:
+            n = len(self._buf)
+        r = self._buf[:n]
+        self._buf = self._buf[n:]
+        return r
+
+    def readinto(self, buf):
+        '''read what is available into buf, returning the count; 0 at EOF'''
+        if not self._buf:
+            self._buf = yield from self._recv(len(buf))
+        n = min(len(buf), len(self._buf))
+        buf[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def readexactly(self, n):
+        r = b''
+        while len(r) < n:
+            d = yield from self.read(n - len(r))
+            if not d:
+                break
+            r += d
+        return r
+
+    def readline(self):
+        while b'\n' not in self._buf:
+            d = yield from self._recv()
+            if not d:
+                break
+            self._buf += d
+        i = self._buf.find(b'\n') + 1 or len(self._buf)
+        r = self._buf[:i]
+        self._buf = self._buf[i:]
+        return r
+
+    def aclose(self):
+        yield IOReadDone(self.s)
+        self.s.close()
+
+
+class StreamWriter(object):
+
+    def __init__(self, s, extra=None):
+        self.s = s
+        self.extra = extra or {}
+
+    def get_extra_info(self, name, default=None):
+        return self.extra.get(name, default)
+
+    def awrite(self, buf, off=0, sz=-1):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        if sz < 0:
+            sz = len(buf) - off
+        mv = memoryview(buf)[off:off + sz]
+        while len(mv):
+            try:
+                n = self.s.send(mv)
+            except BlockingIOError:
+                yield IOWrite(self.s)
+                continue
+            mv = mv[n:]
+
+    def aclose(self):
+        yield IOWriteDone(self.s)
+        self.s.close()
+
+
+# listening sockets of start_server(), so that tests can find the port
+servers = []
+
+def start_server(client_coro, host, port, backlog=10):
+    ai = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+    s = socket.socket(ai[0], socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(ai[-1])
+    s.listen(backlog)
+    s.setblocking(False)
+    servers.append(s)
+    while True:
+        yield IORead(s)
+        try:
+            c, addr = s.accept()
+        except BlockingIOError:
+            continue
+        except OSError:
+            # closed by a test
+            return
+        c.setblocking(False)
+        yield client_coro(StreamReader(c), StreamWriter(c, {'peername': addr}))
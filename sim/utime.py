@@ -0,0 +1,61 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+'''time as MicroPython has it on the ESP8266.
+
+Wall time counts from 2000-01-01 and localtime() is UTC, as on the device.
+The ticks counters wrap at 2**30 like the device's, so code that forgets
+ticks_diff() fails here too. Everything else is the host's time module.
+'''
+import time as _time
+import calendar as _calendar
+from time import *
+
+EPOCH = 946684800           # 1970-01-01 to 2000-01-01
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+# microseconds since some fixed point; a test can put a virtual clock here
+source = None
+_t0 = _time.perf_counter()
+
+def _us():
+    if source is not None:
+        return source()
+    return int((_time.perf_counter() - _t0) * 1000000)
+
+def ticks_us():
+    return _us() & TICKS_MAX
+
+def ticks_ms():
+    return (_us() // 1000) & TICKS_MAX
+
+def ticks_cpu():
+    return ticks_us()
+
+def ticks_add(t, delta):
+    return (t + delta) & TICKS_MAX
+
+def ticks_diff(a, b):
+    return ((a - b + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+def sleep_ms(n):
+    _time.sleep(n / 1000)
+
+def sleep_us(n):
+    _time.sleep(n / 1000000)
+
+# seconds added to the host's time, see machine.RTC
+offset = 0
+
+def time():
+    return int(_time.time()) - EPOCH + offset
+
+def localtime(t=None):
+    if t is None:
+        t = time()
+    return tuple(_time.gmtime(int(t) + EPOCH))[:8]
+
+gmtime = localtime
+
+def mktime(t):
+    return _calendar.timegm(tuple(t[:6]) + (0, 0, 0)) - EPOCH
@@ -0,0 +1,11 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+# The tests run the device code on CPython, with the stand-ins from sim/
+# in place of the MicroPython modules.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sim
+sim.install()
+sim.board()
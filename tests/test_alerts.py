@@ -0,0 +1,122 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import pytest
+from alerts import Detector
+
+H = 3600
+DAY = 86400
+
+
+def test_continuous():
+    d = Detector(flow_minutes=10, gap_s=120)
+    # a pulse batch a minute, from 12:00
+    t0 = 12 * H
+    for m in range(10):
+        d.update(0.5, t0 + m * 60)
+    assert not d.continuous.active
+    assert d.continuous.value == 9
+    d.changed = False
+    d.update(0.5, t0 + 600)
+    assert d.continuous.active and d.changed
+    assert d.continuous.since == t0
+    assert d.continuous.raised == 1
+    assert d.summary() == 'continuous'
+    # still flowing, as far as check() can tell, until gap_s has passed
+    d.check(t0 + 600 + 120)
+    assert d.continuous.active
+    d.check(t0 + 600 + 121)
+    assert not d.continuous.active
+    assert d.summary() == ''
+
+def test_continuous_gap():
+    d = Detector(flow_minutes=10, gap_s=120)
+    # 8 minutes of batches 2 minutes apart, then a gap of more than gap_s,
+    # which starts a new run
+    for m in range(0, 10, 2):
+        d.update(0.5, m * 60)
+    for m in range(15, 25, 2):
+        d.update(0.5, m * 60)
+    assert not d.continuous.active
+    assert d.continuous.value == 8
+    # check() picks up a change of settings
+    d.flow_minutes = 5
+    d.check(24 * 60)
+    assert d.continuous.active
+    assert d.continuous.since == 15 * 60
+
+def test_quiet_wraps_midnight():
+    d = Detector(quiet=(22, 6), quiet_litres=1.0)
+    assert [h for h in range(24) if d.in_quiet(3 * DAY + h * H)] == \
+        [0, 1, 2, 3, 4, 5, 22, 23]
+    # daytime flow doesn't count
+    d.update(5.0, 12 * H)
+    assert not d.quiet_flow.active
+    d.check(22 * H)
+    # the litres add up across midnight
+    d.update(0.6, 23 * H)
+    assert not d.quiet_flow.active
+    d.update(0.6, DAY + 1 * H)
+    assert d.quiet_flow.active
+    assert d.quiet_flow.since == DAY + 1 * H
+    assert d.quiet_flow.value == pytest.approx(1.2)
+    d.check(DAY + 5 * H + 3599)
+    assert d.quiet_flow.active
+    # and start over the next quiet period
+    d.check(DAY + 6 * H)
+    assert not d.quiet_flow.active
+    d.update(0.6, DAY + 23 * H)
+    assert not d.quiet_flow.active
+    assert d.quiet_flow.raised == 1
+
+def test_no_quiet_hours():
+    d = Detector()
+    d.update(100.0, 3 * H)
+    assert not d.in_quiet(3 * H)
+    assert not d.quiet_flow.active
+
+def test_hourly_warmup():
+    d = Detector(warmup=3, factor=3.0, min_litres=20.0, alpha=0.25)
+    # 10 litres at 08:30 on two days, and 100 on the third, which isn't
+    # an alert while the hour has no baseline
+    for day, litres in ((0, 10.0), (1, 10.0), (2, 100.0)):
+        d.update(litres, day * DAY + 8 * H + 1800)
+        assert d.baseline(8) is None
+        assert not d.hourly.active
+    # folded when the hour ends, into a moving average
+    d.check(2 * DAY + 9 * H)
+    assert d.baseline(8) == pytest.approx(10 + 0.25 * 90)
+    # above factor times the baseline
+    t = 3 * DAY + 8 * H + 60
+    d.update(90.0, t)
+    assert not d.hourly.active
+    d.update(10.0, t + 60)
+    assert d.hourly.active
+    assert d.hourly.since == t + 60
+    assert d.hourly.value == pytest.approx(100.0)
+    # until the hour is over
+    d.check(3 * DAY + 9 * H)
+    assert not d.hourly.active
+    assert d.hourly.raised == 1
+
+def test_hourly_min_litres():
+    d = Detector(warmup=1, factor=3.0, min_litres=20.0)
+    d.update(1.0, 8 * H)
+    d.check(9 * H)
+    assert d.baseline(8) == 1.0
+    # three times the baseline, but less than min_litres
+    d.update(15.0, DAY + 8 * H)
+    assert not d.hourly.active
+    d.update(6.0, DAY + 8 * H + 10)
+    assert d.hourly.active
+
+def test_baseline_folds_empty_hours():
+    d = Detector(warmup=1, alpha=0.25)
+    d.update(5.0, 8 * H)
+    # nothing for days: every hour in between had no flow, and each hour of
+    # the day is folded at most once a day
+    d.update(1.0, 5 * DAY + 8 * H)
+    for h in range(24):
+        if h != 8:
+            assert d.baseline(h) == 0.0
+    # hour 8 was 5 litres on day 0, and none on day 1
+    assert d.baseline(8) == pytest.approx(5 + 0.25 * (0 - 5))
+    assert Detector(warmup=2).baseline(8) is None
@@ -0,0 +1,87 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import pytest
+from machine import I2C, Pin
+from sim import devices, utime
+from arbiter import Arbiter, PRIO_PERSIST, PRIO_DISPLAY
+
+
+@pytest.fixture
+def bus():
+    '''a bus of its own with an FRAM and an OLED, and a clock that is the
+    bus time, so that the arbiter's accounting can be checked against it'''
+    b = I2C(scl=Pin(22), sda=Pin(23))
+    b.bus.attach(0x50, devices.FRAM())
+    b.bus.attach(0x3c, devices.SSD1306())
+    utime.source = lambda: int(b.bus.bus_us)
+    yield b
+    utime.source = None
+    del devices._buses[(22, 23)]
+
+def oled_job(b, during=None):
+    '''an OLED refresh: set the window, then send a page at a time. The
+    timer callback in during lands after the first page.'''
+    def job():
+        b.bus.begin('oled')
+        b.writeto(0x3c, b'\x00\x21\x00\x7f\x22\x00\x03')
+        for page in range(4):
+            b.writeto(0x3c, b'\x40' + bytes(128))
+            if page == 0 and during is not None:
+                during()
+        b.bus.end('oled')
+    return job
+
+def save_job(b, n=64):
+    def job():
+        b.bus.begin('fram')
+        b.writeto_mem(0x50, 0, bytes(n), addrsize=16)
+        b.readfrom_mem(0x50, 0, 4, addrsize=16)
+        b.bus.end('fram')
+    return job
+
+
+def test_unarbitrated_interleaves(bus):
+    # the hazard: a save from a timer callback in the middle of a refresh
+    oled_job(bus, save_job(bus))()
+    assert bus.bus.interleaved > 0
+
+def test_callback_is_queued(bus):
+    a = Arbiter()
+    bus.bus.log = []
+    ran = []
+    def callback():
+        ran.append(a.submit('state', PRIO_PERSIST, save_job(bus), 'fram'))
+    assert a.submit('oled', PRIO_DISPLAY, oled_job(bus, callback), 'oled')
+    assert ran == [False]
+    assert bus.bus.interleaved == 0
+    # the save ran once the refresh was done
+    tags = [t for _, _, t in bus.bus.log]
+    assert tags == ['oled'] * 5 + ['fram'] * 3
+    assert a.stats['fram'][3] == 1
+
+def test_queue_by_priority(bus):
+    a = Arbiter()
+    order = []
+    def during():
+        a.submit('oled', PRIO_DISPLAY, lambda: order.append('oled'), 'oled')
+        a.submit('history', PRIO_PERSIST, lambda: order.append('history'), 'fram')
+        # replaces the queued refresh
+        a.submit('oled', PRIO_DISPLAY, lambda: order.append('oled2'), 'oled')
+    a.submit('state', PRIO_PERSIST, during, 'fram')
+    assert order == ['history', 'oled2']
+    assert not a.busy
+
+def test_time_per_device(bus):
+    # bus time adds up per device, whatever the jobs are called
+    a = Arbiter()
+    a.submit('state', PRIO_PERSIST, save_job(bus, 64), 'fram')
+    a.submit('history', PRIO_PERSIST, save_job(bus, 32), 'fram')
+    fram_us = bus.bus.bus_us
+    a.submit('oled', PRIO_DISPLAY, oled_job(bus), 'oled')
+    oled_us = bus.bus.bus_us - fram_us
+    assert sorted(a.stats) == ['fram', 'oled']
+    assert a.stats['fram'][0] == 2
+    assert a.stats['fram'][1] == pytest.approx(fram_us, abs=2)
+    assert a.stats['oled'][1] == pytest.approx(oled_us, abs=2)
+    # a job naming no device is accounted under its name
+    a.submit('misc', PRIO_PERSIST, lambda: None)
+    assert a.stats['misc'][0] == 1
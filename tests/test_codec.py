@@ -0,0 +1,46 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import struct
+import db
+
+
+def state(**kw):
+    d = dict(db.DB_generic.defaults)
+    d.update(kw)
+    return d
+
+def test_round_trip():
+    c = db.DB_generic()
+    buf = bytearray(c.codec_size)
+    d = state(usage=1305, hostname='kitchen', indicator='oled', volume_ml=1958)
+    assert c.encode(d, buf, now=600000000) == 600000000
+    got = db.DB_generic().decode(buf)
+    for k in ('usage', 'hostname', 'indicator', 'volume_ml', 'metric'):
+        assert got[k] == d[k]
+    assert got['last_save_time'] == 600000000
+    assert abs(got['ml_per_pulse'] - 1.5) < 1e-6
+
+def test_hostname_is_cached():
+    c = db.DB_generic()
+    buf = bytearray(c.codec_size)
+    d = state(hostname='kitchen')
+    c.encode(d, buf, now=0)
+    b = c._host_bytes
+    c.encode(d, buf, now=1)
+    assert c._host_bytes is b
+    # loading what was saved gives back the same str, without decoding it
+    h = c.decode(buf)['hostname']
+    assert h == 'kitchen'
+    assert c.decode(buf)['hostname'] is h
+    # a new name is picked up by both
+    d['hostname'] = 'garden'
+    c.encode(d, buf, now=2)
+    assert c.decode(buf)['hostname'] == 'garden'
+    assert db.DB_generic().decode(buf)['hostname'] == 'garden'
+
+def test_v1_record():
+    c = db.DB_generic()
+    buf = bytearray(c.codec_size)
+    struct.pack_into(c._codec_v1_fmt, buf, 0, 1, 1, 1, 100, 2.0, 5, b'old')
+    d = c.decode(buf)
+    assert d['hostname'] == 'old'
+    assert d['volume_ml'] == 200
@@ -0,0 +1,83 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import pytest
+from machine import I2C, Pin
+from sim import devices
+import sim
+import db
+from curve import Curve
+
+
+def test_k_interpolates():
+    c = Curve([(10, 1.2), (0, 1.5), (20, 1.3)])
+    assert c.points == [(0.0, 1.5), (10.0, 1.2), (20.0, 1.3)]
+    assert c.k(0) == pytest.approx(1.5)
+    assert c.k(5) == pytest.approx(1.35)
+    assert c.k(10) == pytest.approx(1.2)
+    assert c.k(15) == pytest.approx(1.25)
+    # held level outside the points
+    assert c.k(100) == pytest.approx(1.3)
+    assert Curve([(5, 1.4), (10, 1.2)]).k(1) == pytest.approx(1.4)
+
+def test_one_point():
+    c = Curve([(3, 1.25)])
+    assert c.k(0) == c.k(3) == c.k(50) == pytest.approx(1.25)
+
+def test_no_points():
+    with pytest.raises(ValueError):
+        Curve([])
+
+def test_parse():
+    assert Curve.parse('0:1.5,10:1.2') == [(0.0, 1.5), (10.0, 1.2)]
+    for s in ('', '0', '0:0', '-1:1.5', '0:-1', '0:1.5,x:1', '0:inf', 'nan:1.5'):
+        with pytest.raises(ValueError):
+            Curve.parse(s)
+
+
+def test_accumulate():
+    # batches at different rates add up at the calibration of their rate,
+    # carrying the fraction of a ml from one batch to the next
+    wm = sim.boot()
+    saved = wm.curve, wm.vol_frac, wm.state['volume_ml']
+    try:
+        wm.curve = Curve([(0, 1.5), (10, 1.0)])
+        wm.vol_frac = 0.0
+        wm.state['volume_ml'] = 0
+        for hz, n in ((0, 3), (10, 7), (5, 1), (20, 2)):
+            wm.flow.hz = lambda now_us=None, hz=hz: hz
+            wm.accumulate(n)
+        ml = 3 * 1.5 + 7 * 1.0 + 1.25 + 2 * 1.0
+        assert wm.state['volume_ml'] == int(ml)
+        assert wm.state['volume_ml'] + wm.vol_frac == pytest.approx(ml)
+        assert 0 <= wm.vol_frac < 1
+    finally:
+        wm.curve, wm.vol_frac, wm.state['volume_ml'] = saved
+        del wm.flow.hz
+
+
+def curve_db():
+    b = I2C(scl=Pin(26), sda=Pin(27))
+    fram = b.bus.attach(0x50, devices.FRAM(1024))
+    return db.DB_curve(bus=b, memaddr=512), fram
+
+def test_db_round_trip():
+    c, _ = curve_db()
+    c.save({'points': [(0, 1.5), (10, 1.2)]})
+    p = c.load()['points']
+    assert [(h, round(k, 4)) for h, k in p] == [(0.0, 1.5), (10.0, 1.2)]
+    c.save({'points': []})
+    assert c.load() == {'points': []}
+
+def test_db_at_most_max_points():
+    c, _ = curve_db()
+    c.save({'points': [(i, 1.0 + i / 10) for i in range(10)]})
+    assert len(c.load()['points']) == c.max_points
+
+def test_db_blank_or_torn():
+    c, fram = curve_db()
+    assert c.load() == {'points': []}
+    c.save({'points': [(0, 1.5)]})
+    fram.fail_after(10)
+    with pytest.raises(devices.PowerCut):
+        c.save({'points': [(0, 1.1), (5, 1.3)]})
+    # half old, half new: the CRC fails and there is no curve
+    assert c.load() == {'points': []}
@@ -0,0 +1,101 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import socket
+import time
+import pytest
+from discovery import Discovery, calculate_broadcast
+
+
+class Net(object):
+    '''an interface on loopback, whose broadcast address is its own'''
+
+    def __init__(self):
+        self.config = ('127.0.0.1', '255.255.255.255', '127.0.0.1', '127.0.0.1')
+
+    def ifconfig(self):
+        return self.config
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+@pytest.fixture
+def disco():
+    net = Net()
+    d = Discovery(net, http_port=8080, uuid='5e1a0b01', port=free_port())
+    c = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    c.settimeout(2)
+    yield d, net, c
+    c.close()
+    d.close()
+
+def announcement(d):
+    '''the announcement d sent to itself, over loopback'''
+    d._sock.setblocking(True)
+    d._sock.settimeout(2)
+    try:
+        return d._sock.recvfrom(512)[0]
+    finally:
+        d._sock.setblocking(False)
+
+
+def test_broadcast_address():
+    assert calculate_broadcast('192.168.1.23', '255.255.255.0') == '192.168.1.255'
+    assert calculate_broadcast('10.1.2.3', '255.0.0.0') == '10.255.255.255'
+
+def test_announce_and_back_off(disco):
+    d, net, _ = disco
+    assert d.poll(0)
+    assert announcement(d) == b'watermeter running on http://127.0.0.1'
+    sent = [0]
+    for now in range(1, 2000):
+        if d.poll(now):
+            sent.append(now)
+            announcement(d)
+    # every 30 s at first, doubling up to 900 s
+    gaps = [b - a for a, b in zip(sent, sent[1:])]
+    assert gaps == [30, 60, 120, 240, 480, 900]
+    assert d.announced == len(sent)
+
+def test_m_search(disco):
+    d, net, c = disco
+    d.poll(0)
+    announcement(d)
+    c.sendto(b'M-SEARCH * HTTP/1.1\r\nST: ' + Discovery.ST + b'\r\n\r\n', ('127.0.0.1', d._port))
+    # not yet due to announce, but queries are answered on every poll
+    assert not d.poll(1)
+    data = c.recv(512)
+    assert data.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'LOCATION: http://127.0.0.1:8080/\r\n' in data
+    assert b'USN: uuid:5e1a0b01::' + Discovery.ST in data
+    assert d.answered == 1
+    # queries for something else are not
+    c.sendto(b'M-SEARCH * HTTP/1.1\r\nST: urn:other:device\r\n\r\n', ('127.0.0.1', d._port))
+    c.sendto(b'M-SEARCH * HTTP/1.1\r\nST: ssdp:all\r\n\r\n', ('127.0.0.1', d._port))
+    for _ in range(200):
+        d.poll(2)
+        if d.answered == 2:
+            break
+        time.sleep(0.01)
+    assert c.recv(512).startswith(b'HTTP/1.1 200 OK')
+    assert d.answered == 2
+
+def test_status_and_address_changes(disco):
+    d, net, _ = disco
+    d.poll(0)
+    announcement(d)
+    d.poll(30)
+    announcement(d)
+    # a status goes out at once, and the backoff starts over
+    d.set_status('continuous')
+    assert d.poll(31)
+    assert announcement(d) == b'watermeter running on http://127.0.0.1 alert=continuous'
+    assert not d.poll(60)
+    assert d.poll(61)
+    announcement(d)
+    # no address, no announcements
+    net.config = ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
+    assert not d.poll(1000)
+    assert d.ip == '0.0.0.0'
@@ -0,0 +1,118 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import random
+import pytest
+from machine import I2C, Pin
+from sim import devices
+import ssd1306
+from display import Display
+
+
+@pytest.fixture
+def oled():
+    '''a 128x32 OLED on a bus of its own, returning (Display, device)'''
+    b = I2C(scl=Pin(24), sda=Pin(25))
+    dev = b.bus.attach(0x3c, devices.SSD1306(128, 32))
+    o = ssd1306.SSD1306_I2C(128, 32, b)
+    yield Display(o), dev
+    del devices._buses[(24, 25)]
+
+def changed(old, new, width=128):
+    '''the whole characters a page needs sent: (x0, x1) or None'''
+    cols = [x for x in range(width) if old[x] != new[x]]
+    if not cols:
+        return None
+    return cols[0] // 8 * 8, cols[-1] // 8 * 8 + 7
+
+def show(d, dev):
+    '''show(), returning the pixel bytes it sent'''
+    n = dev.data_bytes
+    sent = d.bytes_sent
+    d.show()
+    assert dev.data_bytes - n == d.bytes_sent - sent
+    return dev.data_bytes - n
+
+
+def test_one_character(oled):
+    d, dev = oled
+    d.line(1, 'total 123.4 L')
+    show(d, dev)
+    d.line(1, 'total 123.5 L')
+    assert (d._x0[1], d._x1[1]) == (80, 87)
+    assert show(d, dev) == 8
+    assert dev.ram == d._oled.buffer
+    # the same text again sends nothing
+    writes = dev.writes
+    d.line(1, 'total 123.5 L')
+    assert show(d, dev) == 0
+    assert dev.writes == writes
+
+def test_shorter_line_is_cleared(oled):
+    d, dev = oled
+    d.line(0, '12.5 l/min')
+    show(d, dev)
+    d.line(0, '9 l/min')
+    show(d, dev)
+    assert dev.ram == d._oled.buffer
+    # nothing is left lit past the new text
+    assert not any(dev.ram[7 * 8:128])
+
+def test_blank_changes_send_nothing(oled):
+    # past the right edge, and trailing spaces against no text at all
+    d, dev = oled
+    d.line(0, '0123456789abcdef')
+    d.line(1, 'abc   ')
+    show(d, dev)
+    d.line(0, '0123456789abcdefXYZ')
+    d.line(1, 'abc')
+    assert show(d, dev) == 0
+    d.line(1, 'abc  x')
+    assert show(d, dev) == 8
+    assert dev.ram == d._oled.buffer
+
+def test_changes_add_up(oled):
+    # two changes to a row before a show go out as one range
+    d, dev = oled
+    d.line(2, 'abcdefgh')
+    show(d, dev)
+    d.line(2, 'Xbcdefgh')
+    d.line(2, 'XbcdefgY')
+    assert show(d, dev) == 64
+    assert dev.ram == d._oled.buffer
+
+@pytest.mark.parametrize('seed', range(3))
+def test_random_lines(oled, seed):
+    # whatever is drawn, the device ends up with the framebuffer, and each
+    # page is sent from the first to the last character that changed
+    d, dev = oled
+    rand = random.Random(seed)
+    buf = d._oled.buffer
+    for _ in range(200):
+        before = bytes(buf)
+        for row in rand.sample(range(4), rand.randint(1, 4)):
+            old = d._rows[row]
+            if old and rand.random() < 0.7:
+                # change a character or two
+                s = list(old)
+                for _ in range(rand.randint(1, 2)):
+                    s[rand.randrange(len(s))] = rand.choice('0123456789.')
+                s = ''.join(s)
+            else:
+                s = ''.join(rand.choice('0123456789 .Llmin/') for _ in range(rand.randint(0, 20)))
+            d.line(row, s)
+        want = 0
+        for p in range(4):
+            r = changed(before[p * 128:p * 128 + 128], buf[p * 128:p * 128 + 128])
+            if r:
+                want += r[1] - r[0] + 1
+        assert show(d, dev) == want
+        assert dev.ram == buf
+
+def test_clear(oled):
+    d, dev = oled
+    d.line(3, 'alert')
+    d.show()
+    n = d.bytes_sent
+    d.clear()
+    assert d.bytes_sent - n == 512
+    assert not any(dev.ram)
+    assert d._rows == [''] * 4
@@ -0,0 +1,67 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import pytest
+from machine import I2C, Pin
+from sim import devices
+import db
+
+def eeprom(write_ms=0, memaddr=0):
+    '''a DB_eeprom on a 24LC32 of its own: 4 KB, 32 byte pages'''
+    b = I2C(scl=Pin(16), sda=Pin(17))
+    chip = b.bus.attach(0x50, devices.EEPROM(kbits=32, pagesize=32, write_ms=write_ms))
+    return db.DB_eeprom(bus=b, device_kbits=32, pagesize=32, memaddr=memaddr), chip
+
+def state(usage):
+    d = dict(db.DB_generic.defaults)
+    d['usage'] = usage
+    return d
+
+
+def test_layout():
+    e, _ = eeprom(memaddr=40)
+    assert e._recsize == 64
+    assert e._memaddr == 64
+    assert e._slots == (4096 - 64) // 64
+
+def test_missing_device():
+    b = I2C(scl=Pin(18), sda=Pin(19))
+    with pytest.raises(IOError):
+        db.DB_eeprom(bus=b)
+
+def test_wear_is_spread():
+    # every slot takes its turn, so after n passes over the device no page
+    # has had more than n write cycles, and only whole pages are written
+    e, chip = eeprom()
+    passes = 3
+    for usage in range(1, e._slots * passes + 1):
+        e.save(state(usage))
+    pages = e._recsize // e.pagesize
+    assert chip.writes == e._slots * passes * pages
+    assert chip.bytes_written == chip.writes * e.pagesize
+    assert e.page_writes == chip.writes
+    assert chip.wear() == passes
+    # the pages before memaddr are never touched
+    assert not any(chip.cycles[:e._memaddr // e.pagesize])
+    assert e.load()['usage'] == e._slots * passes
+
+def test_polls_for_write_cycle():
+    # with a real write cycle the device NAKs until it is done, and saves
+    # still land
+    e, chip = eeprom(write_ms=2)
+    for usage in range(1, 6):
+        e.save(state(usage))
+    assert chip.naks > 0
+    e2 = db.DB_eeprom(bus=e._bus, device_kbits=32, pagesize=32)
+    assert e2.load()['usage'] == 5
+
+def test_torn_page_write():
+    e, chip = eeprom()
+    for usage in range(1, 10):
+        e.save(state(usage))
+    # lose power in the second page of the next record
+    chip.fail_after(e.pagesize + 3)
+    with pytest.raises(devices.PowerCut):
+        e.save(state(10))
+    e2 = db.DB_eeprom(bus=e._bus, device_kbits=32, pagesize=32)
+    assert e2.load()['usage'] == 9
+    e2.save(state(11))
+    assert e2.load()['usage'] == 11
@@ -0,0 +1,169 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import socket
+import threading
+import time
+import pytest
+import uasyncio as asyncio
+import httpd
+
+app = httpd.App()
+
+@app.route('/hello')
+def hello(req, resp):
+    req.parse_qs()
+    body = 'hello {}'.format(req.form.get('name', 'world')).encode()
+    yield from resp.start('text/plain', '200', len(body))
+    yield from resp.awrite(body)
+
+@app.route('/big')
+def big(req, resp):
+    # too long to be put together with the head in the buffer
+    body = bytearray(b'x' * 1000)
+    yield from resp.start('text/plain', '200', len(body))
+    yield from resp.awrite(body, 500)
+    yield from resp.awrite(memoryview(body)[:500])
+
+@app.route('/boom')
+def boom(req, resp):
+    float('inf') * 0 + int(float('inf'))
+    yield
+
+
+@pytest.fixture
+def server():
+    srv = httpd.Server(app.url_map, max_conn=2, hdr_size=256, timeout_ms=300)
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    loop = asyncio.new_event_loop()
+    t = threading.Thread(target=srv.run, args=('127.0.0.1', port), daemon=True)
+    t.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.01)
+    # the probe above took a slot until it was seen closed
+    wait(lambda: not srv._idle)
+    yield srv, port
+    loop.stop()
+    t.join(1)
+    for ls in asyncio.servers:
+        ls.close()
+    del asyncio.servers[:]
+
+def wait(cond, secs=3):
+    end = time.time() + secs
+    while not cond():
+        assert time.time() < end
+        time.sleep(0.01)
+
+class Client(object):
+
+    def __init__(self, port):
+        self.s = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.rfile = self.s.makefile('rb')
+
+    def sendall(self, data):
+        self.s.sendall(data)
+
+    def recv(self, n):
+        return self.s.recv(n)
+
+    def close(self):
+        self.rfile.close()
+        self.s.close()
+
+connect = Client
+
+def response(c):
+    '''(status, headers, body) of the next response on c, None if closed'''
+    line = c.rfile.readline()
+    if not line:
+        return None
+    status = int(line.split()[1])
+    headers = {}
+    while True:
+        line = c.rfile.readline()
+        if line in (b'\r\n', b''):
+            break
+        k, _, v = line.decode().partition(':')
+        headers[k.lower()] = v.strip()
+    n = int(headers.get('content-length', 0))
+    return status, headers, c.rfile.read(n)
+
+
+def test_keep_alive(server):
+    srv, port = server
+    c = connect(port)
+    for name in ('a', 'b'):
+        c.sendall('GET /hello?name={} HTTP/1.1\r\n\r\n'.format(name).encode())
+        status, headers, body = response(c)
+        assert status == 200
+        assert headers['connection'] == 'keep-alive'
+        assert body == 'hello {}'.format(name).encode()
+    assert srv.requests == 2
+    c.close()
+
+def test_short_and_long_bodies(server):
+    srv, port = server
+    c = connect(port)
+    for path, n in ((b'/hello', 11), (b'/big', 1000), (b'/hello', 11)):
+        c.sendall(b'GET ' + path + b' HTTP/1.1\r\n\r\n')
+        status, headers, body = response(c)
+        assert status == 200
+        assert len(body) == n == int(headers['content-length'])
+    c.close()
+
+def test_pipelined_requests_in_one_segment(server):
+    srv, port = server
+    c = connect(port)
+    c.sendall(b'GET /hello?name=a HTTP/1.1\r\nX-Thing: 1\r\n\r\n'
+              b'GET /hello?name=b HTTP/1.1\r\nConnection: close\r\n\r\n')
+    assert response(c)[2] == b'hello a'
+    status, headers, body = response(c)
+    assert body == b'hello b'
+    assert headers['connection'] == 'close'
+    assert response(c) is None
+
+def test_handler_error_answers_500_and_frees_the_slot(server):
+    srv, port = server
+    c = connect(port)
+    c.sendall(b'GET /boom HTTP/1.1\r\n\r\n')
+    assert response(c)[0] == 500
+    assert response(c) is None
+    assert srv.errors == 1
+    wait(lambda: not srv._idle and len(srv._free) == 3)
+
+def test_head_too_large(server):
+    srv, port = server
+    c = connect(port)
+    # fills the 256 byte buffer without ending the head; more would be
+    # left unread, and the close would reset the connection
+    head = b'GET /hello HTTP/1.1\r\nX-Pad: '
+    c.sendall(head + b'x' * (256 - len(head)))
+    assert response(c)[0] == 431
+    assert response(c) is None
+
+def test_silent_connections_are_evicted(server):
+    srv, port = server
+    silent = [connect(port) for _ in range(2)]
+    wait(lambda: len(srv._idle) == 2)
+    c = connect(port)
+    c.sendall(b'GET /hello HTTP/1.1\r\n\r\n')
+    assert response(c)[0] == 200
+    assert srv.evicted == 1
+    assert silent[0].recv(1) == b''
+
+def test_silent_connections_time_out(server):
+    srv, port = server
+    # a silent one, and one that never finishes its request
+    silent = connect(port)
+    slow = connect(port)
+    slow.sendall(b'GET /hello HTTP/1.1\r\nX-Slow: ')
+    assert silent.recv(1) == b''
+    assert slow.recv(1) == b''
+    assert srv.timeouts == 2
+    wait(lambda: not srv._idle)
@@ -0,0 +1,73 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import random
+import pytest
+from machine import I2C, Pin
+from sim import devices
+import db
+
+def journal(fram=None):
+    '''a DB_journal on an FRAM of its own: 1 KB, 16 records'''
+    b = I2C(scl=Pin(14), sda=Pin(15))
+    if fram is None:
+        fram = b.bus.attach(0x50, devices.FRAM(1024))
+    return db.DB_journal(bus=b, device_kbits=8), fram
+
+def state(usage):
+    d = dict(db.DB_generic.defaults)
+    d['usage'] = usage
+    return d
+
+
+def test_blank_device():
+    j, _ = journal()
+    assert j._find_newest() is None
+    assert j.load()['usage'] == 0
+
+@pytest.mark.parametrize('seed', range(5))
+def test_power_cut_fuzz(seed):
+    # saves, some of them cut short at a random byte, each cut followed by
+    # a reboot: load() must come back with the last complete save, or the
+    # one that was cut if it got through after all
+    rand = random.Random(seed)
+    j, fram = journal()
+    if seed == 4:
+        # and across the sequence number wrapping
+        j._seq = 0xffffffff - 40
+    saved = 0
+    for usage in range(1, 400):
+        cut = rand.random() < 0.3
+        if cut:
+            fram.fail_after(rand.randrange(j._recsize))
+        try:
+            j.save(state(usage))
+            saved = usage
+        except devices.PowerCut:
+            pass
+        if cut:
+            fram.cut = None
+            j, _ = journal(fram)
+            got = j.load()['usage']
+            assert got in (saved, usage)
+            saved = got
+            if saved:
+                assert j._find_newest() == j._slot
+        assert j.load()['usage'] == saved
+
+def test_torn_first_slot_after_wrap():
+    j, fram = journal()
+    for usage in range(1, j._slots + 1):
+        j.save(state(usage))
+    # the next save goes to slot 0, and is torn
+    fram.fail_after(10)
+    with pytest.raises(devices.PowerCut):
+        j.save(state(99))
+    j, _ = journal(fram)
+    assert j._find_newest() == j._slots - 1
+    assert j.load()['usage'] == j._slots
+
+def test_save_is_stamped_with_the_time_given():
+    j, _ = journal()
+    d = state(5)
+    j.save(d, 1234567)
+    assert d['last_save_time'] == 1234567
+    assert j.load()['last_save_time'] == 1234567
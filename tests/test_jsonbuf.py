@@ -0,0 +1,34 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import json
+import random
+from jsonbuf import JSONWriter
+
+def text(w):
+    return bytes(w.buf[:w.n])
+
+
+def test_non_finite_floats_are_null():
+    w = JSONWriter()
+    w.arr()
+    for v in (float('nan'), float('inf'), float('-inf'), -0.5):
+        w.val(v, 2)
+    w.end()
+    assert json.loads(text(w)) == [None, None, None, -0.5]
+
+def test_strings_round_trip():
+    rand = random.Random(1)
+    w = JSONWriter(16)
+    for _ in range(200):
+        s = ''.join(chr(rand.randrange(0x80)) for _ in range(rand.randrange(20)))
+        w.obj().item(s, s).end()
+        assert json.loads(text(w)) == {s: s}
+
+def test_nesting_and_growth():
+    w = JSONWriter(8)
+    w.obj().item('n', 12345).key('a').sub_arr()
+    for i in range(50):
+        w.sub_obj().item('i', i).item('x', i / 8, 3).end()
+    w.end().item('t', True).end()
+    d = json.loads(text(w))
+    assert d['n'] == 12345 and d['t'] is True
+    assert d['a'][49] == {'i': 49, 'x': 6.125}
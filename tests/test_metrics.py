@@ -0,0 +1,16 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+from metrics import Exposition
+
+def samples(e):
+    return [float(l.split()[1]) for l in bytes(e.buf).decode().splitlines()
+            if not l.startswith('#')]
+
+
+def test_set_signed():
+    e = Exposition((('a', 'gauge', 'A', 3), ('b', 'counter', 'B', 0)), width=10)
+    e.set(0, -1.25)
+    e.set(1, 42)
+    assert samples(e) == [-1.25, 42]
+    assert b'\na -00001.250\n' in e.buf
+    e.set(0, 0.5)
+    assert samples(e) == [0.5, 42]
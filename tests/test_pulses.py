@@ -0,0 +1,20 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+from sim import stress
+
+
+def test_scheduled_drain_inside_direct_call():
+    r = stress.run(rate_hz=500, seconds=0.5)
+    # the scheduled consumer did land inside direct calls
+    assert r['nested'] > 0
+    assert r['duplicated'] == 0
+    assert r['lost'] == 0
+    assert r['dropped'] == 0
+    assert r['counted'] == r['edges']
+
+def test_flood_drops_but_never_miscounts():
+    # far more edges than the consumer can take: the ring overflows, and
+    # the direct calls still return
+    r = stress.run(rate_hz=50000, seconds=0.05)
+    assert r['dropped'] > 0
+    assert r['duplicated'] == 0
+    assert r['lost'] == 0
@@ -0,0 +1,78 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import socket
+import pytest
+from push import Publisher, EPOCH_OFFSET
+
+
+@pytest.fixture
+def sink():
+    '''a UDP collector on loopback, returning (socket, port)'''
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(('127.0.0.1', 0))
+    s.settimeout(2)
+    yield s, s.getsockname()[1]
+    s.close()
+
+def lines(s):
+    return s.recv(2048).decode().splitlines()
+
+def nothing_sent(s):
+    s.settimeout(0.05)
+    try:
+        s.recv(2048)
+    except socket.timeout:
+        return True
+    finally:
+        s.settimeout(2)
+    return False
+
+
+def test_line_protocol(sink):
+    s, port = sink
+    p = Publisher('127.0.0.1', port, name='watermeter,host=kitchen', batch=1)
+    p.sample(1293, 1.9395, 599999990)
+    p.sample(1305, 1.9575, 600000000)
+    assert lines(s) == ['watermeter,host=kitchen pulses=1305i,delta=12i,volume=1.958 {}'.format(
+        (600000000 + EPOCH_OFFSET) * 1000000000)]
+    assert p.sent == 1
+    p.close()
+
+def test_batch_and_interval(sink):
+    s, port = sink
+    p = Publisher('127.0.0.1', port, min_interval=30, batch=3, max_age=1000)
+    p.sample(0, 0, 0)
+    t = 0
+    pulses = 0
+    for _ in range(100):
+        t += 10
+        pulses += 5
+        p.sample(pulses, pulses * 1.5 / 1000, t)
+    # every third sync got through, three to a datagram
+    got = lines(s) + lines(s) + lines(s)
+    # nanoseconds since 1970
+    times = [int(l.rsplit(' ', 1)[1]) // 1000000000 - EPOCH_OFFSET for l in got]
+    assert times == list(range(30, 300, 30))
+    assert all('delta=15i' in l for l in got)
+    p.close()
+
+def test_unchanged_count_not_sent(sink):
+    s, port = sink
+    p = Publisher('127.0.0.1', port, batch=1)
+    p.sample(7, 0.01, 100)
+    p.sample(7, 0.01, 200)
+    assert nothing_sent(s)
+    p.sample(8, 0.012, 300)
+    assert len(lines(s)) == 1
+    p.close()
+
+def test_max_age(sink):
+    s, port = sink
+    p = Publisher('127.0.0.1', port, min_interval=10, batch=6, max_age=60)
+    p.sample(0, 0, 0)
+    p.sample(1, 0, 10)
+    p.sample(2, 0, 20)
+    assert nothing_sent(s)
+    # the oldest line is a minute old at the next sample, changed or not
+    p.sample(2, 0, 70)
+    assert len(lines(s)) == 2
+    p.close()
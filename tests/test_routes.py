@@ -0,0 +1,166 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import json
+import pytest
+import sim
+import httpd
+
+
+class Writer(object):
+
+    def __init__(self):
+        self.data = b''
+
+    def awrite(self, buf, off=0, sz=-1):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        self.data += bytes(buf[off:] if sz < 0 else buf[off:off + sz])
+        return
+        yield
+
+def request(path, qs='', headers=None):
+    '''run a route, returning the head and the body it wrote'''
+    wm = sim.boot()
+    fn = [e[1] for e in wm.app.url_map if e[0] == path][0]
+    req = httpd.Request()
+    req.method = 'GET'
+    req.path = path
+    req.qs = qs
+    req.headers = headers or {}
+    w = Writer()
+    for _ in fn(req, httpd.Response(w)):
+        pass
+    head, _, body = w.data.partition(b'\r\n\r\n')
+    return head.decode(), body
+
+def get(path, qs=''):
+    '''run a route, returning its JSON'''
+    return json.loads(request(path, qs)[1])
+
+
+@pytest.mark.parametrize('qs', ['k=inf', 'k=nan', 'k=-inf', 'mls=inf&pulses=10',
+                                'mls=100&pulses=inf', 'mls=nan&pulses=nan',
+                                'curve=0:1.5,inf:1.6', 'curve=0:nan'])
+def test_calibrate_rejects_non_finite(qs):
+    wm = sim.boot()
+    k = wm.state['ml_per_pulse']
+    r = get('/calibrate', qs)
+    assert r['updated'] is False
+    assert 'msg' in r
+    assert wm.state['ml_per_pulse'] == k
+
+@pytest.mark.parametrize('qs', ['k=1e39', 'k=1e-45', 'mls=1e39&pulses=1',
+                                'mls=1e30&pulses=1e-30', 'curve=0:1e39', 'curve=1e39:1.5'])
+def test_calibrate_rejects_beyond_float32(qs):
+    # ml_per_pulse and the curve are saved as float32
+    wm = sim.boot()
+    k = wm.state['ml_per_pulse']
+    r = get('/calibrate', qs)
+    assert r['updated'] is False
+    assert 'msg' in r
+    assert wm.state['ml_per_pulse'] == k
+    wm.save_state()
+    assert wm.dbh.load()['ml_per_pulse'] == pytest.approx(k)
+
+@pytest.mark.parametrize('arg', ['factor', 'quiet_litres', 'min_litres'])
+@pytest.mark.parametrize('v', ['inf', '-inf', 'nan'])
+def test_alerts_reject_non_finite(arg, v):
+    from alerts import Detector
+    wm = sim.boot()
+    if wm.detector is None:
+        wm.detector = Detector()
+    before = getattr(wm.detector, arg)
+    r = get('/alerts', '{}={}'.format(arg, v))
+    assert r['msg'] == 'unable to process argument'
+    assert getattr(wm.detector, arg) == before
+
+def test_filter_sets_every_channel():
+    from debounce import EdgeFilter
+    wm = sim.boot()
+    saved = wm.edge_filters
+    other = EdgeFilter()
+    other.rejected = 5
+    wm.edge_filters = saved + (other,)
+    try:
+        before = wm.rejected_edges()
+        r = get('/filter', 'holdoff=1500&ratio=3')
+        assert [(f.holdoff_us, f.ratio) for f in wm.edge_filters] == [(1500, 3)] * len(wm.edge_filters)
+        assert r['rejected'] == before
+        assert before >= 5
+        r = get('/filter', 'holdoff=0&ratio=0')
+        assert (other.holdoff_us, other.ratio) == (0, 0)
+    finally:
+        wm.edge_filters = saved
+        for f in saved:
+            f.holdoff_us = f.ratio = 0
+
+def test_filter_off_by_default():
+    from debounce import EdgeFilter
+    f = EdgeFilter()
+    assert (f.holdoff_us, f.ratio) == (0, 0)
+    assert all(f.accept(t) for t in (0, 10, 20, 5000, 5010))
+    assert f.rejected == 0
+
+def test_history_in_unix_time():
+    from clock import EPOCH_OFFSET
+    wm = sim.boot()
+    h = wm.history
+    now = wm.clock.time()
+    last = h._last or 0
+    h.update(last, now)
+    h.update(last + 10, now)
+    u = now + EPOCH_OFFSET
+    hour = now // 3600 * 3600 + EPOCH_OFFSET
+    r = get('/history', 'res=hour')
+    assert r['buckets'][-1][0] == hour
+    assert r['buckets'][-1][1] >= 10
+    # from and to are unix times too
+    r = get('/history', 'res=hour&from={}&to={}'.format(u - 3600, u))
+    assert r['buckets'][-1][0] == hour
+    r = get('/history', 'res=hour&from={}&to={}'.format(u - 86400, hour - 1))
+    assert all(b[0] < hour for b in r['buckets'])
+
+def etag(head):
+    for line in head.split('\r\n'):
+        k, _, v = line.partition(':')
+        if k.lower() == 'etag':
+            return v.strip()
+
+def test_usage_etag_follows_the_curve():
+    from machine import Pin
+    wm = sim.boot()
+    try:
+        assert get('/calibrate', 'curve=0:1.5,10:1.2')['updated']
+        Pin(4).fire(30)
+        head, body = request('/usage')
+        tag = etag(head)
+        before = json.loads(body)['volume']
+        head, body = request('/usage', headers={b'If-None-Match': tag.encode()})
+        assert ' 304 ' in head.split('\r\n')[0]
+        # clearing the curve changes the volume, but not the pulses or k
+        assert get('/calibrate', 'curve=')['updated']
+        head, body = request('/usage', headers={b'If-None-Match': tag.encode()})
+        assert ' 200 ' in head.split('\r\n')[0]
+        assert etag(head) != tag
+        assert json.loads(body)['volume'] != before
+    finally:
+        wm.set_curve([])
+
+def test_history_from_boot():
+    # pulses counted between loading the state and the first history
+    # update are recorded, not taken as the baseline
+    from machine import Pin
+    wm = sim.boot()
+    wm.save_state()
+    # as after a reboot
+    wm.history._last = None
+    wm.load_state()
+    def total():
+        return sum(b[1] for b in get('/history', 'res=minute')['buckets'])
+    before = total()
+    Pin(4).fire(40)
+    wm.pulse_consumer()
+    wm._history_job()
+    Pin(4).fire(5)
+    wm.pulse_consumer()
+    wm._history_job()
+    assert total() - before == 45
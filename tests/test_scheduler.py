@@ -0,0 +1,77 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import logging
+import uasyncio as asyncio
+import scheduler
+from scheduler import Scheduler
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_errors_are_logged():
+    loop = asyncio.new_event_loop()
+    log = Records()
+    scheduler.logger.addHandler(log)
+    try:
+        s = Scheduler()
+        calls = []
+        def bad():
+            calls.append(1)
+            if len(calls) % 2:
+                raise ValueError('bad reading')
+            raise KeyError('usage')
+        bad_task = s.every('bad', 2, bad)
+        good_task = s.every('good', 2, lambda: None)
+        s.start()
+        for _ in range(1000):
+            loop.step()
+            if bad_task.runs >= 4:
+                break
+    finally:
+        scheduler.logger.removeHandler(log)
+        asyncio.new_event_loop()
+
+    # the job kept running, and each exception was counted and logged
+    assert bad_task.runs >= 4
+    assert bad_task.errors == bad_task.runs
+    assert good_task.errors == 0
+    assert bad_task.last_error == repr(KeyError('usage'))
+    assert log.messages[:2] == ["bad: ValueError('bad reading')", "bad: KeyError('usage')"]
+    assert len(log.messages) == bad_task.errors
+
+
+def test_heartbeat():
+    from machine import WDT
+    from sim import utime
+    import sim
+    wm = sim.boot()
+    clk = [0]
+    utime.source = lambda: clk[0]
+    saved = wm.scheduler, wm.doggo
+    try:
+        wm.scheduler = s = Scheduler()
+        wm.doggo = dog = WDT()
+        # the runner of a 1 s job, stepped by hand on a virtual clock
+        run = s._runner(s.every('tick', 1000, lambda: None))
+        next(run)
+        for _ in range(40):
+            clk[0] += 1000000
+            next(run)
+            wm.doggo_treats()
+        assert s.heartbeat == 40000
+        assert dog.feeds == 40
+        # a stuck loop stops the feeding once it has run out of patience
+        for _ in range(40):
+            clk[0] += 1000000
+            wm.doggo_treats()
+        assert dog.feeds == 40 + wm.doggo_patience - 1
+    finally:
+        utime.source = None
+        wm.scheduler, wm.doggo = saved
@@ -0,0 +1,79 @@
+# vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
+import socket
+import threading
+import time
+import sim
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def get(port, path):
+    for _ in range(100):
+        try:
+            c = socket.create_connection(('127.0.0.1', port), timeout=5)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    c.sendall('GET {} HTTP/1.0\r\n\r\n'.format(path).encode())
+    r = b''
+    while True:
+        d = c.recv(4096)
+        if not d:
+            break
+        r += d
+    c.close()
+    return r.partition(b'\r\n\r\n')[2].decode()
+
+
+def test_main_runs_off_device():
+    import json
+    import watermeter as wm
+    import uasyncio as asyncio
+    from machine import Pin
+
+    wm.port = free_port()
+    wm.sntp = sim.sntp
+    result = {}
+    collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    collector.bind(('127.0.0.1', 0))
+    collector.settimeout(5)
+
+    def client():
+        try:
+            before = json.loads(get(wm.port, '/usage'))['pulses']
+            Pin(4).fire(25)
+            result['usage'] = json.loads(get(wm.port, '/usage'))
+            result['before'] = before
+            result['sync'] = json.loads(get(wm.port, '/sync'))
+            # a sample pushed at the next sync, and none at the one after
+            for _ in range(100):
+                if wm.publisher:
+                    break
+                time.sleep(0.05)
+            wm.publisher.sample(wm.pulse_ctr - 1, 0, wm.clock.time() - 60)
+            wm.publisher.sample(wm.pulse_ctr, 0, wm.clock.time())
+            wm.publisher.sample(wm.pulse_ctr + 1, 0, wm.clock.time() + 10)
+            wm.publisher.flush()
+            result['push'] = collector.recv(2048).decode().splitlines()
+        except Exception as e:
+            result['error'] = e
+        finally:
+            asyncio.get_event_loop().stop()
+
+    threading.Thread(target=client, daemon=True).start()
+    # without the edge filter, which would take the burst of edges above
+    # for ringing
+    wm.main(holdoff_us=0, ratio=0,
+            push='127.0.0.1:{}'.format(collector.getsockname()[1]), push_interval=30)
+    collector.close()
+
+    assert 'error' not in result, result['error']
+    assert result['usage']['pulses'] == result['before'] + 25
+    assert result['sync'] == {'msg': 'database saved'}
+    assert wm.dbh.load()['usage'] == wm.pulse_ctr
+    assert len(result['push']) == 1
+    assert result['push'][0].startswith('watermeter,host=')
@@ -1,30 +1,122 @@
 # vim: tabstop=4:softtabstop=4:shiftwidth=4:expandtab:
 from network import WLAN, STA_IF, AP_IF
-import btree
-from ntptime import settime as ntp_settime
-from machine import Pin, I2C, Timer, RTC, WDT, reset, freq
-import usocket as socket
+from machine import Pin, I2C, Timer, RTC, WDT, reset, freq, unique_id
 import time
-import picoweb
 import logging
 import os
-from db import DB_fram as DB
+import gc
+import sys
+import micropython
+import ubinascii
+from array import array
+from db import DB_journal as DB
+from db import DB_curve, FLOAT32_MIN, FLOAT32_MAX
+from flow import FlowRate
+from debounce import EdgeFilter
+from channel import Channel
+# Only what counting pulses needs is imported here. The clock, arbiter and
+# scheduler come in with start_services(), once the IRQ is armed, and the
+# web server, uasyncio, metrics, the JSON writer and the optional modules
+# (curve, alerts, history, discovery, display, push, instrument) where
+# they are first used. Each .mpy loaded takes heap for its bytecode, see
+# the README on freezing them instead.
 
 led_pin = None
 oled = None
+display = None
+display_due = False     # something shown on the OLED changed
+display_interval = 1    # seconds, minimum time between redraws
+display_redraws = 0
 bus = I2C(sda=Pin(5), scl=Pin(4))
-dbh = DB(bus=bus)
+# the FRAM and the OLED share the bus; jobs that use it go through here,
+# see start_services()
+arbiter = None
+
+# FRAM layout: the state journal in the first 8 KB, usage history after it,
+# then a 1 KB journal for each extra channel, and the calibration curve at
+# the top. Opened by open_storage(), as finding the FRAM takes a bus scan.
+fram_kbits = 256
+journal_size = 8192
+channel_journal_size = 1024
+curve_size = 128
+dbh = None
+history = None
+curve_db = None
 
 logger = logging.Logger('watermeter')
 
+class App(object):
+    '''the routes, in the url_map form that httpd.Server and picoweb.WebApp
+    both take, collected without importing either'''
+
+    def __init__(self):
+        self.url_map = []
+
+    def route(self, url, **kwargs):
+        def _route(f):
+            self.url_map.append((url, f, kwargs))
+            return f
+        return _route
+
 # need to create this early so the decorator works
-app = picoweb.WebApp(None)
+app = App()
 
 # global, various functions can share them
 ip = None
 port = 80
 pulse_ctr = 0
 gal_to_l = 3.78541
+# With a calibration curve, see /calibrate?curve=, the volume is added up
+# per batch of pulses in state['volume_ml'], this being the fraction of a
+# ml not yet added. Without one it is pulses * ml_per_pulse.
+curve = None
+vol_frac = 0.0
+# bumped whenever the curve is set or cleared, which changes litres()
+# without changing the pulse count or ml_per_pulse
+curve_gen = 0
+# leak and anomaly rules, fed from pulse_consumer(), set up by main(), see
+# main(alerts=...)
+detector = None
+alert_text = ''         # active alerts, as shown and announced
+# seconds between automatic saves. The journal makes small frequent saves
+# safe, and FRAM endurance is effectively unlimited.
+sync_interval = 10
+# All timestamps come from here rather than the RTC, see ntp_sync() and
+# start_services()
+clock = None
+last_save = 0           # clock.time() of the last save
+http_requests = 0
+publisher = None        # push telemetry, see main(push=...)
+scheduler = None
+profiler = None         # call timing, see main(debug=2) and /debug/stats
+discovery = None
+
+# The pulse ISR only timestamps edges into this preallocated ring; the
+# scheduled pulse_consumer() turns them into counts outside of interrupt
+# context. Nothing in the ISR path allocates. Size must be a power of 2.
+RING_SIZE = 64
+RING_MASK = RING_SIZE - 1
+pulse_ring = array('L', [0] * RING_SIZE)
+pulse_chan = bytearray(RING_SIZE)   # channel of each edge in the ring
+pulse_head = 0          # next slot written by the ISR
+pulse_tail = 0          # next slot read by the consumer
+pulse_drops = 0         # edges lost because the ring was full
+pulse_pending = False   # consumer already scheduled
+pulse_busy = False      # consumer running, see pulse_consumer()
+last_pulse_us = 0       # ticks_us() of the most recently consumed edge
+flow = FlowRate()
+# drops ringing and spikes before they reach the ring, see /filter
+edge_filter = EdgeFilter()
+
+# Extra sensors, see main(channels=...). Channel 0 is the meter above; the
+# pins and filters are indexed by channel number for the ISR.
+channels = []
+channel_pins = ()
+edge_filters = (edge_filter,)
+
+# boot timing, in ticks_ms() which counts from reset
+irq_armed_ms = None
+first_pulse_ms = None
 
 # YF-S402B = 1.5 mlpp
 # FL-308 = 1.28 mlpp
@@ -38,110 +130,319 @@ state = {
 }
 
 
-# Create a station interface and activate it. It'll be used for the device
-# advertisement broadcast. Just in case there was a previous AP configuration
-# drop that interface
-net = WLAN(AP_IF)
-net.active(0)
-net = WLAN(STA_IF)
-net.active(1)
+net = None
 
-# i was getting some watchdog resets after a while. So maybe this can fix it.
-doggo = None
-def doggo_treats(_=None):
-    doggo.feed()
+def start_network():
+    # Create a station interface and activate it. It'll be used for the device
+    # advertisement broadcast. Just in case there was a previous AP configuration
+    # drop that interface
+    global net
+    if net is not None:
+        return
+    net = WLAN(AP_IF)
+    net.active(0)
+    net = WLAN(STA_IF)
+    net.active(1)
 
-def inet_pton(dottedquad):
-    a = list(map(int, dottedquad.strip().split('.')))
-    n = a[0]<<24 | a[1]<<16 | a[2]<<8 | a[3]
-    return n
+def open_storage(extra_gpios=()):
+    global dbh
+    global history
+    global curve_db
+    if dbh is not None:
+        return
+    dbh = DB(bus=bus, device_kbits=journal_size // 128)
+    # the curve and the channel journals are stacked down from the top of
+    # the FRAM, and the history gets what is left. Adding channels shrinks
+    # the history, losing what it held.
+    top = fram_kbits * 128 - curve_size
+    curve_db = DB_curve(bus=bus, memaddr=top)
+    for i in range(len(extra_gpios)):
+        end = top - i * channel_journal_size
+        cdb = DB(bus=bus, memaddr=end - channel_journal_size, device_kbits=end // 128)
+        channels.append(Channel(i + 1, extra_gpios[i], cdb))
+    size = top - len(channels) * channel_journal_size - journal_size
+    from history import History
+    history = History(dbh, journal_size, size)
 
-def inet_ntop(n):
-    a = [n>>24&0xff, n>>16&0xff, n>>8&0xff, n&0xff]
-    return '{:d}.{:d}.{:d}.{:d}'.format(*a)
+# i was getting some watchdog resets after a while. So maybe this can fix it.
+# The timer feeds it only while the scheduler's jobs keep running, so a
+# stuck event loop still gets us reset.
+doggo = None
+doggo_patience = 30     # seconds without a job run before feeding stops
 
-def calculate_broadcast(ip, nm):
-    netaddr = inet_pton(ip) & inet_pton(nm)
-    bcast_host = inet_pton('255.255.255.255') & ~inet_pton(nm)
-    return inet_ntop(netaddr+bcast_host)
+def doggo_treats(_=None):
+    if time.ticks_diff(time.ticks_ms(), scheduler.heartbeat) < ms(s=doggo_patience):
+        doggo.feed()
 
 def send_adv_msg(_=None):
+    # called every second: answers discovery queries, and announces the
+    # device at a backed off interval
     global ip
-    global port
-    i = net.ifconfig()
-    ip = i[0]
-    dst = calculate_broadcast(ip, i[1])
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.bind(('0.0.0.0', port))
-    try:
-        s.sendto(b'watermeter running on http://{}'.format(ip), (dst, 1900))
-    except OSError:
-        pass
-    s.close()
-    logger.info('advertised http://%s to %s', ip, dst)
+    global discovery
+    if discovery is None:
+        from discovery import Discovery
+        discovery = Discovery(net, http_port=port,
+            uuid=ubinascii.hexlify(unique_id()).decode())
+        discovery.set_status(alert_text)
+    global display_due
+    if discovery.poll(clock.time()):
+        logger.info('advertised http://%s to %s', discovery.ip, discovery._dst[0])
+    if ip != discovery.ip:
+        ip = discovery.ip
+        display_due = True
+
+def set_rtc(t):
+    # The RTC is apparently pretty terrible, and nothing here reads it any
+    # more, but keep it near the clock for whatever else uses time.time().
+    # Reading time() also keeps the RTC from overflowing, as documented.
+    time.time()
+    tm = time.localtime(t)
+    RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
 
 def ntp_sync(_=None):
-    # this function is called once an hour by a periodic timer to do two
-    # things. First, avoid an overflow of the ESP8266 RTC by calling time()
-    # as documented (time() and localtime() do some internal compensation)
-    # and then call ntp_settime() to resync the clock which is apparently
-    # pretty terrible
-    if not net.isconnected():
+    # Called every few minutes, but NTP is only asked when the clock wants
+    # another sample, which is less and less often as its rate settles.
+    # The clock slews to NTP instead of stepping, so it never jumps.
+    if not net.isconnected() or not clock.due():
         return False
     try:
-        t = time.time()
         # this could fail if the network isn't available
-        ntp_settime()
-        t = time.time() - t
-        logger.debug('NTP synced, delta %f', t)
+        offset = clock.sample(sntp())
+        logger.debug('NTP offset %d ms, rate %d ppm, next in %d s',
+            offset, clock.ppm, clock.interval)
+        set_rtc(clock.time())
         return True
     except Exception as e:
         logger.warning('NTP Sync failed: %s', e)
         return False
 
+def sntp():
+    from clock import sntp
+    return sntp()
+
+def bootstrap_clock():
+    if clock.time() < state['last_save_time']:
+        # NTP has not set time, bootstrap the clock from the last save
+        clock.set(state['last_save_time'])
+        set_rtc(state['last_save_time'])
+        logger.debug('bootstrapped clock to %d', state['last_save_time'])
+
+def start_services():
+    # what isn't needed to count pulses, which main() starts once the IRQ
+    # is armed
+    global clock
+    global arbiter
+    global scheduler
+    if clock is not None:
+        return
+    from clock import Clock
+    from arbiter import Arbiter
+    from scheduler import Scheduler
+    clock = Clock(time.time())
+    bootstrap_clock()
+    arbiter = Arbiter()
+    scheduler = Scheduler()
+
 def load_state():
     global state
     global pulse_ctr
-
-    rtc = RTC()
-    if time.time() < 500_000_000:
-        # NTP has not set time, bootstrap the clock with default time
-        rtc.datetime(state['last_save_time'])
-        logger.debug('bootstrapped clock to %s', str(state['last_save_time']))
+    global curve
 
     state = dbh.load()
+    if clock is not None:
+        bootstrap_clock()
+
     pulse_ctr = state['usage']
+    # so that the pulses counted before the first history update after
+    # boot are in it
+    history._last = pulse_ctr
+    p = curve_db.load()['points']
+    curve = None
+    if p:
+        from curve import Curve
+        curve = Curve(p)
+    for ch in channels:
+        ch.load()
 
 def save_state():
     global state
     global pulse_ctr
+    global display_due
 
+    pulse_consumer()
     state['usage'] = pulse_ctr
-    dbh.save(state)
+    if curve is None:
+        state['volume_ml'] = int(pulse_ctr * state['ml_per_pulse'])
+    display_due = True  # calibration or units may have changed
+    if not arbiter.submit('state', arbiter.PERSIST, _save_job, 'fram'):
+        logger.debug('bus busy, save queued')
+
+def _save_job():
+    # stamped by the clock, like everything else, rather than the RTC,
+    # which drifts between NTP samples
+    global last_save
+    last_save = clock.time()
+    dbh.save(state, last_save)
     logger.debug('saved database')
-    state['last_save_time'] = time.localtime()
+
+def _history_job():
+    history.update(pulse_ctr, clock.time())
+
+def _channels_job():
+    for ch in channels:
+        if ch.dirty():
+            ch.save(clock.time())
 
 
 def data_sync(_=None):
     logger.debug('auto sync')
+    pulse_consumer()
+    now = clock.time()
+    if detector is not None:
+        detector.check(now)
+        alerts_changed()
+    arbiter.submit('history', arbiter.PERSIST, _history_job, 'fram')
+    for ch in channels:
+        if ch.dirty():
+            arbiter.submit('channels', arbiter.PERSIST, _channels_job, 'fram')
+            break
+    if publisher:
+        publisher.sample(pulse_ctr, litres(), now)
     if pulse_ctr == state['usage']:
         logger.debug('no sync needed')
         return
-    if time.time() - time.mktime(state['last_save_time']) >= 600:
+    if now - last_save >= sync_interval:
         save_state()
     else:
         logger.debug('not yet time to sync')
 
 
-def pulse_handler(_=None):
-    # increment the pulse counter
-    global pulse_ctr
-    global led_pin
-    pulse_ctr += 1
+def pulse_handler(pin=None):
+    # hard IRQ context: record the edge time and get out. No allocation
+    # allowed here, so only small ints and the preallocated ring are used.
+    # Every channel's pin calls this; the pin says which channel it is.
+    global pulse_head
+    global pulse_drops
+    global pulse_pending
+    t = time.ticks_us()
+    c = 0
+    nc = len(channel_pins)
+    while c < nc and channel_pins[c] is not pin:
+        c += 1
+    if c == nc:
+        c = 0
+    if not edge_filters[c].accept(t):
+        return
+    n = (pulse_head + 1) & RING_MASK
+    if n == pulse_tail:
+        pulse_drops += 1
+    else:
+        pulse_ring[pulse_head] = t
+        pulse_chan[pulse_head] = c
+        pulse_head = n
+    if not pulse_pending:
+        try:
+            micropython.schedule(pulse_consumer, None)
+            pulse_pending = True
+        except RuntimeError:
+            # schedule queue is full, the next edge will try again
+            pass
     # eye candy: blink the LED. Maybe.
     if led_pin:
         led_pin.value(led_pin.value()^1)
 
+def pulse_consumer(_=None):
+    # drain the ISR ring into the pulse counter. Runs from the scheduler,
+    # and is also called directly before anything reads pulse_ctr for
+    # persistence. The scheduled call runs at any backward jump, so it can
+    # land inside a direct call; it then leaves the ring alone, as the
+    # drain under way rereads pulse_head and takes the new edges too. An
+    # edge that slips in after that drain's last look waits for the next
+    # edge or the next direct call. A drain takes at most a ring's worth,
+    # so that edges coming faster than they are counted can't keep it
+    # going forever.
+    global pulse_ctr
+    global pulse_tail
+    global pulse_pending
+    global pulse_busy
+    global last_pulse_us
+    global display_due
+    global first_pulse_ms
+    pulse_pending = False
+    if pulse_busy:
+        return
+    pulse_busy = True
+    try:
+        if pulse_tail != pulse_head:
+            display_due = True
+            if first_pulse_ms is None:
+                first_pulse_ms = time.ticks_ms()
+                logger.info('first pulse counted %d ms after reset', first_pulse_ms)
+        n = 0
+        left = RING_SIZE
+        while pulse_tail != pulse_head and left:
+            left -= 1
+            t = pulse_ring[pulse_tail]
+            c = pulse_chan[pulse_tail]
+            pulse_tail = (pulse_tail + 1) & RING_MASK
+            if c:
+                channels[c - 1].pulse(t)
+                continue
+            last_pulse_us = t
+            n += 1
+            flow.update(t)
+        pulse_ctr += n
+        if n:
+            if curve is not None:
+                accumulate(n)
+            if detector is not None:
+                k = ml_per_pulse(flow.hz(last_pulse_us))
+                detector.update(n * k / 1000.0, clock.time())
+                alerts_changed()
+    finally:
+        pulse_busy = False
+
+def alerts_changed():
+    global alert_text
+    global display_due
+    if not detector.changed:
+        return
+    detector.changed = False
+    alert_text = detector.summary()
+    logger.warning('alerts: %s', alert_text or 'clear')
+    display_due = True
+    if discovery:
+        discovery.set_status(alert_text)
+
+def accumulate(n):
+    # add n pulses to the volume at the calibration for the current rate
+    global vol_frac
+    v = n * curve.k(flow.hz(last_pulse_us)) + vol_frac
+    ml = int(v)
+    vol_frac = v - ml
+    state['volume_ml'] += ml
+
+def litres():
+    if curve is None:
+        return pulse_ctr * state['ml_per_pulse'] / 1000.0
+    return (state['volume_ml'] + vol_frac) / 1000.0
+
+def ml_per_pulse(hz=None):
+    # the calibration at a pulse rate, or the mean so far if hz is None
+    if curve is None:
+        return state['ml_per_pulse']
+    if hz is None:
+        return litres() * 1000.0 / pulse_ctr if pulse_ctr else curve.k(0)
+    return curve.k(hz)
+
+def flow_rate(window=False):
+    # current flow in litres or gallons per minute
+    hz = flow.window_hz() if window else flow.hz()
+    v = hz * 60 * ml_per_pulse(hz) / 1000.0
+    if state['metric'] is False:
+        v /= gal_to_l
+    return v
+
 def setup_oled(bus):
     from ssd1306 import SSD1306_I2C
     # this assumes a particular board.
@@ -154,99 +455,582 @@ def setup_oled(bus):
     # using h=32 on a big LCD can be used to create a double height font
     return SSD1306_I2C(128, 32, bus)
 
+# The /usage body and the values behind it. Rebuilt only when the pulse
+# count, calibration, unit or the wall clock second changes, so repeated
+# polls and the OLED share one computation.
+snap_pulses = None
+snap_k = None
+snap_gen = None
+snap_metric = None
+snap_second = None
+snap_volume = 0.0
+snap_unit = 'litre'
+snap_time = None
+snap_body = None
+
+def usage_snapshot():
+    global snap_pulses, snap_k, snap_gen, snap_metric, snap_second
+    global snap_volume, snap_unit, snap_time, snap_body
+    pulse_consumer()
+    now = clock.time()
+    k = state['ml_per_pulse']
+    metric = state['metric']
+    if (snap_pulses == pulse_ctr and snap_k == k and snap_gen == curve_gen
+            and snap_metric == metric and snap_second == now):
+        return snap_body
+
+    snap_pulses = pulse_ctr
+    snap_k = k
+    snap_gen = curve_gen
+    snap_metric = metric
+    snap_second = now
+    snap_unit = 'litre'
+    snap_volume = litres()
+    if metric is False:
+        snap_unit = 'gal'
+        snap_volume /= gal_to_l
+    snap_time = clock.localtime(now)
+
+    # don't scribble over a body that is still being sent
+    if snap_body is None or snap_body.busy:
+        from jsonbuf import JSONWriter
+        snap_body = JSONWriter(128)
+    w = snap_body
+    w.obj()
+    w.key('timestamp').timestamp(snap_time)
+    w.item('unit', snap_unit)
+    w.item('volume', snap_volume)
+    w.item('pulses', snap_pulses)
+    w.item('k', k)
+    w.end()
+    w.release()
+    return w
+
 def oled_output(_=None):
-    doggo_treats() # just in case the OLED is slow
-    u = 'litre'
-    v = pulse_ctr * state['ml_per_pulse'] / 1000.0
+    global display_redraws
+    display_redraws += 1
+    usage_snapshot()
+    u = snap_unit
+    v = snap_volume
+    t = snap_time
+    # only the characters that changed are redrawn and sent over I2C
+    # an alert takes the place of the IP address until it clears
+    display.line(0, "! {}".format(alert_text) if alert_text else "{}".format(ip))
+    display.line(1, "{:02d}/{:02d} {:02d}:{:02d}".format(t[1], t[2], t[3], t[4]))
+    display.line(2, "{:.1f} {}".format(v, u))
+    display.line(3, "{:.2f} {}/min".format(flow_rate(), u[0].upper()))
+    arbiter.submit('oled', arbiter.DISPLAY, display.show, 'oled')
+
+display_minute = None
+
+def display_tick():
+    # Redraw the OLED when something on it changed: new pulses, a unit or
+    # calibration change, a new IP, or the minute rolling over. Runs every
+    # display_interval, so changes are coalesced to at most one redraw
+    # per interval, and an idle meter redraws once a minute.
+    global display_due
+    global display_minute
+    m = clock.time() // 60
+    # keep redrawing while the flow rate decays to zero
+    if display_due or m != display_minute or flow.hz() > 0:
+        display_due = False
+        display_minute = m
+        oled_output()
 
-    if state['metric'] is False:
-        u = 'gallon'
-        v /= gal_to_l
+# Responses are built in this one buffer rather than through a dict and
+# picoweb.jsonify(), to keep polling from churning the heap. It's only held
+# while a response is being sent; a request that arrives meanwhile gets a
+# private writer.
+jw = None
+
+def json_writer():
+    global jw
+    from jsonbuf import JSONWriter
+    if jw is None:
+        jw = JSONWriter()
+    return JSONWriter() if jw.busy else jw
+
+def start_response(resp, content_type, length=None, status='200', headers=None):
+    # routes work under both picoweb and httpd. Only httpd can keep the
+    # connection open, and only if it knows the length of the body.
+    httpd = sys.modules.get('httpd')
+    if httpd and isinstance(resp, httpd.Response):
+        yield from resp.start(content_type, status, length, headers)
+    else:
+        import picoweb
+        yield from picoweb.start_response(resp, content_type, status, headers)
+
+def send_json(resp, w, headers=None):
+    global http_requests
+    http_requests += 1
+    try:
+        yield from start_response(resp, 'application/json', w.n, headers=headers)
+        yield from resp.awrite(w.buf, 0, w.n)
+    finally:
+        w.release()
 
-    t = time.localtime()
-    oled.fill(0)
-    oled.text("{}".format(ip), 0, 0)
-    oled.text("{:02d}/{:02d} {:02d}:{:02d}:{:02d}".format(t[1], t[2], t[3], t[4], t[5]), 0, 8)
-    oled.text("{:.1f} {}".format(v, u), 0, 16)
-    oled.show()
+def send_msg(resp, msg):
+    w = json_writer()
+    w.obj().item('msg', msg).end()
+    yield from send_json(resp, w)
 
 @app.route("/")
 def show_endpoints(req, resp):
-    endpoints = list(
-        filter(lambda x: str(x).startswith('/'),
-            map(lambda x: x[0],
-                app.url_map
-                )
-            )
-        )
-    yield from picoweb.jsonify(resp, endpoints)
+    w = json_writer()
+    w.arr()
+    for e in app.url_map:
+        if isinstance(e[0], str) and e[0].startswith('/'):
+            w.val(e[0])
+    w.end()
+    yield from send_json(resp, w)
 
 
 @app.route("/usage")
 def show_config(req, resp):
-    t = '{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}.{:03d}'.format(*(time.localtime()))
-    u = 'litre'
-    v = pulse_ctr * state['ml_per_pulse'] / 1000.0
+    # The ETag changes only with the pulse count, calibration or unit, so
+    # a poller can skip meters that haven't moved.
+    w = usage_snapshot()
+    tag = '"{}-{}-{}-{:d}"'.format(snap_pulses, snap_k, snap_gen, snap_metric)
+    h = {'ETag': tag}
+    if req.headers.get(b'If-None-Match', b'').decode() == tag:
+        global http_requests
+        http_requests += 1
+        yield from start_response(resp, 'application/json', 0, '304', h)
+        return
+    yield from send_json(resp, w.hold(), h)
 
+
+def channel_json(w, ch):
+    v = ch.litres()
+    u = 'litre'
     if state['metric'] is False:
         u = 'gal'
         v /= gal_to_l
+    w.item('channel', ch.n)
+    w.item('unit', u)
+    w.item('volume', v)
+    w.item('pulses', ch.pulses)
+    w.item('k', ch.state['ml_per_pulse'])
+    w.item('hz', ch.flow.hz())
+
+def show_channel(req, resp):
+    # /usage/<n>, registered for each channel by main()
+    n = int(req.path.rsplit('/', 1)[1])
+    if n == 0:
+        yield from show_config(req, resp)
+        return
+    pulse_consumer()
+    w = json_writer()
+    w.obj()
+    w.key('timestamp').timestamp(clock.localtime())
+    channel_json(w, channels[n - 1])
+    w.end()
+    yield from send_json(resp, w)
+
+@app.route("/channels")
+def show_channels(req, resp):
+    # every channel in one response, channel 0 first
+    pulse_consumer()
+    w = json_writer()
+    w.obj()
+    w.key('timestamp').timestamp(clock.localtime())
+    w.key('channels').sub_arr()
+    w.sub_obj()
+    w.item('channel', 0)
+    w.item('unit', 'litre' if state['metric'] else 'gal')
+    v = litres()
+    w.item('volume', v if state['metric'] else v / gal_to_l)
+    w.item('pulses', pulse_ctr)
+    w.item('k', state['ml_per_pulse'])
+    w.item('hz', flow.hz())
+    w.end()
+    for ch in channels:
+        w.sub_obj()
+        channel_json(w, ch)
+        w.end()
+    w.end()
+    w.end()
+    yield from send_json(resp, w)
+
+
+@app.route("/flow")
+def show_flow(req, resp):
+    pulse_consumer()
+    u = 'l/min'
+    if state['metric'] is False:
+        u = 'gal/min'
 
-    msg = {
-        'timestamp': t,
-        'unit': u,
-        'volume': v,
-        'pulses': pulse_ctr,
-        'k': state['ml_per_pulse'],
-    }
-    yield from picoweb.jsonify(resp, msg)
+    w = json_writer()
+    w.obj()
+    w.item('unit', u)
+    w.item('rate', flow_rate())
+    w.item('window_rate', flow_rate(window=True))
+    w.item('hz', flow.hz())
+    w.end()
+    yield from send_json(resp, w)
+
+
+@app.route("/history")
+def show_history(req, resp):
+    req.parse_qs()
+    res = req.form.get('res', 'hour')
+    if res not in history.resolutions:
+        res = 'hour'
+    s = history.resolutions[res]
+    # the API speaks unix time, the history the device's
+    from clock import EPOCH_OFFSET
+    try:
+        t1 = clock.time()
+        if 'to' in req.form:
+            t1 = int(req.form['to']) - EPOCH_OFFSET
+        t0 = t1 - 24 * s
+        if 'from' in req.form:
+            t0 = int(req.form['from']) - EPOCH_OFFSET
+    except ValueError:
+        yield from send_msg(resp, "'from' and 'to' must be integer timestamps")
+        return
+
+    # with a calibration curve this uses its mean over all pulses so far
+    u = 'litre'
+    k = ml_per_pulse() / 1000.0
+    if state['metric'] is False:
+        u = 'gal'
+        k /= gal_to_l
+
+    # stream the buckets rather than building the whole document
+    global http_requests
+    http_requests += 1
+    yield from start_response(resp, 'application/json')
+    yield from resp.awrite('{{"res": "{}", "unit": "{}", "buckets": ['.format(res, u))
+    sep = ''
+    for t, n in history.query(res, t0, t1):
+        yield from resp.awrite('{}[{}, {}, {:.3f}]'.format(sep, t + EPOCH_OFFSET, n, n * k))
+        sep = ', '
+    yield from resp.awrite(']}')
+
+
+# Only the values are rewritten per scrape, see metrics.Exposition. Keep
+# the order in sync with show_metrics(). Built on the first scrape.
+exposition = None
+
+def metrics_exposition():
+    global exposition
+    if exposition is not None:
+        return exposition
+    from metrics import Exposition
+    exposition = Exposition((
+        ('watermeter_pulses_total', 'counter', 'Pulses counted', 0),
+        ('watermeter_volume_litres_total', 'counter', 'Volume measured', 3),
+        ('watermeter_ml_per_pulse', 'gauge', 'Calibration constant', 4),
+        ('watermeter_last_save_age_seconds', 'gauge', 'Time since state was saved', 0),
+        ('watermeter_heap_free_bytes', 'gauge', 'Free heap', 0),
+        ('watermeter_heap_alloc_bytes', 'gauge', 'Allocated heap', 0),
+        ('watermeter_http_requests_total', 'counter', 'HTTP requests served', 0),
+        ('watermeter_isr_dropped_pulses_total', 'counter', 'Pulses lost to a full ISR ring', 0),
+        ('watermeter_display_redraws_total', 'counter', 'OLED redraws', 0),
+        ('watermeter_display_bytes_total', 'counter', 'Framebuffer bytes sent to the OLED', 0),
+        ('watermeter_i2c_fram_seconds_total', 'counter', 'I2C bus time spent on the FRAM', 6),
+        ('watermeter_i2c_oled_seconds_total', 'counter', 'I2C bus time spent on the OLED', 6),
+        ('watermeter_boot_irq_armed_seconds', 'gauge', 'Time from reset until pulses were counted', 3),
+        ('watermeter_boot_first_pulse_seconds', 'gauge', 'Time from reset to the first pulse, 0 until then', 3),
+        ('watermeter_isr_rejected_edges_total', 'counter', 'Edges rejected by the pulse filters', 0),
+        ('watermeter_clock_offset_seconds', 'gauge', 'Clock offset from NTP at the last sample', 3),
+        ('watermeter_clock_rate_ppm', 'gauge', 'Clock rate correction', 0),
+        ('watermeter_ntp_samples_total', 'counter', 'NTP queries answered', 0),
+        ('watermeter_alerts_active', 'gauge', 'Leak and anomaly alerts raised', 0),
+    ))
+    return exposition
+
+bus_devices = ('fram', 'oled')
+
+@app.route("/metrics")
+def show_metrics(req, resp):
+    global http_requests
+    http_requests += 1
+    pulse_consumer()
+    e = metrics_exposition()
+    e.set(0, pulse_ctr)
+    e.set(1, litres())
+    e.set(2, state['ml_per_pulse'])
+    e.set(3, clock.time() - last_save)
+    e.set(4, gc.mem_free())
+    e.set(5, gc.mem_alloc())
+    e.set(6, http_requests)
+    e.set(7, pulse_drops)
+    e.set(8, display_redraws)
+    e.set(9, display.bytes_sent if display else 0)
+    for i in range(len(bus_devices)):
+        s = arbiter.stats.get(bus_devices[i])
+        e.set(10 + i, s[1] / 1000000 if s else 0)
+    e.set(12, irq_armed_ms / 1000 if irq_armed_ms else 0)
+    e.set(13, first_pulse_ms / 1000 if first_pulse_ms else 0)
+    e.set(14, rejected_edges())
+    e.set(15, clock.last_offset_ms / 1000)
+    e.set(16, clock.ppm)
+    e.set(17, clock.samples)
+    e.set(18, len([r for r in detector.rules if r.active]) if detector else 0)
+    yield from start_response(resp, 'text/plain; version=0.0.4', len(e.buf))
+    yield from resp.awrite(e.buf)
+
+
+@app.route("/tasks")
+def show_tasks(req, resp):
+    w = json_writer()
+    w.arr()
+    for t in scheduler.tasks:
+        n = t.runs or 1
+        w.sub_obj()
+        w.item('name', t.name)
+        w.item('period_ms', t.period)
+        w.item('runs', t.runs)
+        w.item('mean_us', t.run_us // n)
+        w.item('max_us', t.max_us)
+        w.item('mean_late_ms', t.late_ms // n)
+        w.item('max_late_ms', t.max_late_ms)
+        w.item('overruns', t.overruns)
+        w.item('skipped', t.skipped)
+        w.item('errors', t.errors)
+        w.item('last_error', t.last_error)
+        w.end()
+    w.end()
+    yield from send_json(resp, w)
+
+
+@app.route("/debug/stats")
+def show_stats(req, resp):
+    if profiler is None:
+        yield from send_msg(resp, 'profiling disabled, start with main(debug=2)')
+        return
+    w = json_writer()
+    w.obj()
+    w.key('mem_free').sub_obj()
+    w.item('now', profiler.sample_mem())
+    w.item('low', profiler.mem_low)
+    w.item('high', profiler.mem_high)
+    w.end()
+    w.key('calls').sub_arr()
+    for p in profiler.probes:
+        w.sub_obj()
+        w.item('name', p.name)
+        w.item('count', p.count)
+        w.item('min_us', p.min_us)
+        w.item('mean_us', p.total_us // p.count if p.count else 0)
+        w.item('max_us', p.max_us)
+        w.end()
+    w.end()
+    w.end()
+    yield from send_json(resp, w)
 
 
 @app.route("/sync")
 def sync(req, resp):
     save_state()
-    yield from picoweb.jsonify(resp, {'msg': 'database saved'})
+    yield from send_msg(resp, 'database saved')
+
+def finite(s):
+    # float(s), but not 'nan' or 'inf', which float() takes too
+    v = float(s)
+    if v - v != 0:
+        raise ValueError('not a finite number')
+    return v
+
+def bad_k(v):
+    # what is wrong with v as ml_per_pulse, if anything. It is saved as a
+    # float32, which would overflow or round it to 0.
+    if not v > 0.0:
+        return "Calibration constant must be greater than 0.0"
+    if not FLOAT32_MIN <= v <= FLOAT32_MAX:
+        return "Calibration constant out of range"
+    return None
 
 @app.route("/calibrate")
 def calibrate(req, resp):
     global state
-    rv = {'updated': False}
+    updated = False
+    msg = None
 
     req.parse_qs()
-    v = req.form.get('mls', None)
-    n = req.form.get('pulses', None)
+    mls = req.form.get('mls', None)
+    pulses = req.form.get('pulses', None)
     k = req.form.get('k', None)
-    rv['mls'] = v
-    rv['k'] = k
-    rv['pulses'] = n
-    if k:
+    cv = req.form.get('curve', None)
+    # calibrates channel 0 unless ch=<n> picks another one
+    cal = state
+    ch = None
+    try:
+        c = int(req.form.get('ch', 0))
+    except ValueError:
+        c = -1
+    if c < 0 or c > len(channels):
+        msg = "no such channel"
+    elif c:
+        ch = channels[c - 1]
+        cal = ch.state
+    if msg:
+        pass
+    elif cv is not None and ch:
+        msg = "calibration curves are only supported on channel 0"
+    elif cv is not None:
         try:
-            k = float(k)
-            if k > 0.0:
-                state['ml_per_pulse'] = k
-                rv['updated'] = True
+            from curve import Curve
+            p = Curve.parse(cv) if cv else []
+            if len(p) > DB_curve.max_points:
+                msg = "at most {} calibration points".format(DB_curve.max_points)
             else:
-                rv['msg'] = "Calibration constant must be greater than 0.0"
+                set_curve(p)
+                updated = True
         except ValueError:
-            rv['msg'] = "unable to process argument"
-    elif v and n:
+            msg = "curve must be hz:mls_per_pulse pairs separated by commas"
+    elif k:
         try:
-            v = float(v)
-            n = float(n)
+            v = finite(k)
+            msg = bad_k(v)
+            if not msg:
+                cal['ml_per_pulse'] = v
+                updated = True
+        except ValueError:
+            msg = "unable to process argument"
+    elif mls and pulses:
+        try:
+            v = finite(mls)
+            n = finite(pulses)
             if v > 0.0 and n > 0.0:
-                state['ml_per_pulse'] = v/n
-                rv['updated'] = True
+                msg = bad_k(v/n)
             else:
-                rv['msg'] = "Calibration constant must be greater than 0.0"
+                msg = "Calibration constant must be greater than 0.0"
+            if not msg:
+                cal['ml_per_pulse'] = v/n
+                updated = True
         except ValueError:
-            rv['msg'] = "unable to process argument"
+            msg = "unable to process argument"
     else:
-        rv['msg'] = "Must supply either 'k' or 'mls' and 'pulses' parameters to change calibration"
-    rv['ml_per_pulse'] = state['ml_per_pulse']
-    if rv['updated']:
+        msg = "Must supply either 'k', 'mls' and 'pulses', or 'curve' parameters to change calibration"
+    if updated and ch:
+        arbiter.submit('channels', arbiter.PERSIST, lambda: ch.save(clock.time()), 'fram')
+    elif updated:
         save_state()
 
-    yield from picoweb.jsonify(resp, rv)
+    w = json_writer()
+    w.obj()
+    w.item('updated', updated)
+    w.item('mls', mls)
+    w.item('k', k)
+    w.item('pulses', pulses)
+    if msg:
+        w.item('msg', msg)
+    if ch:
+        w.item('ch', ch.n)
+    w.item('ml_per_pulse', cal['ml_per_pulse'])
+    if curve is not None and ch is None:
+        w.key('curve').sub_arr()
+        for h, m in curve.points:
+            w.sub_arr().val(h).val(m).end()
+        w.end()
+    w.end()
+    yield from send_json(resp, w)
+
+def set_curve(points):
+    global curve
+    global curve_gen
+    global vol_frac
+    pulse_consumer()
+    curve_gen += 1
+    if curve is None:
+        # carry on from the volume so far
+        state['volume_ml'] = int(pulse_ctr * state['ml_per_pulse'])
+        vol_frac = 0.0
+    curve = None
+    if points:
+        from curve import Curve
+        curve = Curve(points)
+    arbiter.submit('curve', arbiter.PERSIST, lambda: curve_db.save({'points': points}, clock.time()), 'fram')
+
+@app.route("/alerts")
+def show_alerts(req, resp):
+    # the rules can be adjusted here until reboot, see main(alerts=...)
+    msg = None
+    d = detector
+    if d is None:
+        yield from send_msg(resp, "alerts are not running")
+        return
+    req.parse_qs()
+    f = req.form
+    try:
+        if 'flow_minutes' in f:
+            d.flow_minutes = int(f['flow_minutes'])
+        if 'quiet' in f:
+            a, _, b = f['quiet'].partition('-')
+            d.quiet = (int(a) % 24, int(b) % 24) if a else None
+        if 'quiet_litres' in f:
+            d.quiet_litres = finite(f['quiet_litres'])
+        if 'factor' in f:
+            d.factor = finite(f['factor'])
+        if 'min_litres' in f:
+            d.min_litres = finite(f['min_litres'])
+    except ValueError:
+        msg = "unable to process argument"
+    pulse_consumer()
+    t = clock.time()
+    d.check(t)
+    alerts_changed()
+
+    w = json_writer()
+    w.obj()
+    if msg:
+        w.item('msg', msg)
+    from clock import EPOCH_OFFSET
+    w.key('alerts').sub_arr()
+    for r in d.rules:
+        w.sub_obj()
+        w.item('name', r.name)
+        w.item('active', r.active)
+        w.item('since', r.since + EPOCH_OFFSET if r.active else None)
+        w.item('raised', r.raised)
+        w.item('value', r.value, 2)
+        w.end()
+    w.end()
+    w.item('flow_minutes', d.flow_minutes)
+    w.item('quiet', '{}-{}'.format(*d.quiet) if d.quiet else None)
+    w.item('quiet_litres', d.quiet_litres)
+    w.item('factor', d.factor)
+    w.item('min_litres', d.min_litres)
+    w.item('hour_baseline_litres', d.baseline(t % 86400 // 3600), 2)
+    w.end()
+    yield from send_json(resp, w)
+
+def rejected_edges():
+    n = 0
+    for f in edge_filters:
+        n += f.rejected
+    return n
+
+@app.route("/filter")
+def pulse_filter(req, resp):
+    # every channel has a filter of its own, all set alike
+    msg = None
+    req.parse_qs()
+    try:
+        h = int(req.form.get('holdoff', edge_filter.holdoff_us))
+        r = int(req.form.get('ratio', edge_filter.ratio))
+        if h >= 0 and r >= 0:
+            for f in edge_filters:
+                f.holdoff_us = h
+                f.ratio = r
+        else:
+            msg = "holdoff and ratio must not be negative"
+    except ValueError:
+        msg = "unable to process argument"
+
+    w = json_writer()
+    w.obj()
+    if msg:
+        w.item('msg', msg)
+    w.item('holdoff_us', edge_filter.holdoff_us)
+    w.item('ratio', edge_filter.ratio)
+    w.item('rejected', rejected_edges())
+    w.item('pulses', pulse_ctr)
+    w.end()
+    yield from send_json(resp, w)
 
 @app.route("/metric")
 def go_metric(req, resp):
@@ -254,7 +1038,9 @@ def go_metric(req, resp):
     if not state['metric']:
         state['metric'] = True
         save_state()
-    yield from picoweb.jsonify(resp, {'metric': True})
+    w = json_writer()
+    w.obj().item('metric', True).end()
+    yield from send_json(resp, w)
 
 @app.route("/imperial")
 def no_metric(req, resp):
@@ -262,7 +1048,9 @@ def no_metric(req, resp):
     if state['metric']:
         state['metric'] = False
         save_state()
-    yield from picoweb.jsonify(resp, {'metric': False})
+    w = json_writer()
+    w.obj().item('metric', False).end()
+    yield from send_json(resp, w)
 
 @app.route("/uninstall")
 def uninstall(req=None, resp=None):
@@ -274,7 +1062,7 @@ def uninstall(req=None, resp=None):
     if req is None or resp is None:
         print(msg)
         return
-    yield from picoweb.jsonify(resp, {'msg': msg})
+    yield from send_msg(resp, msg)
 
 @app.route("/install")
 def install(req=None, resp=None):
@@ -285,7 +1073,7 @@ def install(req=None, resp=None):
     if req is None or resp is None:
         print(msg)
         return msg
-    yield from picoweb.jsonify(resp, {'msg': msg})
+    yield from send_msg(resp, msg)
 
 def initconfig(**kwargs):
     '''
@@ -303,6 +1091,8 @@ def initconfig(**kwargs):
     global oled
     global bus
 
+    start_network()
+    open_storage()
     if kwargs.get('pulses', None):
         try:
             n = int(kwargs['pulses'])
@@ -313,8 +1103,8 @@ def initconfig(**kwargs):
 
     if kwargs.get('k', None):
         try:
-            n = float(kwargs['k'])
-            if n > 0:
+            n = finite(kwargs['k'])
+            if not bad_k(n):
                 state['ml_per_pulse'] = n
         except Exception:
             pass
@@ -384,6 +1174,28 @@ def initconfig(**kwargs):
 
     save_state()
 
+def instrument():
+    # replace the hot paths and the routes with timed wrappers. Only done
+    # when asked for, so normally they run with no overhead at all.
+    global profiler
+    global pulse_handler
+    global save_state
+    global oled_output
+    global send_adv_msg
+    global ntp_sync
+    from instrument import Profiler
+    profiler = Profiler()
+    pulse_handler = profiler.wrap_isr('pulse_handler', pulse_handler)
+    save_state = profiler.wrap('save_state', save_state)
+    oled_output = profiler.wrap('oled_output', oled_output)
+    send_adv_msg = profiler.wrap('send_adv_msg', send_adv_msg)
+    ntp_sync = profiler.wrap('ntp_sync', ntp_sync)
+    dbh.load = profiler.wrap('dbh.load', dbh.load)
+    for i in range(len(app.url_map)):
+        e = app.url_map[i]
+        if isinstance(e[0], str):
+            app.url_map[i] = (e[0], profiler.wrap_route(e[0], e[1])) + tuple(e[2:])
+
 def ms(s=None, m=None, h=None):
     t = 0
     if s is not None:
@@ -394,60 +1206,138 @@ def ms(s=None, m=None, h=None):
         t += h * 60 * 60 * 1000
     return t
 
-def main(debug=0):
+def main(debug=0, push=None, server='httpd', holdoff_us=0, ratio=0, gpios=(),
+         alerts=None, push_interval=10):
+    '''
+    Parameters
+        debug (int): 1 for verbose logging, 2 to also time the hot paths
+            and routes, reported on /debug/stats
+        server (str): 'httpd' for the keep-alive server, or 'picoweb'
+        push (str): "host[:port]" of a collector to push usage to over UDP,
+            as InfluxDB line protocol
+        push_interval (int): seconds between pushed samples at least. Usage
+            is sampled at every sync, so no less than sync_interval
+        holdoff_us (int): ignore edges closer than this to the last pulse,
+            0 (the default) to turn this off
+        ratio (int): ignore intervals shorter than 1/ratio of the typical
+            one, 0 (the default) to turn this off
+        gpios (tuple): GPIO numbers of additional flow sensors, which
+            become channels 1, 2, ...
+        alerts (dict): settings for the leak rules, eg.
+            {'flow_minutes': 30, 'quiet': (1, 5)}, see alerts.Detector
+    '''
     global doggo
     global led_pin
-    global oled
-    global dbh
-    global bus
+    global irq_armed_ms
+    global channel_pins
+    global edge_filters
+    global detector
 
     logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    micropython.alloc_emergency_exception_buf(100)
+    open_storage(gpios)
+    for i in range(len(channels) + 1):
+        app.route('/usage/{}'.format(i))(show_channel)
+    if debug >= 2:
+        instrument()
     load_state()
 
+    # Count pulses before anything else: the network, NTP, the display and
+    # the web server come up afterwards, in the background, and water that
+    # flows in the meantime is not lost.
+    dpin = 4 # D2
+    if state['indicator'] == 'oled':
+        dpin = 12 # D6
+    else:
+        logger.debug('using LED blinks')
+        led_pin = Pin(2, Pin.OUT, value=1)
+    # the ISR finds the channel from its pin, so these are set up first
+    pins = [Pin(dpin, Pin.IN, Pin.PULL_UP)]
+    filters = [edge_filter]
+    for ch in channels:
+        pins.append(Pin(ch.gpio, Pin.IN, Pin.PULL_UP))
+        filters.append(ch.filter)
+    for f in filters:
+        f.holdoff_us = holdoff_us
+        f.ratio = ratio
+    channel_pins = tuple(pins)
+    edge_filters = tuple(filters)
+    for p in channel_pins:
+        p.irq(trigger=Pin.IRQ_FALLING, handler=pulse_handler, hard=True)
+    irq_armed_ms = time.ticks_ms()
+    logger.info('counting pulses %d ms after reset, %d bytes free', irq_armed_ms, gc.mem_free())
+
+    start_services()
+    # the rules see the pulses from here on
+    from alerts import Detector
+    detector = Detector(**alerts) if alerts else Detector()
+
+    # the watchdog is fed from a timer, as long as the scheduler's
+    # heartbeat shows the loop is running, see doggo_treats()
+    logger.debug('starting watchdog task')
+    doggo = WDT()
+    wd_timer = Timer(-1)
+    wd_timer.init(period=ms(s=1), mode=Timer.PERIODIC, callback=doggo_treats)
+
+    # Periodic jobs run as tasks on the uasyncio loop alongside the HTTP
+    # server, not in timer callbacks. See /tasks for how they behave.
+    logger.debug('starting data sync task')
+    scheduler.every('sync', ms(s=sync_interval), data_sync, jitter_ms=500, deadline_ms=100)
+    scheduler.start()
+
+    start_network()
+    import uasyncio as asyncio
+    asyncio.get_event_loop().create_task(bring_up(push, push_interval))
+
+    logger.info('starting watermeter app')
+    if server == 'picoweb':
+        import picoweb
+        picoweb.WebApp(None, routes=app.url_map).run(debug=debug, port=port, host='0.0.0.0')
+    else:
+        import httpd
+        httpd.Server(app.url_map).run(port=port)
+
+def bring_up(push, push_interval=10):
+    # everything that isn't needed to count pulses, started once the event
+    # loop is running
+    import uasyncio as asyncio
+    global oled
+    global display
+    global publisher
+
+    if state['indicator'] == 'oled':
+        logger.debug('starting OLED task')
+        oled = setup_oled(bus)
+        from display import Display
+        display = Display(oled)
+        display.clear()
+        scheduler.every('oled', ms(s=display_interval), display_tick, deadline_ms=100)
+
     for i in range(30):
-        logger.debug('waiting for network')
-        time.sleep(2)  # give the wifi time to connect
         if net.isconnected():
             break
+        logger.debug('waiting for network')
+        yield from asyncio.sleep(2)  # give the wifi time to connect
 
     logger.debug('starting NTP task')
     ntp_sync()
-    ntp_timer = Timer(-1)
-    ntp_timer.init(period=ms(m=5), mode=Timer.PERIODIC, callback=ntp_sync)
+    scheduler.every('ntp', ms(m=5), ntp_sync, jitter_ms=ms(s=10), deadline_ms=ms(s=2))
 
     logger.debug('starting device announcement task')
     send_adv_msg()
-    adv_timer = Timer(-1)
-    adv_timer.init(period=ms(m=1), mode=Timer.PERIODIC, callback=send_adv_msg)
+    scheduler.every('adv', ms(s=1), send_adv_msg, deadline_ms=50)
 
     save_state()
 
-    logger.debug('starting watchdog task')
-    doggo = WDT()
-    wd_timer = Timer(-1)
-    wd_timer.init(period=ms(s=1), mode=Timer.PERIODIC, callback=doggo_treats)
-
-    dpin = 4 # D2
-    if state['indicator'] == 'oled':
-        logger.debug('starting OLED task')
-        oled = setup_oled(bus)
-        oled_output()
-        oled_timer = Timer(-1)
-        oled_timer.init(period=ms(s=1), mode=Timer.PERIODIC, callback=oled_output)
-        dpin = 12 # D6
-    else:
-        logger.debug('using LED blinks')
-        led_pin = Pin(2, Pin.OUT, value=1)
-
-    logger.debug('starting data sync task')
-    save_timer = Timer(-1)
-    save_timer.init(period=ms(m=5), mode=Timer.PERIODIC, callback=data_sync)
-
-    data_pin = Pin(dpin, Pin.IN, Pin.PULL_UP)
-    data_irq = data_pin.irq(trigger=Pin.IRQ_FALLING, handler=pulse_handler)
-
-    logger.info('starting watermeter app')
-    app.run(debug=debug, port=port, host='0.0.0.0')
+    if push:
+        h, _, p = push.partition(':')
+        logger.debug('pushing usage to %s', push)
+        from push import Publisher
+        publisher = Publisher(h, int(p) if p else 8089,
+            name='watermeter,host={}'.format(state.get('hostname') or ip),
+            min_interval=push_interval)
+    gc.collect()
+    logger.info('up, %d bytes free', gc.mem_free())
 
 if __name__ == '__main__':
     main()